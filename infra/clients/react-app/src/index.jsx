@@ -229,6 +229,7 @@ function App() {
                   <Select value={algorithm} onChange={e=>setAlgorithm(e.target.value)} fullWidth size="small" sx={{ mb: 2 }}>
                   <MenuItem value="processing_1">Processing 1</MenuItem>
                   <MenuItem value="processing_6">Processing 6</MenuItem>
+                  <MenuItem value="processing_7">Processing 7 (3-D)</MenuItem>
                   </Select>
                   <Button variant="contained" color="secondary" fullWidth onClick={startJob} sx={{ mb: 2, color: '#fff', fontWeight: 700, fontSize:18, py:1.5 }} disabled={status==='waiting' || !clientId}>Start processing</Button>
                   {!clientId && (
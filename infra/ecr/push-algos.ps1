@@ -8,14 +8,19 @@ $repo = "$Account.dkr.ecr.$Region.amazonaws.com/mip-algos"
 # Torna alla root del progetto
 Push-Location (Join-Path $PSScriptRoot "..\..")
 
+# Revisione del codice: diventa CODE_VERSION (chiave della result cache)
+$rev = (git rev-parse --short HEAD)
+
 # Ricostruisci le immagini
 docker build -t mip-base:latest             -f containers/base/Dockerfile .
-docker build -t mip-processing_1             -f containers/processing_1/Dockerfile .
-docker build -t mip-processing_6             -f containers/processing_6/Dockerfile .
+docker build -t mip-processing_1 --build-arg REVISION=$rev -f containers/processing_1/Dockerfile .
+docker build -t mip-processing_6 --build-arg REVISION=$rev -f containers/processing_6/Dockerfile .
+docker build -t mip-processing_7 --build-arg REVISION=$rev -f containers/processing_7/Dockerfile .
 
 # Tag utile per ECR
 docker tag mip-processing_1 "${repo}:processing_1"
 docker tag mip-processing_6 "${repo}:processing_6"
+docker tag mip-processing_7 "${repo}:processing_7"
 
 # Autenticazione a ECR
 aws ecr get-login-password --region $Region |
@@ -24,8 +29,9 @@ aws ecr get-login-password --region $Region |
 # Push su ECR
 docker push "${repo}:processing_1"
 docker push "${repo}:processing_6"
+docker push "${repo}:processing_7"
 
-Write-Host "✅ processing_1 e processing_6 ora in ECR sotto mip-algos ($Region)"
+Write-Host "✅ processing_1, processing_6 e processing_7 ora in ECR sotto mip-algos ($Region)"
 
 # Ritorna nella cartella originale
 Pop-Location
@@ -27,6 +27,7 @@ $resultsQueue = Get-OutputValue $imgOutputs "ResultsQueueUrl"
 $wsEndpoint = Get-OutputValue $imgOutputs "WebSocketEndpoint"
 $req1 = Get-OutputValue $imgOutputs "ImageRequestsQueueUrlprocessing1"
 $req6 = Get-OutputValue $imgOutputs "ImageRequestsQueueUrlprocessing6"
+$req7 = Get-OutputValue $imgOutputs "ImageRequestsQueueUrlprocessing7"
 
 # Recupero dinamico dell'output PacsApiSvcServiceURL*
 $pacsDns = ($pacsOutputs | Where-Object { $_.OutputKey -like "PacsApiSvcServiceURL*" })[0].OutputValue
@@ -44,6 +45,7 @@ $envFile = Join-Path -Path (Get-Location) -ChildPath "gen_env/env.ps1"
 
 `$Env:REQ1_QUEUE         = '$req1'
 `$Env:REQ6_QUEUE         = '$req6'
+`$Env:REQ7_QUEUE         = '$req7'
 "@ | Out-File -FilePath $envFile -Encoding UTF8 -Force
 
 Write-Host "✅ Ho generato env.ps1 in $envFile"
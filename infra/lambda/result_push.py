@@ -1,4 +1,4 @@
-import json, os, boto3, logging
+import json, os, time, boto3, logging
 import aws_embedded_metrics
 
 log = logging.getLogger()
@@ -8,24 +8,52 @@ TABLE = os.environ["CONN_TABLE"]
 api = boto3.client("apigatewaymanagementapi",
                    endpoint_url=os.environ["WS_CALLBACK_URL"])
 
+# latenze per algoritmo dagli istanti (epoch ms) in body["timing"]:
+# router → enqueued, worker → received/published, qui → pushed
+LATENCIES = (
+    ("QueueWaitMs", "enqueued", "received"),    # coda delle richieste (e autoscaling)
+    ("ProcessingMs", "received", "published"),  # worker: fetch + compute + publish
+    ("DeliveryMs", "published", "pushed"),      # RESULT_QUEUE + questa Lambda
+    ("EndToEndMs", "enqueued", "pushed"),
+)
+
+
+@aws_embedded_metrics.metric_scope
+def put_latencies(body, metrics):
+    """Un documento EMF per risultato, dimensione Algo (CloudWatch ne ricava i percentili)."""
+    timing = body.get("timing") or {}
+    metrics.set_namespace("ImagePipeline")
+    metrics.set_dimensions({"Function": "ResultPush", "Algo": body.get("algo_id", "unknown")})
+    for name, start, end in LATENCIES:
+        if start in timing and end in timing:
+            metrics.put_metric(name, max(0, timing[end] - timing[start]), "Milliseconds")
+    metrics.set_property("trace_id", body.get("trace_id"))
+    metrics.set_property("job_id", body.get("job_id"))
+    metrics.set_property("cached", bool(body.get("cached")))
+
+
 @aws_embedded_metrics.metric_scope
 def lambda_handler(event, context, metrics):
     metrics.set_namespace("ImagePipeline")
     metrics.put_dimensions({"Function": "ResultPush"})
     for r in event["Records"]:
         body = json.loads(r["body"])
-        log.info("[result_push] Received body: %s", body)
+        trace_id = body.get("trace_id")
+        log.info("[result_push] trace_id=%s Received body: %s", trace_id, body)
         cid = body["client_id"]
         item = ddb.get_item(TableName=TABLE, Key={"client_id": {"S": cid}}).get("Item")
         if not item:
-            log.warning("No connection found for client_id %s", cid)
+            log.warning("No connection found for client_id %s (trace_id=%s)", cid, trace_id)
             metrics.put_metric("PushFailures", 1, "Count")
             continue
+        if "timing" in body:
+            body["timing"]["pushed"] = int(time.time() * 1000)
         try:
             api.post_to_connection(ConnectionId=item["connectionId"]["S"],
                                    Data=json.dumps(body).encode())
             metrics.put_metric("MessagesPushed", 1, "Count")
+            put_latencies(body)
         except api.exceptions.GoneException:
-            log.warning("Gone – client %s disconnected", cid)
+            log.warning("Gone – client %s disconnected (trace_id=%s)", cid, trace_id)
             ddb.delete_item(TableName=TABLE, Key={"client_id": {"S": cid}})
             metrics.put_metric("Disconnected", 1, "Count")
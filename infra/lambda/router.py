@@ -1,9 +1,21 @@
 import json
 import os
+import time
+import uuid
 import boto3
 
 sqs = boto3.client("sqs")
 QUEUE_URLS = json.loads(os.environ["QUEUE_URLS_JSON"])
+# MiB del task Fargate di ogni algoritmo: un job multi-algoritmo va alla coda
+# del worker più capiente tra i suoi algoritmi (es. processing_7 da 4 GiB)
+TASK_MEMORY = json.loads(os.environ.get("TASK_MEMORY_JSON", "{}"))
+
+
+def target_algo(algo, algos):
+    """Algoritmo della coda a cui inviare il job (a parità di memoria: quello del path)."""
+    if not algos:
+        return algo
+    return max([algo, *algos], key=lambda a: TASK_MEMORY.get(a, 0))
 
 def lambda_handler(event, context):
     try:
@@ -18,9 +30,33 @@ def lambda_handler(event, context):
                 "body": json.dumps({"error":"Unknown algorithm"})
             }
         body = json.loads(event["body"])
+        # job multi-algoritmo: "algos" = lista di ALGO_ID eseguiti sullo
+        # stesso input da un solo worker (vedi target_algo)
+        algos = body.get("algos")
+        if algos is not None and (
+            not isinstance(algos, list) or not algos
+            or any(a not in QUEUE_URLS for a in algos)
+        ):
+            return {
+                "statusCode": 400,
+                "headers": {
+                    "Access-Control-Allow-Origin": "*",
+                    "Access-Control-Allow-Headers": "Content-Type"
+                },
+                "body": json.dumps({"error": "Invalid algos", "algos": algos})
+            }
+        # trace_id comune a tutti i log del job (router → worker → result_push)
+        # e istanti epoch ms dei passaggi, completati dal worker e da result_push
+        body["trace_id"] = body.get("trace_id") or uuid.uuid4().hex
+        body["timing"] = {"enqueued": int(time.time() * 1000)}
+        queue_algo = target_algo(algo, algos)
+        print(json.dumps({
+            "msg": "enqueue", "trace_id": body["trace_id"],
+            "job_id": body.get("job_id"), "algo": algo, "algos": algos, "queue": queue_algo,
+        }))
         msg = json.dumps(body)
         resp = sqs.send_message(
-            QueueUrl=QUEUE_URLS[algo],
+            QueueUrl=QUEUE_URLS[queue_algo],
             MessageBody=msg,
             MessageGroupId=body.get("job_id","default")
         )
@@ -32,7 +68,8 @@ def lambda_handler(event, context):
             },
             "body": json.dumps({
                 "message":"Enqueued",
-                "sqs_message_id":resp["MessageId"]
+                "sqs_message_id":resp["MessageId"],
+                "trace_id":body["trace_id"]
             })
         }
     except Exception as e:
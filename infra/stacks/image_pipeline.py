@@ -30,8 +30,10 @@ class ImagePipeline(Stack):
 
         algos_param = self.node.try_get_context("algos")
         algos = (
-            algos_param.split(",") if algos_param else ["processing_1", "processing_6"]
+            algos_param.split(",") if algos_param else ["processing_1", "processing_6", "processing_7"]
         )
+        # processing_7 tiene in memoria volume, maschera e label 3‑D interi
+        task_memory_mib = {algo: 4096 if algo == "processing_7" else 2048 for algo in algos}
 
         ecr_repo = ecr.Repository.from_repository_name(
             self, "AlgosRepo", "mip-algos"
@@ -148,7 +150,7 @@ class ImagePipeline(Stack):
 
         for algo in algos:
             task = ecs.FargateTaskDefinition(
-                self, f"TaskDef{algo}", cpu=1024, memory_limit_mib=2048
+                self, f"TaskDef{algo}", cpu=1024, memory_limit_mib=task_memory_mib[algo]
             )
             task.add_container(
                 "Main",
@@ -165,7 +167,19 @@ class ImagePipeline(Stack):
                     "ALGO_ID": algo,
                     "PACS_API_BASE": pacs_api_url if pacs_api_url else "",
                     "PACS_API_KEY":  "devkey",
-                    "RESULT_QUEUE": results_q.queue_url  # nome già usato in tutto il codice
+                    "RESULT_QUEUE": results_q.queue_url,  # nome già usato in tutto il codice
+                    # pipeline a stadi: download del job successivo e upload del
+                    # precedente mentre la CPU elabora quello corrente
+                    "FETCH_WORKERS": "2",
+                    "PREFETCH_DEPTH": "2",
+                    "PUBLISH_DEPTH": "2",
+                    # metriche EMF per fase (presign … notify) nei log CloudWatch
+                    "TELEMETRY": "stdout",
+                    "TELEMETRY_SAMPLE": "1.0",
+                    "LOG_LEVEL": "INFO",
+                    # 1 = profilo cProfile/tracemalloc di ogni job accanto al risultato
+                    # (per un solo job: "profile": true nel messaggio)
+                    "PROFILE": "0",
                 },
                 command=["/app/worker.sh"],
             )
@@ -197,7 +211,9 @@ class ImagePipeline(Stack):
             index="router.py",
             handler="lambda_handler",
             environment={
-               "QUEUE_URLS_JSON": json.dumps(queue_url_map)
+               "QUEUE_URLS_JSON": json.dumps(queue_url_map),
+               # i job multi-algoritmo vanno al worker con più memoria
+               "TASK_MEMORY_JSON": json.dumps(task_memory_mib),
             }
         )
         # Lambda di provisioning per /provision
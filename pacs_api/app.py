@@ -53,7 +53,13 @@ def list_images(study_id: str = Path(..., description="Path completo fino allo s
         for obj in page.get("Contents", []):
             if obj["Key"].endswith(".dcm"):
                 url = _signed(obj["Key"])
-                out.append({"url": url, "key": obj["Key"]})
+                # key + etag: identificano il contenuto per la cache dei worker
+                out.append({
+                    "url": url,
+                    "key": obj["Key"],
+                    "etag": obj["ETag"].strip('"'),
+                    "size": obj["Size"],
+                })
     return out
 
 
@@ -62,8 +68,21 @@ def list_images(study_id: str = Path(..., description="Path completo fino allo s
 @app.get("/studies/{study_id:path}/images/{image_path:path}")
 def get_image(
     study_id: str = Path(..., description="Path completo fino allo study, es: liver1/phantomx_abdomen_pelvis_dataset/D55-01"),
-    image_path: str = Path(..., description="Path relativo all'immagine dopo lo study_id, es: 300/AiCE_BODY-SHARP_300_172938.900/IM-0135-0001.dcm")
+    image_path: str = Path(..., description="Path relativo all'immagine dopo lo study_id, es: 300/AiCE_BODY-SHARP_300_172938.900/IM-0135-0001.dcm"),
+    meta: bool = Query(False, description="etag/size (e 404 se manca) con una HEAD su S3: serve alla cache dei worker"),
 ):
     key = f"{study_id}/{image_path}"
-    url = _signed(key)
-    return JSONResponse({"url": url, "expires": (dt.datetime.utcnow() + dt.timedelta(seconds=900)).isoformat()+"Z"})
+    out = {
+        "url": _signed(key),
+        "key": key,
+        "expires": (dt.datetime.utcnow() + dt.timedelta(seconds=900)).isoformat()+"Z",
+    }
+    # la preview presigna slice per slice: niente round-trip S3 se non richiesto
+    if meta:
+        try:
+            head = s3.head_object(Bucket=BUCKET, Key=key)
+        except s3.exceptions.ClientError:
+            raise HTTPException(status_code=404, detail="image not found")
+        out["etag"] = head["ETag"].strip('"')
+        out["size"] = head["ContentLength"]
+    return JSONResponse(out)
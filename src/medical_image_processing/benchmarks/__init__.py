@@ -0,0 +1 @@
+"""Benchmark e controlli di conformità eseguibili con ``python -m``."""
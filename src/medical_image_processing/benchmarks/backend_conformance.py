@@ -0,0 +1,92 @@
+"""Conformità del backend OpenCV rispetto a quello scipy (riferimento).
+
+    python -m medical_image_processing.benchmarks.backend_conformance --slices 20
+
+Per ogni primitiva (e per le maschere finali dei Processor) riporta la
+percentuale di pixel identici, il Dice sulle maschere e i tempi medi.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+
+from medical_image_processing.benchmarks.synthetic import synthetic_hu_slice
+from medical_image_processing.utils.filters import cross_kernel, disk_kernel, get_backend
+
+
+def _agreement(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(np.asarray(a) == np.asarray(b)))
+
+
+def _dice(a: np.ndarray, b: np.ndarray) -> float:
+    a, b = np.asarray(a, bool), np.asarray(b, bool)
+    den = a.sum() + b.sum()
+    return 1.0 if den == 0 else float(2 * (a & b).sum() / den)
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+def _primitives(img: np.ndarray):
+    """(nome, funzione(backend)) sugli input tipici dei due Processor."""
+    img8 = (np.clip(img, 30, 150).astype(np.float32) - 30) / 120 * 255
+    img8 = img8.astype(np.uint8)
+    mask = img > 120
+    return [
+        ("gaussian s=1.5", lambda bk: bk.gaussian(img8, 1.5)),
+        ("closing disk(7)", lambda bk: bk.closing(mask, disk_kernel(7))),
+        ("closing disk(9) x2", lambda bk: bk.closing(mask, disk_kernel(9), iterations=2)),
+        ("opening disk(9)", lambda bk: bk.opening(mask, disk_kernel(9), ignore_border=True)),
+        ("opening cross x2", lambda bk: bk.opening(mask, cross_kernel(2), iterations=2)),
+        ("fill_holes", lambda bk: bk.fill_holes(mask)),
+        ("remove_small_holes", lambda bk: bk.remove_small_holes(mask, 5_000)),
+    ]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--slices", type=int, default=10)
+    ap.add_argument("--size", type=int, default=512)
+    ap.add_argument("--backend", default="opencv")
+    args = ap.parse_args()
+
+    import medical_image_processing.processing  # noqa: F401 - registra gli algoritmi
+    from medical_image_processing.processing.base import Processor
+
+    ref, cand = get_backend("scipy"), get_backend(args.backend)
+    rows: dict[str, list] = {}
+    for z in range(args.slices):
+        img = synthetic_hu_slice(z, args.size, noise=15 + 5 * (z % 4))
+        for name, fn in _primitives(img):
+            a, ta = _timed(fn, ref)
+            b, tb = _timed(fn, cand)
+            rows.setdefault(name, []).append((_agreement(a, b), _dice(a, b) if a.dtype == bool else None, ta, tb))
+        for algo in ("processing_1", "processing_6"):
+            proc = Processor.factory(algo)
+            proc.backend = "scipy"
+            a, ta = _timed(proc.run, img)
+            proc.backend = args.backend
+            b, tb = _timed(proc.run, img)
+            rows.setdefault(f"{algo} mask", []).append(
+                (_agreement(a["mask"], b["mask"]), _dice(a["mask"], b["mask"]), ta, tb)
+            )
+
+    print(f"scipy vs {args.backend}: {args.slices} slice {args.size}x{args.size}")
+    print(f"{'step':<22} {'agree % (min)':>14} {'dice (min)':>11} {'scipy ms':>9} {args.backend + ' ms':>10}")
+    for name, vals in rows.items():
+        agree = min(v[0] for v in vals) * 100
+        dices = [v[1] for v in vals if v[1] is not None]
+        dice = f"{min(dices):.4f}" if dices else "-"
+        ta = np.mean([v[2] for v in vals]) * 1e3
+        tb = np.mean([v[3] for v in vals]) * 1e3
+        print(f"{name:<22} {agree:>14.3f} {dice:>11} {ta:>9.1f} {tb:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Picco di RSS nel caricare una serie: HU float64 (legacy) vs HUVolume compatto.
+
+    python -m medical_image_processing.benchmarks.hu_memory --slices 300
+
+Ogni modalità gira in un processo separato, così il picco misurato
+(``ru_maxrss``) non è inquinato dall'altra.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+MODES = ("legacy", "compact")
+
+
+def _peak_rss_mb() -> float:
+    # Linux: KiB, macOS: byte
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _child(mode: str, folder: Path, algo: str | None) -> dict:
+    import numpy as np
+
+    import medical_image_processing.processing  # noqa: F401 - registra gli algoritmi
+    from medical_image_processing.processing.base import Processor
+    from medical_image_processing.utils.dicom_io import load_series
+
+    baseline = _peak_rss_mb()
+    t0 = time.perf_counter()
+    vol, _ = load_series(sorted(folder.glob("*.dcm")), compact=mode == "compact")
+    load_s = time.perf_counter() - t0
+    if algo:
+        Processor.factory(algo).run(vol)
+    return {
+        "mode": mode,
+        "dtype": str(np.asarray(vol).dtype),
+        "volume_mb": np.asarray(vol).nbytes / 2**20,
+        "baseline_mb": baseline,
+        "peak_mb": _peak_rss_mb(),
+        "load_s": load_s,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--slices", type=int, default=200)
+    ap.add_argument("--size", type=int, default=512)
+    ap.add_argument("--algo", default=None, help="esegue anche il Processor sul volume")
+    ap.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    ap.add_argument("--folder", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(args.child, Path(args.folder), args.algo)))
+        return
+
+    from medical_image_processing.benchmarks.synthetic import write_synthetic_series
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_synthetic_series(tmp, args.slices, args.size)
+        rows = []
+        for mode in MODES:
+            cmd = [sys.executable, "-m", __spec__.name, "--child", mode, "--folder", tmp]
+            if args.algo:
+                cmd += ["--algo", args.algo]
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            rows.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"series: {args.slices}x{args.size}x{args.size}  algo: {args.algo or '-'}")
+    print(f"{'mode':<8} {'dtype':<8} {'volume MB':>10} {'peak RSS MB':>12} {'Δ MB':>8} {'load s':>7}")
+    for r in rows:
+        print(
+            f"{r['mode']:<8} {r['dtype']:<8} {r['volume_mb']:>10.1f} {r['peak_mb']:>12.1f} "
+            f"{r['peak_mb'] - r['baseline_mb']:>8.1f} {r['load_s']:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Dati CT sintetici (addome con “fegato” ellittico) per i benchmark."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+from pydicom.dataset import Dataset, FileDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+
+def synthetic_hu_slice(z: int = 0, size: int = 512, noise: float = 15.0) -> np.ndarray:
+    """Slice HU int16: aria, corpo a 40 HU, fegato ~170 HU in alto a sinistra."""
+    yy, xx = np.mgrid[:size, :size]
+    body = ((xx - size / 2) ** 2 / (0.45 * size) ** 2 + (yy - size / 2) ** 2 / (0.35 * size) ** 2) < 1
+    liver = ((xx - 0.33 * size) ** 2 / (0.2 * size) ** 2 + (yy - 0.45 * size) ** 2 / (0.17 * size) ** 2) < 1
+    hu = np.full((size, size), -1000.0)
+    hu[body] = 40
+    hu[liver] = 170 + 5 * np.sin(z / 3)
+    hu += np.random.default_rng(z).normal(0, noise, hu.shape)
+    return np.round(hu).astype(np.int16)
+
+
+def write_synthetic_series(
+    folder: str | Path,
+    n_slices: int,
+    size: int = 512,
+    *,
+    slope: float = 1.0,
+    intercept: float = -1024.0,
+) -> list[Path]:
+    """Scrive una serie CT sintetica (uint16 + rescale) e restituisce i path."""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    study, series, frame_ref = generate_uid(), generate_uid(), generate_uid()
+    paths = []
+    for z in range(n_slices):
+        raw = (synthetic_hu_slice(z, size) - intercept) / slope
+        raw = np.clip(np.round(raw), 0, 4095).astype(np.uint16)
+
+        meta = Dataset()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        meta.MediaStorageSOPClassUID = CTImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        ds = FileDataset(None, {}, file_meta=meta, preamble=b"\0" * 128)
+        ds.SOPClassUID = CTImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.StudyInstanceUID, ds.SeriesInstanceUID = study, series
+        ds.FrameOfReferenceUID = frame_ref
+        ds.Modality = "CT"
+        ds.PatientID, ds.PatientName = "SYNTH", "Synthetic^Phantom"
+        ds.InstanceNumber = z + 1
+        ds.ImagePositionPatient = [0.0, 0.0, -2.5 * z]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [0.7, 0.7]
+        ds.SliceThickness = 2.5
+        ds.Rows = ds.Columns = size
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+        ds.PixelRepresentation = 0
+        ds.RescaleSlope, ds.RescaleIntercept = slope, intercept
+        ds.PixelData = raw.tobytes()
+
+        path = folder / f"IM-{z + 1:04d}.dcm"
+        ds.save_as(path, enforce_file_format=True)
+        paths.append(path)
+    return paths
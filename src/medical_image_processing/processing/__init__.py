@@ -2,8 +2,10 @@
 
 from .threshold_ccl import ThresholdCCL
 from .liver_cc_simple import LiverCCSimple
+from .liver_volume_3d import LiverVolume3D
 
 __all__ = [
     "ThresholdCCL",
     "LiverCCSimple",
+    "LiverVolume3D",
 ]
@@ -1,18 +1,348 @@
 from __future__ import annotations
 
+import atexit
+import contextlib
+import multiprocessing as mp
+import os
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from multiprocessing import shared_memory
+from typing import Iterable, Iterator
 
 import numpy as np
 
+from medical_image_processing.utils.cpu import cpu_count
+from medical_image_processing.utils.filters import get_backend
+
+
+def volume_workers() -> int:
+    """Processi usati per le serie 3‑D (env PROC_WORKERS, default: CPU del task)."""
+    env = os.environ.get("PROC_WORKERS")
+    if env:
+        return max(1, int(env))
+    return cpu_count()
+
+
+_POOL: ProcessPoolExecutor | None = None
+_POOL_SIZE = 0
+_POOL_LOCK = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Pool di processi condiviso, creato alla prima serie e riusato dopo."""
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_SIZE != workers:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False)
+            # forkserver: sicuro anche se il processo padre ha thread attivi
+            methods = mp.get_all_start_methods()
+            ctx = mp.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if ctx.get_start_method() == "forkserver":
+                ctx.set_forkserver_preload(["medical_image_processing.processing"])
+            _POOL = ProcessPoolExecutor(workers, mp_context=ctx)
+            _POOL_SIZE = workers
+        return _POOL
+
+
+@atexit.register
+def _shutdown_pool() -> None:
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Apre un segmento creato dal padre (che resta l'unico a fare unlink)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13: il resource tracker è quello del padre
+        return shared_memory.SharedMemory(name=name)
+
+
+def _run_chunk(
+    proc: "Processor",
+    in_name: str,
+    out_name: str,
+    shape: tuple[int, ...],
+    dtype: str,
+    z0: int,
+    z1: int,
+) -> list:
+    """Eseguito nei processi del pool: ``_run_2d`` sulle slice [z0, z1)."""
+    shm_in, shm_out = _attach(in_name), _attach(out_name)
+    vol = out = None
+    try:
+        vol = np.ndarray(shape, dtype=dtype, buffer=shm_in.buf)
+        out = np.ndarray(shape, dtype=np.uint8, buffer=shm_out.buf)
+        metas = []
+        for z in range(z0, z1):
+            r = proc._run_2d(vol[z])
+            out[z] = r["mask"]
+            metas.append(r["meta"])
+        return metas
+    finally:
+        vol = out = None  # le view vanno rilasciate prima di close()
+        shm_in.close()
+        shm_out.close()
+
+
+class _SliceRing:
+    """Slot (H,W) in shared memory per le slice in volo di ``run_unordered``.
+
+    Come in ``_run_volume_parallel`` ai worker viaggiano solo i nomi dei
+    segmenti e l'indice dello slot (via ``_run_chunk``), non i pixel.
+    """
+
+    def __init__(self, shape: tuple[int, ...], dtype: np.dtype, slots: int):
+        self.shape = (slots, *shape)
+        self.dtype = np.dtype(dtype)
+        n = int(np.prod(self.shape))
+        self.shm_in = shared_memory.SharedMemory(create=True, size=max(n * self.dtype.itemsize, 1))
+        self.shm_out = shared_memory.SharedMemory(create=True, size=max(n, 1))
+        self.inp = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm_in.buf)
+        self.out = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm_out.buf)
+        self.free = list(range(slots))
+
+    def fits(self, frame: np.ndarray) -> bool:
+        return frame.shape == self.shape[1:] and frame.dtype == self.dtype
+
+    def submit(self, pool: ProcessPoolExecutor, proc: "Processor", frame: np.ndarray):
+        """Copia ``frame`` in uno slot libero e lo manda al pool; (future, slot)."""
+        slot = self.free.pop()
+        self.inp[slot] = frame
+        try:
+            fut = pool.submit(
+                _run_chunk, proc, self.shm_in.name, self.shm_out.name,
+                self.shape, self.dtype.str, slot, slot + 1,
+            )
+        except BaseException:
+            self.free.append(slot)
+            raise
+        return fut, slot
+
+    def take(self, slot: int) -> np.ndarray:
+        """Maschera dello slot (copiata) e slot di nuovo libero."""
+        mask = self.out[slot].copy()
+        self.free.append(slot)
+        return mask
+
+    def close(self) -> None:
+        self.inp = self.out = None  # le view vanno rilasciate prima di close()
+        for shm in (self.shm_in, self.shm_out):
+            shm.close()
+            shm.unlink()
+
 
 class Processor(ABC):
-    """Abstract interface for image processing algorithms."""
+    """Abstract interface for image processing algorithms.
+
+    Le sottoclassi implementano ``_run_2d`` (una slice HU → mask/labels/meta);
+    ``run`` gestisce input 2‑D e serie 3‑D, queste ultime distribuite per
+    slice su un pool di processi tramite shared memory.
+    """
 
     ALGO_ID = "base"
+    VERSION = "1"  # versione dell'algoritmo: parte della chiave della result cache
+    # run_volume = _run_2d slice per slice: una serie si può elaborare in
+    # streaming, man mano che le slice arrivano (vedi run_unordered)
+    PER_SLICE = True
+
+    def cache_params(self) -> dict:
+        """Parametri che determinano l'output (chiave della result cache).
+
+        Default: gli attributi pubblici impostati nel costruttore; il backend
+        dei filtri viene risolto, dato che il default dipende dall'env.
+        """
+        params = {k: v for k, v in vars(self).items() if not k.startswith("_")}
+        if "backend" in params:
+            params["backend"] = get_backend(params["backend"]).name
+        return params
 
-    @abstractmethod
     def run(self, img: np.ndarray, meta: dict | None = None) -> dict:
         """Run the algorithm and return a result dictionary."""
+        img = np.asarray(img)  # HUVolume int16/float32: nessun upcast
+        if img.ndim == 2:  # --- slice 2‑D ---
+            return self._run_2d(img, meta)
+        elif img.ndim == 3:  # --- serie 3‑D ---
+            return self.run_volume(img)
+        else:
+            raise ValueError("Input deve essere 2‑D (H,W) o 3‑D (Z,H,W).")
+
+    @abstractmethod
+    def _run_2d(self, img2d: np.ndarray, meta: dict | None = None) -> dict:
+        """Una slice HU (H,W) → ``{"mask", "labels", "meta"}``.
+
+        Le sottoclassi con ``PER_SLICE = False`` la implementano delegando al
+        percorso volumetrico (volume di una slice).
+        """
+
+    def run_batch(
+        self, images: Iterable[np.ndarray], metas: Iterable[dict | None] | None = None
+    ) -> list[dict]:
+        """Esegue l'algoritmo su slice 2‑D indipendenti (es. job diversi).
+
+        Le slice con stessa shape e dtype vengono impilate e passate a
+        ``_run_stack``, dove le sottoclassi vettorizzano i passi per pixel
+        (finestra, smoothing, soglia); i risultati sono identici a quelli di
+        ``run`` chiamato slice per slice e sono restituiti nello stesso ordine.
+        """
+        images = [np.asarray(img) for img in images]
+        metas = [None] * len(images) if metas is None else list(metas)
+        if len(metas) != len(images):
+            raise ValueError("run_batch: images e metas devono avere la stessa lunghezza")
+        if any(img.ndim != 2 for img in images):
+            raise ValueError("run_batch: solo slice 2‑D (H,W).")
+        groups: dict[tuple, list[int]] = {}
+        for i, img in enumerate(images):
+            groups.setdefault((img.shape, img.dtype.str), []).append(i)
+        results: list[dict | None] = [None] * len(images)
+        for idx in groups.values():
+            stack = np.stack([images[i] for i in idx])
+            for i, r in zip(idx, self._run_stack(stack, [metas[i] for i in idx])):
+                results[i] = r
+        return results
+
+    def _run_stack(self, stack: np.ndarray, metas: list[dict | None]) -> list[dict]:
+        """Default: ``_run_2d`` su ogni slice dello stack (N,H,W)."""
+        return [self._run_2d(img, meta) for img, meta in zip(stack, metas)]
+
+    def iter_run(self, frames: Iterable[np.ndarray]) -> Iterator[dict]:
+        """Esegue ``_run_2d`` su ogni frame man mano che viene decodificato.
+
+        ``frames`` è ad es. ``dicom_io.iter_hu_frames(path)``: la decodifica
+        dei frame successivi procede sul pool mentre si elabora il corrente.
+        """
+        for frame in frames:
+            yield self._run_2d(np.asarray(frame))
+
+    def run_unordered(
+        self, frames: Iterable[np.ndarray], workers: int | None = None, cpu_slot=None
+    ) -> Iterator[tuple[int, np.ndarray, dict]]:
+        """``_run_2d`` su slice che arrivano in ordine qualsiasi (es. download).
+
+        Restituisce ``(indice in frames, mask, meta)`` appena ogni slice è
+        pronta. Con più worker le slice vanno al pool di processi di
+        ``run_volume`` (al più 2×workers in volo, ognuna in uno slot di
+        :class:`_SliceRing`: al pool passano solo indici), mentre ``frames``
+        continua a produrre le successive.
+
+        ``cpu_slot`` (semaforo) è tenuto solo mentre si calcola: per ogni
+        slice, o finché il pool ha slice in volo. In attesa del frame
+        successivo (download) resta libero per gli altri job.
+        """
+        workers = workers or volume_workers()
+        if workers <= 1:
+            for i, frame in enumerate(frames):
+                with cpu_slot or contextlib.nullcontext():
+                    r = self._run_2d(np.asarray(frame))
+                yield i, r["mask"], r["meta"]
+            return
+        pool = _get_pool(workers)
+        pending: dict = {}  # future -> (indice in frames, slot del ring)
+        ring: _SliceRing | None = None
+        lock = threading.Lock()
+        in_flight = 0
+
+        def done(_fut=None) -> None:
+            # ultima slice in volo completata: il pool è fermo, lo slot torna libero
+            nonlocal in_flight
+            with lock:
+                in_flight -= 1
+                idle = in_flight == 0
+            if idle and cpu_slot is not None:
+                cpu_slot.release()
+
+        def collect(finished) -> Iterator[tuple[int, np.ndarray, dict]]:
+            for f in finished:
+                i, slot = pending.pop(f)
+                (meta,) = f.result()
+                yield i, ring.take(slot), meta
+
+        try:
+            for i, frame in enumerate(frames):
+                frame = np.asarray(frame)
+                if ring is None or not ring.fits(frame):
+                    # prima slice, o shape/dtype diversi: si svuota e si rialloca
+                    yield from collect(as_completed(list(pending)))
+                    if ring is not None:
+                        ring.close()
+                        ring = None
+                    ring = _SliceRing(frame.shape, frame.dtype, 2 * workers)
+                with lock:
+                    in_flight += 1
+                    first = in_flight == 1
+                if first and cpu_slot is not None:
+                    cpu_slot.acquire()
+                try:
+                    fut, slot = ring.submit(pool, self, frame)
+                except BaseException:
+                    done()
+                    raise
+                fut.add_done_callback(done)
+                pending[fut] = (i, slot)
+                while len(pending) >= 2 * workers:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from collect(finished)
+            yield from collect(as_completed(list(pending)))
+        finally:
+            for f in pending:
+                f.cancel()
+            # le slice già partite usano ancora i segmenti: si chiudono dopo
+            wait(pending)
+            if ring is not None:
+                ring.close()
+
+    def run_volume(self, vol: np.ndarray, workers: int | None = None) -> dict:
+        """Esegue ``_run_2d`` su ogni slice di ``vol`` (Z,H,W).
+
+        Con più di un worker le slice vengono distribuite a blocchi sul pool
+        di processi: input e maschere passano per shared memory, quindi ai
+        worker viaggiano solo nomi dei segmenti e indici.
+        """
+        vol = np.asarray(vol)
+        workers = min(workers or volume_workers(), vol.shape[0])
+        if workers <= 1:
+            masks = np.empty(vol.shape, dtype=np.uint8)
+            slice_meta = []
+            for z in range(vol.shape[0]):
+                r = self._run_2d(vol[z])
+                masks[z] = r["mask"]
+                slice_meta.append(r["meta"])
+        else:
+            masks, slice_meta = self._run_volume_parallel(vol, workers)
+        return {
+            "mask": masks,
+            "labels": None,  # non servono per ogni slice
+            "meta": {"series": slice_meta, "algo": self.ALGO_ID},
+        }
+
+    def _run_volume_parallel(self, vol: np.ndarray, workers: int) -> tuple[np.ndarray, list]:
+        shm_in = shared_memory.SharedMemory(create=True, size=max(vol.nbytes, 1))
+        shm_out = shared_memory.SharedMemory(create=True, size=max(vol.size, 1))
+        out = None
+        try:
+            np.ndarray(vol.shape, dtype=vol.dtype, buffer=shm_in.buf)[:] = vol
+            out = np.ndarray(vol.shape, dtype=np.uint8, buffer=shm_out.buf)
+            # blocchi più piccoli del numero di worker per bilanciare il carico
+            bounds = np.linspace(0, vol.shape[0], min(vol.shape[0], workers * 4) + 1).astype(int)
+            pool = _get_pool(workers)
+            futs = [
+                pool.submit(
+                    _run_chunk, self, shm_in.name, shm_out.name,
+                    vol.shape, vol.dtype.str, int(z0), int(z1),
+                )
+                for z0, z1 in zip(bounds[:-1], bounds[1:])
+                if z1 > z0
+            ]
+            slice_meta = [m for f in futs for m in f.result()]
+            return out.copy(), slice_meta
+        finally:
+            out = None  # le view vanno rilasciate prima di close()
+            shm_in.close()
+            shm_in.unlink()
+            shm_out.close()
+            shm_out.unlink()
 
     @staticmethod
     def factory(algo_id: str):
@@ -3,18 +3,23 @@ from __future__ import annotations
 
 import numpy as np
 import scipy.ndimage as ndi
-from scipy.ndimage import binary_closing
-from skimage.morphology import disk
-from scipy.ndimage import binary_fill_holes, binary_opening, generate_binary_structure
 
 from .base import Processor
+from medical_image_processing.utils.components import component_stats
+from medical_image_processing.utils.filters import (
+    cross_kernel,
+    disk_kernel,
+    get_backend,
+    windowed_median,
+)
+from medical_image_processing.utils.timing import step
 
 
 class LiverCCSimple(Processor):
     """
     Segmentazione 2‑D del fegato (approccio rapido “notebook‑style”)
     ---------------------------------------------------------------
-      1) Median filter (rumore)
+      1) Median filter (rumore) – veloce su HU quantizzati, vedi windowed_median
       2) Threshold HU > thr (parenchima)
       3) Closing     (chiude fessure)
       4) Fill‑holes  (tappa cavità interne)
@@ -23,6 +28,7 @@ class LiverCCSimple(Processor):
     """
 
     ALGO_ID = "processing_6"
+    VERSION = "1"  # da incrementare quando cambia l'output (invalida la result cache)
 
     def __init__(
         self,
@@ -31,63 +37,67 @@ class LiverCCSimple(Processor):
         close_k: int = 9,  # raggio closing più grande
         min_area_px: int = 25_000,
         side: str = "left",  # 'left' (radiological) o 'right'
+        backend: str | None = None,  # 'scipy' | 'opencv' (default env FILTER_BACKEND)
+        median: str = "fast",  # 'fast' (HU quantizzati, vedi windowed_median) | 'exact'
     ):
         self.thr = thr
         self.med_k = median_k
         self.close_k = close_k
         self.min_area = min_area_px
         self.side = side
-
-    # -------------- main --------------
-    def run(self, img: np.ndarray, meta: dict | None = None) -> dict:
-        if img.ndim == 2:  # --- slice 2‑D ---
-            return self._run_2d(img, meta)
-        elif img.ndim == 3:  # --- serie 3‑D ---
-            masks, slice_meta = [], []
-            for z in range(img.shape[0]):
-                r = self._run_2d(img[z])
-                masks.append(r["mask"])
-                slice_meta.append(r["meta"])
-            return {
-                "mask": np.stack(masks, axis=0),
-                "labels": None,
-                "meta": {"series": slice_meta, "algo": self.ALGO_ID},
-            }
-        else:
-            raise ValueError("Input deve essere 2‑D (H,W) o 3‑D (Z,H,W).")
+        self.backend = backend
+        self.median = median
 
     # ---------- logica originale (leggermente refactor) ----------
     def _run_2d(self, img2d: np.ndarray, meta: dict | None = None) -> dict:
-        img = img2d
+        bk = get_backend(self.backend)
+        with step("threshold"):
+            mask = self._threshold(img2d, bk)
+        return self._segment(mask, img2d.shape, bk)
 
-        # 1) median filter
-        smooth = ndi.median_filter(img, size=self.med_k)
+    def _run_stack(self, stack: np.ndarray, metas: list[dict | None]) -> list[dict]:
+        # quantizzazione/soglia su tutto lo stack, morfologia e CCL per slice
+        bk = get_backend(self.backend)
+        with step("threshold"):
+            masks = self._threshold(stack, bk)
+        return [self._segment(mask, stack.shape[1:], bk) for mask in masks]
 
-        # 2) threshold
-        mask = smooth > self.thr
+    def _threshold(self, img: np.ndarray, bk) -> np.ndarray:
+        """Passi 1‑2 su una slice (H,W) o uno stack (N,H,W) di slice."""
+        # 1) median filter + 2) threshold
+        if self.median == "fast" and self.med_k % 2 == 1:
+            # finestra di 256 HU centrata sulla soglia: esatto per HU interi
+            lo = int(np.floor(self.thr)) - 127
+            smooth8 = windowed_median(img, self.med_k, lo)
+            return smooth8 > (self.thr - lo)
+        if img.ndim == 3:
+            return np.stack([bk.median(im, self.med_k) > self.thr for im in img])
+        return bk.median(img, self.med_k) > self.thr
 
-        # 3) binary closing (chiude solchi vascolari/bordo)
-        footprint = disk(self.close_k)
-        mask = binary_closing(mask, structure=footprint, iterations=2)
+    def _segment(self, mask: np.ndarray, shape: tuple[int, ...], bk) -> dict:
+        from medical_image_processing.utils.liver_select import pick_liver_component
+        from medical_image_processing.utils.morpho import postprocess_mask
 
-        # 4) fill‑holes (tappa cavità interne)
-        mask = binary_fill_holes(mask)
+        with step("morphology"):
+            # 3) binary closing (chiude solchi vascolari/bordo)
+            mask = bk.closing(mask, disk_kernel(self.close_k), iterations=2)
 
-        # 5) tiny opening per togliere granuli isolati
-        struc = generate_binary_structure(2, 1)
-        mask = binary_opening(mask, structure=struc, iterations=2)
+            # 4) fill‑holes (tappa cavità interne)
+            mask = bk.fill_holes(mask)
 
-        from medical_image_processing.utils.liver_select import pick_liver_component
-        from medical_image_processing.utils.morpho import postprocess_mask
+            # 5) tiny opening per togliere granuli isolati
+            mask = bk.opening(mask, cross_kernel(2), iterations=2)
 
-        mask = postprocess_mask(mask.astype(bool), close_r=self.close_k, dims=2)
-        lbl, num = ndi.label(mask)
-        best = pick_liver_component(
-            lbl, img.shape, min_area=self.min_area, side=self.side
-        )
+            mask = postprocess_mask(mask.astype(bool), close_r=self.close_k, dims=2, backend=bk)
+        with step("ccl"):
+            lbl, num = ndi.label(mask)
+            stats = component_stats(lbl, num)
+            best = pick_liver_component(
+                lbl, shape, min_area=self.min_area, side=self.side, stats=stats
+            )
         if best is None:
             return {
-                "mask": np.zeros_like(img, np.uint8),
+                "mask": np.zeros(shape, np.uint8),
                 "labels": lbl.astype(np.int32),
                 "meta": {"msg": "liver not found"},
             }
@@ -97,8 +107,8 @@ class LiverCCSimple(Processor):
             "labels": lbl.astype(np.int32),
             "meta": {
                 "thr": self.thr,
-                "area_px": int((lbl == best).sum()),
+                "area_px": int(stats.area[best - 1]),
                 "label_id": int(best),
-                "components": lbl.max(),
+                "components": int(num),
             },
         }
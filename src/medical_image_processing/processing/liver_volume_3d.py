@@ -0,0 +1,120 @@
+# processing/liver_volume_3d.py          ALGO_ID = "processing_7"
+from __future__ import annotations
+
+import numpy as np
+import scipy.ndimage as ndi
+
+from .base import Processor
+from medical_image_processing.utils.components import component_stats
+from medical_image_processing.utils.filters import cross_kernel
+from medical_image_processing.utils.liver_select import pick_liver_component
+from medical_image_processing.utils.morpho import postprocess_mask
+from medical_image_processing.utils.timing import step
+from medical_image_processing.utils.windowing import apply_window
+
+
+class LiverVolume3D(Processor):
+    """
+    Segmentazione 3‑D del fegato (un solo passaggio sul volume)
+    -----------------------------------------------------------
+      1) finestra soft‑tissue 30‑150 HU  → 8‑bit
+      2) smoothing gauss 3‑D (sigma_z separato per slice spesse)
+      3) threshold fisso
+      4) closing + fill‑holes 3‑D (postprocess_mask dims=3), opening 3‑D
+      5) una sola CCL 3‑D + scelta del fegato sul volume
+
+    A differenza di processing_1/6 la componente è scelta una volta per
+    tutto il volume: niente salti tra slice adiacenti. Un input 2‑D viene
+    trattato come volume di una slice.
+    """
+
+    ALGO_ID = "processing_7"
+    VERSION = "1"  # da incrementare quando cambia l'output (invalida la result cache)
+    PER_SLICE = False  # serve il volume intero: niente streaming per slice
+    WINDOW = (30, 150)  # HU
+
+    def __init__(
+        self,
+        sigma: float = 1.5,
+        sigma_z: float = 1.0,  # in slice: più basso di sigma se le slice sono spesse
+        threshold: int = 110,  # sugli 8‑bit della finestra, come processing_1
+        close_r: int = 3,  # iterazioni closing 6‑connesso
+        open_r: int = 2,  # iterazioni opening 6‑connesso (stacca ponti sottili)
+        min_area_px: int = 20_000,  # per slice: volume minimo = min_area_px × Z …
+        min_volume_vx: int = 100_000,  # … al più questo
+        side: str = "left",
+        max_cx: float = 0.55,
+    ):
+        self.sigma = sigma
+        self.sigma_z = sigma_z
+        self.threshold = threshold
+        self.close_r = close_r
+        self.open_r = open_r
+        self.min_area = min_area_px
+        self.min_volume = min_volume_vx
+        self.side = side
+        self.max_cx = max_cx
+
+    def _run_2d(self, img2d: np.ndarray, meta: dict | None = None) -> dict:
+        res = self._segment_volume(np.asarray(img2d)[None])
+        res["mask"] = res["mask"][0]
+        return res
+
+    def run_volume(self, vol: np.ndarray, workers: int | None = None) -> dict:
+        """Segmentazione volumetrica; ``workers`` è ignorato (un solo passaggio)."""
+        return self._segment_volume(np.asarray(vol))
+
+    def _segment_volume(self, vol: np.ndarray) -> dict:
+        z = vol.shape[0]
+        with step("threshold"):
+            # 1) window + 2) smoothing 3‑D
+            img8 = apply_window(vol, *self.WINDOW)
+            if self.sigma > 0:
+                img8 = ndi.gaussian_filter(img8, (self.sigma_z if z > 1 else 0, self.sigma, self.sigma))
+
+            # 3) threshold
+            mask = img8 > self.threshold
+            del img8
+
+        # 4) morfologia 3‑D; bordo replicato lungo z, altrimenti closing e
+        # opening (bordo a 0) eroderebbero le prime e le ultime slice: ognuno
+        # consuma tante slice quante sono le sue iterazioni
+        pad = self.close_r + self.open_r
+        with step("morphology"):
+            mask = np.pad(mask, ((pad, pad), (0, 0), (0, 0)), mode="edge")
+            mask = postprocess_mask(mask, close_r=self.close_r, dims=3)
+            if self.open_r > 0:
+                mask = ndi.binary_opening(mask, cross_kernel(3), iterations=self.open_r)
+            mask = mask[pad : pad + z]
+
+        # 5) CCL 3‑D + scelta fegato sul volume
+        with step("ccl"):
+            lbl, num = ndi.label(mask)
+            stats = component_stats(lbl, num)
+            best = pick_liver_component(
+                lbl,
+                vol.shape,
+                min_area=min(self.min_volume, self.min_area * z),
+                side=self.side,
+                max_cx=self.max_cx,
+                stats=stats,
+            )
+        if best is None:
+            return {
+                "mask": np.zeros(vol.shape, np.uint8),
+                "labels": None,
+                "meta": {"msg": "liver not found", "algo": self.ALGO_ID, "components": int(num)},
+            }
+        zs = stats.bbox[best - 1][0]
+        return {
+            "mask": (lbl == best).astype(np.uint8),
+            "labels": None,  # volume int32: troppo grande da restituire
+            "meta": {
+                "algo": self.ALGO_ID,
+                "thr": self.threshold,
+                "volume_vx": int(stats.area[best - 1]),
+                "label_id": int(best),
+                "components": int(num),
+                "slices": [int(zs.start), int(zs.stop)],
+            },
+        }
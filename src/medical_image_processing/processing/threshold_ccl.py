@@ -1,14 +1,14 @@
 # processing/threshold_ccl.py       – ALGO_ID = "processing_1"
 from __future__ import annotations
 
-import cv2
 import numpy as np
 import scipy.ndimage as ndi
-from scipy.ndimage import binary_closing
-from skimage.morphology import binary_opening, disk, remove_small_holes
-from scipy.ndimage import binary_fill_holes
 from .base import Processor
+from medical_image_processing.utils.components import component_stats
+from medical_image_processing.utils.filters import disk_kernel, get_backend
 from medical_image_processing.utils.liver_select import pick_liver_component
+from medical_image_processing.utils.timing import step
+from medical_image_processing.utils.windowing import apply_window
 
 
 class ThresholdCCL(Processor):
@@ -23,6 +23,8 @@ class ThresholdCCL(Processor):
     """
 
     ALGO_ID = "processing_1"
+    VERSION = "1"  # da incrementare quando cambia l'output (invalida la result cache)
+    WINDOW = (30, 150)  # HU
 
     def __init__(
         self,
@@ -33,6 +35,7 @@ class ThresholdCCL(Processor):
         close_k: int = 7,
         open_k: int = 9,  # raggio opening più grande
         max_cx: float = 0.55,  # cx max per fegato (radiological LHS)
+        backend: str | None = None,  # 'scipy' | 'opencv' (default env FILTER_BACKEND)
     ):
         self.sigma = sigma
         self.threshold = threshold
@@ -41,63 +44,61 @@ class ThresholdCCL(Processor):
         self.close_k = close_k
         self.open_k = open_k
         self.max_cx = max_cx
-
-    # ----------------------------------------------------
-    def run(self, img: np.ndarray, meta: dict | None = None) -> dict:
-        if img.ndim == 2:  # --- slice 2‑D ---
-            return self._run_2d(img, meta)
-        elif img.ndim == 3:  # --- serie 3‑D ---
-            masks, slice_meta = [], []
-            for z in range(img.shape[0]):
-                r = self._run_2d(img[z])
-                masks.append(r["mask"])
-                slice_meta.append(r["meta"])
-            return {
-                "mask": np.stack(masks, axis=0),
-                "labels": None,  # non servono per ogni slice
-                "meta": {
-                    "series": slice_meta,
-                    "algo": self.ALGO_ID,
-                },
-            }
-        else:
-            raise ValueError("Input deve essere 2‑D (H,W) o 3‑D (Z,H,W).")
+        self.backend = backend
 
     # ---------- logica originale (leggermente refactor) ----------
     def _run_2d(self, img2d: np.ndarray, meta: dict | None = None) -> dict:
-        img = img2d
+        bk = get_backend(self.backend)
+        with step("threshold"):
+            mask = self._threshold(img2d, bk)
+        return self._segment(mask, img2d.shape, bk)
+
+    def _run_stack(self, stack: np.ndarray, metas: list[dict | None]) -> list[dict]:
+        # passi 1‑3 su tutto lo stack, morfologia e CCL slice per slice
+        bk = get_backend(self.backend)
+        with step("threshold"):
+            masks = self._threshold(stack, bk)
+        return [self._segment(mask, stack.shape[1:], bk) for mask in masks]
+
+    def _threshold(self, img: np.ndarray, bk) -> np.ndarray:
+        """Passi 1‑3 (per pixel) su una slice (H,W) o uno stack (N,H,W)."""
         # 1) window soft‑tissue più stretta per escludere muscoli/intestino
-        lo, hi = 30, 150
-        img_win = np.clip(img, lo, hi).astype(np.float32)
-        img8 = ((img_win - lo) / (hi - lo) * 255).astype(np.uint8)
+        img8 = apply_window(img, *self.WINDOW)
 
         # 2) smoothing
         if self.sigma > 0:
-            img8 = ndi.gaussian_filter(img8, self.sigma)
+            if img8.ndim == 3:
+                img8 = bk.gaussian_stack(img8, self.sigma)
+            else:
+                img8 = bk.gaussian(img8, self.sigma)
 
-        # 3) threshold: usa sempre soglia fissa
-        _, mask = cv2.threshold(img8, self.threshold, 255, cv2.THRESH_BINARY)
-        mask = mask.astype(bool)
+        # 3) threshold: usa sempre soglia fissa (come cv2.THRESH_BINARY)
+        return img8 > self.threshold
 
+    def _segment(self, mask: np.ndarray, shape: tuple[int, ...], bk) -> dict:
         # 4) morfologia
-        mask = binary_closing(mask, structure=disk(self.close_k))
-        mask = binary_fill_holes(mask)
-        mask = binary_opening(mask, disk(self.open_k))
-        mask = remove_small_holes(mask, area_threshold=5_000)
+        with step("morphology"):
+            mask = bk.closing(mask, disk_kernel(self.close_k))
+            mask = bk.fill_holes(mask)
+            mask = bk.opening(mask, disk_kernel(self.open_k), ignore_border=True)
+            mask = bk.remove_small_holes(mask, area_threshold=5_000)
 
         # 5) CCL + scelta fegato
-        lbl, _ = ndi.label(mask)
-        best = pick_liver_component(
-            lbl,
-            img.shape,
-            min_area=self.min_area,
-            side=self.side,
-            max_cx=self.max_cx,  # nuovo filtro laterale
-        )
+        with step("ccl"):
+            lbl, num = ndi.label(mask)
+            stats = component_stats(lbl, num)
+            best = pick_liver_component(
+                lbl,
+                shape,
+                min_area=self.min_area,
+                side=self.side,
+                max_cx=self.max_cx,  # nuovo filtro laterale
+                stats=stats,
+            )
 
         if best is None:
             return {
-                "mask": np.zeros_like(img, np.uint8),
+                "mask": np.zeros(shape, np.uint8),
                 "labels": lbl.astype(np.int32),
                 "meta": {"msg": "liver not found"},
             }
@@ -110,7 +111,7 @@ class ThresholdCCL(Processor):
             "meta": {
                 "sigma": self.sigma,
                 "thr": self.threshold,
-                "area_px": int(liver_mask.sum()),
+                "area_px": int(stats.area[best - 1]),
                 "label_id": int(best),
             },
         }
@@ -0,0 +1,79 @@
+# utils/components.py
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+import scipy.ndimage as ndi
+
+# elementi per blocco nel calcolo dei centroidi (limita la memoria su volumi 3‑D)
+_BLOCK_ELEMS = 1 << 22
+
+
+@dataclass
+class ComponentStats:
+    """Statistiche di tutte le label 1..n di un'immagine etichettata (2‑D o 3‑D).
+
+    Gli array sono indicizzati per ``label - 1``; ``centroid`` ha una colonna
+    per asse, nello stesso ordine degli assi dell'array (es. (y, x) in 2‑D).
+    """
+
+    area: np.ndarray
+    centroid: np.ndarray
+    bbox: list
+    perimeter: np.ndarray | None = None
+
+    def __len__(self) -> int:
+        return len(self.area)
+
+
+def _centroids(lbl: np.ndarray, n: int) -> np.ndarray:
+    """Somma delle coordinate per label tramite bincount, a blocchi sull'asse 0."""
+    sums = np.zeros((lbl.ndim, n + 1))
+    step = max(1, _BLOCK_ELEMS // max(1, lbl[0].size))
+    for z0 in range(0, lbl.shape[0], step):
+        block = lbl[z0 : z0 + step]
+        flat = block.ravel()
+        coords = np.indices(block.shape, dtype=np.int32)
+        coords[0] += z0
+        for ax in range(lbl.ndim):
+            sums[ax] += np.bincount(flat, weights=coords[ax].ravel(), minlength=n + 1)[: n + 1]
+    return sums[:, 1:].T
+
+
+def _perimeters(lbl: np.ndarray, n: int) -> np.ndarray:
+    """Numero di facce tra la label e l'esterno, sommato su tutti gli assi.
+
+    In 2‑D coincide con ``np.count_nonzero(np.diff(lbl == lab, axis))``
+    sommato sui due assi (stima 4‑connessa del perimetro).
+    """
+    perim = np.zeros(n + 1, dtype=np.int64)
+    for ax in range(lbl.ndim):
+        a = np.moveaxis(lbl, ax, 0)[:-1]
+        b = np.moveaxis(lbl, ax, 0)[1:]
+        edge = a != b
+        perim += np.bincount(a[edge], minlength=n + 1)[: n + 1]
+        perim += np.bincount(b[edge], minlength=n + 1)[: n + 1]
+    return perim[1:]
+
+
+def component_stats(
+    lbl: np.ndarray, num: int | None = None, *, perimeter: bool = False
+) -> ComponentStats:
+    """Area, centroide, bounding box (e perimetro) di tutte le label in un passaggio."""
+    lbl = np.asarray(lbl)
+    n = int(lbl.max()) if num is None else int(num)
+    if n == 0:
+        return ComponentStats(
+            np.zeros(0, np.int64), np.zeros((0, lbl.ndim)), [],
+            np.zeros(0, np.int64) if perimeter else None,
+        )
+    area = np.bincount(lbl.ravel(), minlength=n + 1)[1 : n + 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid = _centroids(lbl, n) / area[:, None]
+    return ComponentStats(
+        area=area,
+        centroid=centroid,
+        bbox=ndi.find_objects(lbl, max_label=n),
+        perimeter=_perimeters(lbl, n) if perimeter else None,
+    )
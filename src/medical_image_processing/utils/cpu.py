@@ -0,0 +1,33 @@
+# utils/cpu.py
+"""CPU effettivamente disponibili al processo (default di pool e worker)."""
+
+from __future__ import annotations
+
+import math
+import os
+from functools import lru_cache
+
+_CGROUP_CPU_MAX = "/sys/fs/cgroup/cpu.max"  # cgroup v2: "<quota> <period>" o "max <period>"
+
+
+def _cgroup_quota() -> int | None:
+    """CPU concesse dalla quota cgroup v2 (es. task Fargate), None se illimitate."""
+    try:
+        with open(_CGROUP_CPU_MAX) as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        return None
+    if quota == "max":
+        return None
+    return max(1, math.ceil(int(quota) / int(period)))
+
+
+@lru_cache(maxsize=None)
+def cpu_count() -> int:
+    """Minimo tra affinity del processo e quota cgroup (``os.cpu_count`` come ripiego)."""
+    try:
+        n = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n = os.cpu_count() or 1
+    quota = _cgroup_quota()
+    return min(n, quota) if quota is not None else n
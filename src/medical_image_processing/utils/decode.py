@@ -0,0 +1,121 @@
+# utils/decode.py
+"""Decodifica lazy e parallela dei frame DICOM.
+
+``ds.pixel_array`` decodifica tutti i frame di un file (JPEG, JPEG 2000,
+RLE, multi-frame) su un solo core prima di restituire qualcosa. Qui ogni
+frame è decodificato su richiesta (``pydicom.pixels.pixel_array(index=…)``)
+e :func:`iter_frames` distribuisce i frame su un pool di thread condiviso
+restituendoli in ordine; i codec C usati da pydicom (Pillow, pylibjpeg,
+GDCM) rilasciano il GIL durante la decodifica.
+
+Il plugin di pydicom si sceglie con l'env DECODE_PLUGIN (es. ``pillow``,
+``pylibjpeg``, ``gdcm``; vuoto = scelta automatica); un decoder diverso per
+una transfer syntax si registra con :func:`register_codec`.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, TypeVar
+
+import numpy as np
+import pydicom
+from pydicom.pixels import pixel_array
+
+from medical_image_processing.utils.cpu import cpu_count
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+DECODE_PLUGIN = os.environ.get("DECODE_PLUGIN", "")
+
+# transfer syntax UID → fn(ds, index) -> frame grezzo (valori memorizzati)
+_CODECS: dict[str, Callable[[pydicom.Dataset, int], np.ndarray]] = {}
+
+_POOL: ThreadPoolExecutor | None = None
+_POOL_LOCK = threading.Lock()
+
+
+def decode_workers() -> int:
+    """Thread di decodifica (env DECODE_WORKERS, default: CPU del task)."""
+    env = os.environ.get("DECODE_WORKERS")
+    if env:
+        return max(1, int(env))
+    return cpu_count()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(decode_workers(), thread_name_prefix="decode")
+        return _POOL
+
+
+def register_codec(
+    transfer_syntax: str, fn: Callable[[pydicom.Dataset, int], np.ndarray]
+) -> None:
+    """Usa ``fn(ds, index)`` per decodificare i frame con ``transfer_syntax``."""
+    _CODECS[str(transfer_syntax)] = fn
+
+
+def is_compressed(ds: pydicom.Dataset) -> bool:
+    ts = ds.file_meta.get("TransferSyntaxUID")
+    return ts is not None and ts.is_compressed
+
+
+def n_frames(ds: pydicom.Dataset) -> int:
+    return int(getattr(ds, "NumberOfFrames", 1) or 1)
+
+
+def decode_frame(ds: pydicom.Dataset, index: int, plugin: str | None = None) -> np.ndarray:
+    """Decodifica il solo frame ``index`` di ``ds`` (stessi valori di ``pixel_array``)."""
+    fn = _CODECS.get(str(ds.file_meta.get("TransferSyntaxUID", "")))
+    if fn is not None:
+        return fn(ds, index)
+    return pixel_array(ds, index=index, decoding_plugin=plugin or DECODE_PLUGIN)
+
+
+def imap_ordered(
+    fn: Callable[[T], R], items: Iterable[T], workers: int | None = None
+) -> Iterator[R]:
+    """``map`` sul pool di decodifica, in ordine, con al più 2×workers task in volo."""
+    workers = workers or decode_workers()
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+    pool = _get_pool()
+    pending: deque = deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+def iter_frames(
+    ds: pydicom.Dataset,
+    indices: Iterable[int] | None = None,
+    *,
+    plugin: str | None = None,
+    workers: int | None = None,
+) -> Iterator[np.ndarray]:
+    """Frame grezzi di ``ds`` decodificati su richiesta, in parallelo e in ordine."""
+    indices = iter(range(n_frames(ds)) if indices is None else indices)
+    first = next(indices, None)
+    if first is None:
+        return
+    # il primo frame nel thread chiamante: converte una volta sola gli
+    # elementi del dataset, poi i thread li leggono soltanto
+    yield decode_frame(ds, first, plugin)
+    if not is_compressed(ds):
+        workers = 1  # frame nativi: solo una copia di memoria, niente pool
+    yield from imap_ordered(lambda i: decode_frame(ds, i, plugin), indices, workers)
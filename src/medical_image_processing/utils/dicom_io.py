@@ -1,18 +1,368 @@
 from __future__ import annotations
 
+import contextlib
+import io
+import struct
+from dataclasses import dataclass
 from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Union
 
 import numpy as np
 import pydicom
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian
 
+from medical_image_processing.utils.decode import decode_frame, imap_ordered, iter_frames, n_frames
 
-def load_dicom(path: str | Path) -> tuple[np.ndarray, pydicom.Dataset]:
-    """Load a DICOM file and return the pixel data in HU and the full DICOM dataset."""
-    ds = pydicom.dcmread(str(path))
-    img = ds.pixel_array.astype(np.int16)
 
-    slope = getattr(ds, "RescaleSlope", 1.0)
-    intercept = getattr(ds, "RescaleIntercept", 0.0)
-    img = img * slope + intercept
+_PIXEL_DATA_TAG = (0x7FE0, 0x0010)
 
-    return img, ds
+# un file DICOM su disco o già in memoria (es. scaricato in un io.BytesIO)
+Source = Union[str, Path, BinaryIO]
+
+
+def _is_buffer(src: Source) -> bool:
+    return hasattr(src, "read")
+
+
+@contextlib.contextmanager
+def _open(src: Source):
+    """File aperto in lettura; i buffer vengono riavvolti e lasciati aperti."""
+    if _is_buffer(src):
+        src.seek(0)
+        yield src
+    else:
+        with open(src, "rb") as fp:
+            yield fp
+
+
+def _dcmread(src: Source, **kwargs) -> pydicom.Dataset:
+    if _is_buffer(src):
+        src.seek(0)
+        return pydicom.dcmread(src, **kwargs)
+    return pydicom.dcmread(str(src), **kwargs)
+
+
+@dataclass
+class HUVolume:
+    """HU image or volume in a compact dtype, with the rescale that produced it.
+
+    ``data`` è int16 quando slope/intercept sono interi e gli HU possibili
+    (da BitsStored) stanno in int16, caso tipico CT; float32 altrimenti.
+    Si comporta come un array in lettura (``np.asarray``,
+    ``shape``, indicizzazione) senza copie né upcast.
+    """
+
+    data: np.ndarray
+    slope: float = 1.0
+    intercept: float = 0.0
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None or np.dtype(dtype) == self.data.dtype:
+            return self.data.copy() if copy else self.data
+        return self.data.astype(dtype)
+
+    def __getitem__(self, idx):
+        return self.data[idx]
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.data.shape
+
+    @property
+    def ndim(self) -> int:
+        return self.data.ndim
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.data.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+
+def _rescale(ds: pydicom.Dataset) -> tuple[float, float]:
+    return (
+        float(getattr(ds, "RescaleSlope", 1.0)),
+        float(getattr(ds, "RescaleIntercept", 0.0)),
+    )
+
+
+_INT16 = np.iinfo(np.int16)
+
+
+def _stored_range(ds: pydicom.Dataset) -> tuple[int, int]:
+    """Valori grezzi possibili secondo BitsStored/PixelRepresentation, dopo il cast a int16."""
+    bits = int(getattr(ds, "BitsStored", 16) or 16)
+    if getattr(ds, "PixelRepresentation", 0) == 1:
+        lo, hi = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    else:
+        lo, hi = 0, (1 << bits) - 1
+    if lo < _INT16.min or hi > _INT16.max:
+        return int(_INT16.min), int(_INT16.max)  # uint16 pieno: il cast a int16 copre tutto
+    return lo, hi
+
+
+def _fits_int16(lo: float, hi: float, slope: float, intercept: float) -> bool:
+    """True se ``raw * slope`` e ``raw * slope + intercept`` restano in int16 per raw in [lo, hi]."""
+    scaled = (lo * slope, hi * slope)
+    ends = (*scaled, scaled[0] + intercept, scaled[1] + intercept)
+    return _INT16.min <= min(ends) and max(ends) <= _INT16.max
+
+
+def hu_dtype(ds: pydicom.Dataset) -> np.dtype:
+    """int16 se la rescale è intera e gli HU possibili stanno in int16, altrimenti float32.
+
+    Es. padding -32768 con intercept -1024 (CT signed a 16 bit) darebbe
+    -33792: in int16 diventerebbe +31744 (osso al posto dell'aria).
+    """
+    slope, intercept = _rescale(ds)
+    if (
+        float(slope).is_integer()
+        and float(intercept).is_integer()
+        and _fits_int16(*_stored_range(ds), slope, intercept)
+    ):
+        return np.dtype(np.int16)
+    return np.dtype(np.float32)
+
+
+def _to_hu(raw: np.ndarray, slope: float, intercept: float, out: np.ndarray) -> np.ndarray:
+    """Scrive ``raw * slope + intercept`` in ``out`` senza passare da float64."""
+    # stesso cast a int16 dei pixel grezzi fatto da load_dicom
+    raw = raw.astype(np.int16, copy=False)
+    if out.dtype == np.int16 and (slope != 1 or intercept != 0):
+        if not _fits_int16(raw.min(), raw.max(), slope, intercept):
+            # pixel fuori da BitsStored (header incoerente): saturazione esplicita
+            hu = raw.astype(np.int32) * int(slope) + int(intercept)
+            return np.clip(hu, _INT16.min, _INT16.max, out=out, casting="unsafe")
+    np.copyto(out, raw, casting="unsafe")
+    if slope != 1:
+        np.multiply(out, out.dtype.type(slope), out=out, casting="unsafe")
+    if intercept != 0:
+        np.add(out, out.dtype.type(intercept), out=out, casting="unsafe")
+    return out
+
+
+def load_dicom(
+    path: Source, *, compact: bool = False
+) -> tuple[np.ndarray | HUVolume, pydicom.Dataset]:
+    """Load a DICOM file and return the pixel data in HU and the full DICOM dataset.
+
+    Con ``compact=True`` restituisce un :class:`HUVolume` int16/float32
+    invece dell'array float64. I file compressi o multi-frame sono decodificati
+    frame per frame in parallelo (``utils.decode``) direttamente nell'output.
+    ``path`` può essere anche un buffer in memoria (``io.BytesIO``).
+    """
+    ds = _dcmread(path)
+    slope, intercept = _rescale(ds)
+    dtype = hu_dtype(ds) if compact else np.float64
+    n = n_frames(ds)
+
+    out = None
+    for z, raw in enumerate(iter_frames(ds)):
+        if out is None:
+            out = np.empty(raw.shape if n == 1 else (n, *raw.shape), dtype=dtype)
+        dst = out if n == 1 else out[z]
+        if compact:
+            _to_hu(raw, slope, intercept, dst)
+        else:
+            np.multiply(raw.astype(np.int16, copy=False), slope, out=dst)
+            dst += intercept
+
+    if compact:
+        return HUVolume(out, slope, intercept), ds
+    return out, ds
+
+
+def iter_hu_frames(path: Source, *, compact: bool = True) -> Iterator[np.ndarray]:
+    """Frame HU di un file (anche multi-frame/compresso), decodificati su richiesta.
+
+    Permette ai Processor di partire dal primo frame senza aspettare la
+    decodifica dell'intero file (vedi ``Processor.iter_run``).
+    """
+    ds = _dcmread(path)
+    slope, intercept = _rescale(ds)
+    dtype = hu_dtype(ds) if compact else np.float64
+    for raw in iter_frames(ds):
+        out = np.empty(raw.shape, dtype=dtype)
+        if compact:
+            yield _to_hu(raw, slope, intercept, out)
+        else:
+            np.multiply(raw.astype(np.int16, copy=False), slope, out=out)
+            out += intercept
+            yield out
+
+
+def _slice_sort_keys(headers: list[pydicom.Dataset]) -> list[float]:
+    """Posizione di ogni slice lungo la normale al piano (fallback InstanceNumber)."""
+    try:
+        iop = np.asarray(headers[0].ImageOrientationPatient, dtype=float)
+        normal = np.cross(iop[:3], iop[3:])
+        keys = [float(np.dot(normal, h.ImagePositionPatient)) for h in headers]
+    except AttributeError:
+        return [float(getattr(h, "InstanceNumber", i)) for i, h in enumerate(headers)]
+    if len(set(keys)) < len(keys):  # posizioni duplicate: non affidabili
+        return [float(getattr(h, "InstanceNumber", i)) for i, h in enumerate(headers)]
+    # stesso verso dell'ordinamento per InstanceNumber usato finora
+    inst = [getattr(h, "InstanceNumber", None) for h in headers]
+    if None not in inst and len(headers) > 1:
+        lo, hi = int(np.argmin(keys)), int(np.argmax(keys))
+        if int(inst[lo]) > int(inst[hi]):
+            keys = [-k for k in keys]
+    return keys
+
+
+def _native_pixel_offset(fp, ds: pydicom.Dataset) -> int | None:
+    """Offset dei byte di PixelData nativi, con ``fp`` fermo sul tag (stop_before_pixels).
+
+    Restituisce None se i pixel non sono leggibili direttamente (compressi,
+    big endian, multi-frame, colore): in quel caso si passa da pydicom.
+    """
+    ts = ds.file_meta.get("TransferSyntaxUID")
+    if ts not in (ExplicitVRLittleEndian, ImplicitVRLittleEndian):
+        return None
+    if int(getattr(ds, "NumberOfFrames", 1) or 1) != 1 or ds.SamplesPerPixel != 1:
+        return None
+    if ds.BitsAllocated not in (8, 16):
+        return None
+    hdr = fp.read(8)
+    if len(hdr) < 8 or struct.unpack("<HH", hdr[:4]) != _PIXEL_DATA_TAG:
+        return None
+    if ts == ExplicitVRLittleEndian:
+        if hdr[4:6] not in (b"OB", b"OW"):
+            return None
+        length = struct.unpack("<I", fp.read(4))[0]
+    else:
+        length = struct.unpack("<I", hdr[4:8])[0]
+    if length == 0xFFFFFFFF or length < ds.Rows * ds.Columns * ds.BitsAllocated // 8:
+        return None
+    return fp.tell()
+
+
+def _read_native_frame(path: Source, offset: int, ds: pydicom.Dataset) -> np.ndarray:
+    """Legge un frame nativo direttamente dal file, senza ri-parsare l'header.
+
+    Per i buffer in memoria il frame è una view sui byte scaricati (nessuna copia).
+    """
+    signed = ds.PixelRepresentation == 1
+    dtype = {8: (np.uint8, np.int8), 16: (np.uint16, np.int16)}[ds.BitsAllocated][signed]
+    dtype = np.dtype(dtype).newbyteorder("<")
+    if isinstance(path, io.BytesIO):
+        arr = np.frombuffer(path.getbuffer(), dtype=dtype, count=ds.Rows * ds.Columns, offset=offset)
+    else:
+        with _open(path) as f:
+            f.seek(offset)
+            arr = np.fromfile(f, dtype=dtype, count=ds.Rows * ds.Columns)
+    arr = arr.reshape(ds.Rows, ds.Columns)
+    if signed and ds.BitsStored < ds.BitsAllocated:
+        # estensione del segno dai BitsStored, come fa pydicom
+        shift = ds.BitsAllocated - ds.BitsStored
+        arr = (arr << shift) >> shift
+    return arr
+
+
+def load_series(
+    paths: Iterable[Source], *, compact: bool = False
+) -> tuple[np.ndarray | HUVolume, list[pydicom.Dataset]]:
+    """Load a series into a (Z, H, W) HU volume with a single header parse per file.
+
+    Gli header vengono letti una volta sola (``stop_before_pixels``) e usati
+    per ordinare le slice per ``ImagePositionPatient`` (o ``InstanceNumber``);
+    i pixel vengono poi decodificati direttamente nel volume preallocato.
+    Restituisce il volume e gli header nello stesso ordine delle slice.
+    Con ``compact=True`` il volume è un :class:`HUVolume` int16/float32.
+    ``paths`` può contenere anche buffer in memoria (``io.BytesIO``).
+    """
+    entries = []
+    for p in paths:
+        with _open(p) as fp:
+            ds = pydicom.dcmread(fp, stop_before_pixels=True)
+            offset = _native_pixel_offset(fp, ds)
+        entries.append((p, ds, offset))
+    if not entries:
+        raise ValueError("load_series: nessun file nella serie")
+
+    keys = _slice_sort_keys([e[1] for e in entries])
+    entries = [e for _, e in sorted(zip(keys, entries), key=lambda ke: ke[0])]
+
+    rows, cols = entries[0][1].Rows, entries[0][1].Columns
+    rescales = [_rescale(e[1]) for e in entries]
+    if compact:
+        # int16 solo se per tutte le slice la rescale è intera e gli HU ci stanno
+        dtype = np.result_type(*(hu_dtype(e[1]) for e in entries))
+    else:
+        dtype = np.float64
+    vol = np.empty((len(entries), rows, cols), dtype=dtype)
+    for p, ds, _ in entries:
+        if (ds.Rows, ds.Columns) != (rows, cols):
+            raise ValueError(f"load_series: slice {p} ha dimensioni diverse")
+
+    def read(entry) -> np.ndarray:
+        p, ds, offset = entry
+        if offset is not None:
+            return _read_native_frame(p, offset, ds)
+        # slice compresse (o non leggibili direttamente): pool di decodifica
+        return decode_frame(_dcmread(p), 0)
+
+    for z, raw in enumerate(imap_ordered(read, entries)):
+        slope, intercept = rescales[z]
+        if compact:
+            _to_hu(raw, slope, intercept, vol[z])
+        else:
+            np.multiply(raw.astype(np.int16, copy=False), slope, out=vol[z])
+            vol[z] += intercept
+    headers = [e[1] for e in entries]
+    if compact:
+        slope, intercept = rescales[0]
+        return HUVolume(vol, slope, intercept), headers
+    return vol, headers
+
+
+def _read_slice(path: Source, compact: bool) -> tuple[np.ndarray, pydicom.Dataset]:
+    with _open(path) as fp:
+        ds = pydicom.dcmread(fp, stop_before_pixels=True)
+        offset = _native_pixel_offset(fp, ds)
+    raw = _read_native_frame(path, offset, ds) if offset is not None else decode_frame(_dcmread(path), 0)
+    slope, intercept = _rescale(ds)
+    out = np.empty(raw.shape, dtype=hu_dtype(ds) if compact else np.float64)
+    if compact:
+        return _to_hu(raw, slope, intercept, out), ds
+    np.multiply(raw.astype(np.int16, copy=False), slope, out=out)
+    out += intercept
+    return out, ds
+
+
+def iter_series(
+    paths: Iterable[Source], *, compact: bool = True
+) -> Iterator[tuple[np.ndarray, pydicom.Dataset]]:
+    """Slice HU e header di una serie nell'ordine in cui arrivano i ``paths``.
+
+    A differenza di :func:`load_series` non aspetta l'intera serie: ogni file
+    (ad es. appena scaricato) viene decodificato sul pool di decodifica e
+    restituito subito. L'ordine spaziale si ricostruisce con :func:`stack_series`.
+    """
+    yield from imap_ordered(lambda p: _read_slice(p, compact), paths)
+
+
+def stack_series(
+    frames: list[np.ndarray], headers: list[pydicom.Dataset]
+) -> tuple[HUVolume, list[pydicom.Dataset], list[int]]:
+    """Impila le slice di :func:`iter_series` nell'ordine di :func:`load_series`.
+
+    Restituisce volume, header ordinati e ``order`` (indici in ``frames``),
+    per riordinare allo stesso modo dati calcolati per slice.
+    """
+    if not frames:
+        raise ValueError("stack_series: nessuna slice nella serie")
+    if len({f.shape for f in frames}) > 1:
+        raise ValueError("stack_series: slice con dimensioni diverse")
+    keys = _slice_sort_keys(headers)
+    order = sorted(range(len(frames)), key=lambda i: keys[i])
+    vol = np.empty((len(frames), *frames[0].shape), dtype=np.result_type(*(f.dtype for f in frames)))
+    for z, i in enumerate(order):
+        vol[z] = frames[i]
+    slope, intercept = _rescale(headers[order[0]])
+    return HUVolume(vol, slope, intercept), [headers[i] for i in order], order
@@ -1,33 +1,173 @@
 from __future__ import annotations
 
+import contextlib
+import itertools
+import os
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, Sequence
+
 import numpy as np
 import pydicom
 from pydicom.dataset import Dataset, FileDataset
+from pydicom.encaps import encapsulate, itemize_frame
+from pydicom.pixels.encoders import JPEGLSLosslessEncoder, RLELosslessEncoder
 from pydicom.uid import (
     SecondaryCaptureImageStorage,
+    MultiFrameTrueColorSecondaryCaptureImageStorage,
+    SegmentationStorage,
     generate_uid,
     ExplicitVRLittleEndian,
+    JPEGLSLossless,
+    RLELossless,
     PYDICOM_IMPLEMENTATION_UID,
 )
 from datetime import datetime
 
 
+# compressioni lossless supportate per le Secondary Capture
+COMPRESSIONS = {
+    "none": (ExplicitVRLittleEndian, None),
+    "rle": (RLELossless, RLELosslessEncoder),
+    "jpegls": (JPEGLSLossless, JPEGLSLosslessEncoder),
+}
+ENCODE_WORKERS = max(1, int(os.environ.get("ENCODE_WORKERS", "2")))
 
-def save_secondary_capture(
-    img: np.ndarray,
-    src_ds: pydicom.Dataset,
-    out_path,
-    algo_id: str,
-    *,
-    is_series: bool = False,
-):
-    """Save a mask or RGB overlay as a Secondary Capture DICOM."""
+_ENCODE_POOL: ThreadPoolExecutor | None = None
+_ENCODE_POOL_LOCK = threading.Lock()
+
+
+def _encode_pool() -> ThreadPoolExecutor:
+    global _ENCODE_POOL
+    with _ENCODE_POOL_LOCK:
+        if _ENCODE_POOL is None:
+            _ENCODE_POOL = ThreadPoolExecutor(ENCODE_WORKERS, thread_name_prefix="encode")
+        return _ENCODE_POOL
+
+
+@dataclass
+class EncodeStats:
+    """Byte di pixel data prima e dopo la compressione di un file scritto."""
+
+    transfer_syntax: str
+    raw_bytes: int = 0
+    stored_bytes: int = 0
+    fallback: str | None = None  # compressione richiesta ma non applicata, e perché
+
+    @property
+    def saved(self) -> int:
+        return self.raw_bytes - self.stored_bytes
+
+    @property
+    def compression(self) -> str:
+        """Compressione effettivamente scritta (dopo gli eventuali ripieghi)."""
+        return compression_of(self.transfer_syntax)
+
+    def summary(self) -> str:
+        ratio = self.raw_bytes / self.stored_bytes if self.stored_bytes else 0.0
+        return (
+            f"{pydicom.uid.UID(self.transfer_syntax).name}: "
+            f"{self.raw_bytes / 1e6:.2f} MB → {self.stored_bytes / 1e6:.2f} MB "
+            f"(saved {self.saved / 1e6:.2f} MB, {ratio:.1f}x)"
+        )
+
+
+def compression_of(transfer_syntax: str) -> str:
+    """Chiave di :data:`COMPRESSIONS` con questa transfer syntax."""
+    for name, (ts, _) in COMPRESSIONS.items():
+        if ts == transfer_syntax:
+            return name
+    raise ValueError(f"transfer syntax {transfer_syntax} non in COMPRESSIONS")
+
+
+def resolve_compression(name: str) -> str:
+    """Nome effettivo della compressione: ``jpegls`` senza codec ripiega su ``rle``.
+
+    Il codec JPEG-LS è l'extra opzionale ``jpegls`` (``pip install -e ./src[jpegls]``,
+    cioè pyjpegls). Il modulo non logga: il ripiego si vede confrontando il
+    risultato con ``name``, e nei writer da :attr:`EncodeStats.fallback`.
+    """
+    if name not in COMPRESSIONS:
+        raise ValueError(f"Compressione '{name}' non supportata: {sorted(COMPRESSIONS)}")
+    encoder = COMPRESSIONS[name][1]
+    if encoder is not None and not encoder.is_available:
+        return "rle"
+    return name
+
+
+def _fallback(requested: str, used: str, written: str) -> str | None:
+    """Perché ``written`` differisce da ``requested`` (None se coincidono)."""
+    reasons = []
+    if used != requested:
+        reasons.append(f"codec {requested} non disponibile (extra 'jpegls'), uso {used}")
+    if written != used:
+        reasons.append(f"{used} senza guadagno sul primo frame, scritto {written}")
+    return "; ".join(reasons) or None
+
+
+def _frame_encoder(name: str, ds: Dataset) -> Callable[[np.ndarray], bytes] | None:
+    """Funzione che comprime un frame con la descrizione pixel di ``ds``."""
+    encoder = COMPRESSIONS[name][1]
+    if encoder is None:
+        return None
+    kwargs = dict(
+        rows=ds.Rows,
+        columns=ds.Columns,
+        samples_per_pixel=ds.SamplesPerPixel,
+        number_of_frames=1,
+        bits_allocated=ds.BitsAllocated,
+        bits_stored=ds.BitsStored,
+        pixel_representation=ds.PixelRepresentation,
+        photometric_interpretation=ds.PhotometricInterpretation,
+    )
+    if ds.SamplesPerPixel > 1:
+        kwargs["planar_configuration"] = ds.PlanarConfiguration
+
+    def encode(frame: np.ndarray) -> bytes:
+        return encoder.encode(np.ascontiguousarray(frame, dtype=np.uint8), **kwargs)
+
+    return encode
+
+
+def _iter_encoded(
+    frames: Iterable[np.ndarray], encode: Callable[[np.ndarray], bytes]
+) -> Iterator[bytes]:
+    """Comprime i frame sul pool di encoding, in ordine e con lookahead limitato."""
+    pool = _encode_pool()
+    pending: deque = deque()
+    for frame in frames:
+        pending.append(pool.submit(encode, frame))
+        if len(pending) > 2 * ENCODE_WORKERS:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+@contextlib.contextmanager
+def _open_out(out):
+    """File di output; un buffer (es. ``io.BytesIO``) viene usato così com'è."""
+    if hasattr(out, "write"):
+        yield out
+    else:
+        with open(out, "wb") as f:
+            yield f
+
+
+def _derived_dataset(
+    src_ds: pydicom.Dataset, out_path, algo_id: str, sop_class: str
+) -> FileDataset:
+    """Header comune dei DICOM derivati (file meta, paziente/studio, serie)."""
     now = datetime.utcnow()
     ds = FileDataset(out_path, {}, file_meta=Dataset(), preamble=b"\0" * 128)
     ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
-    ds.file_meta.MediaStorageSOPClassUID = SecondaryCaptureImageStorage
+    ds.file_meta.MediaStorageSOPClassUID = sop_class
     ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
     ds.file_meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
 
     # Copia i tag necessari del paziente/studio
     for tag in (
@@ -48,6 +188,34 @@ def save_secondary_capture(
     ds.ImageType = r"DERIVED\\PRIMARY"
     ds.ContentDate = now.strftime("%Y%m%d")
     ds.ContentTime = now.strftime("%H%M%S.%f")
+    return ds
+
+
+def _set_8bit(ds: Dataset) -> None:
+    ds.BitsAllocated = 8
+    ds.BitsStored = 8
+    ds.HighBit = 7
+    ds.PixelRepresentation = 0
+
+
+def save_secondary_capture(
+    img: np.ndarray,
+    src_ds: pydicom.Dataset,
+    out_path,
+    algo_id: str,
+    *,
+    is_series: bool = False,
+    compression: str = "none",
+) -> EncodeStats:
+    """Save a mask or RGB overlay as a Secondary Capture DICOM.
+
+    ``compression`` è una chiave di :data:`COMPRESSIONS` (``rle``, ``jpegls``):
+    se il frame compresso non risulta più piccolo si scrive non compresso.
+    Come per le serie, la compressione gira sul pool di encoding: i job
+    concorrenti restano entro ``ENCODE_WORKERS`` thread e intanto il chiamante
+    prepara i pixel non compressi.
+    """
+    ds = _derived_dataset(src_ds, out_path, algo_id, SecondaryCaptureImageStorage)
 
     # Pixel data: support mono o RGB
     if img.ndim == 2:
@@ -55,25 +223,291 @@ def save_secondary_capture(
         ds.SamplesPerPixel = 1
         ds.PhotometricInterpretation = "MONOCHROME2"
         ds.Rows, ds.Columns = img.shape
-        pixel_bytes = img.astype(np.uint8).tobytes()
     elif img.ndim == 3 and img.shape[2] == 3:
         # overlay RGB
         ds.SamplesPerPixel = 3
         ds.PhotometricInterpretation = "RGB"
         ds.Rows, ds.Columns, _ = img.shape
-        # il DICOM RGB richiede interleaving R0,G0,B0, R1,G1,B1, …
-        pixel_bytes = img.astype(np.uint8).tobytes()
     else:
         raise ValueError("save_secondary_capture: img deve essere 2D o RGB 3D")
 
-    ds.BitsAllocated = 8
-    ds.BitsStored = 8
-    ds.HighBit = 7
-    ds.PixelRepresentation = 0
+    _set_8bit(ds)
     ds.PlanarConfiguration = 0  # RGB interleaved
-    ds.PixelData = pixel_bytes
+    requested, compression = compression, resolve_compression(compression)
+    encode = _frame_encoder(compression, ds)
+    pending = _encode_pool().submit(encode, img) if encode is not None else None
+    # il DICOM RGB richiede interleaving R0,G0,B0, R1,G1,B1, …
+    pixel_bytes = img.astype(np.uint8).tobytes()
+    stats = EncodeStats(ExplicitVRLittleEndian, len(pixel_bytes), len(pixel_bytes))
+    encoded = pending.result() if pending is not None else None
+    if encoded is not None and len(encoded) < len(pixel_bytes):
+        ds.file_meta.TransferSyntaxUID = COMPRESSIONS[compression][0]
+        ds.PixelData = encapsulate([encoded])
+        ds["PixelData"].VR = "OB"
+        stats = EncodeStats(ds.file_meta.TransferSyntaxUID, len(pixel_bytes), len(ds.PixelData))
+    else:
+        ds.PixelData = pixel_bytes
+    stats.fallback = _fallback(requested, compression, stats.compression)
 
     # Provenienza
     ds.add_new(0x00181030, "LO", f"Post-processed with {algo_id}")
 
-    ds.save_as(out_path, write_like_original=False)
+    ds.save_as(out_path, enforce_file_format=True)
+    return stats
+
+
+def save_secondary_capture_frames(
+    frames: Iterable[np.ndarray],
+    n_frames: int,
+    src_ds: pydicom.Dataset,
+    out_path,
+    algo_id: str,
+    *,
+    slice_locations: Sequence[float] | None = None,
+    compression: str = "none",
+) -> EncodeStats:
+    """Salva una serie di overlay RGB come un unico Multi-frame True Color SC.
+
+    ``frames`` è consumato un frame alla volta: l'header viene scritto da
+    pydicom, poi l'elemento PixelData (lunghezza nota: ``n_frames``·H·W·3) e
+    i frame in streaming, senza mai costruire il volume (Z, H, W, 3).
+
+    Con ``compression`` i frame vengono compressi sul pool di encoding
+    (``ENCODE_WORKERS`` thread) mentre i successivi sono ancora in rendering,
+    e scritti come PixelData incapsulato. Se il primo frame compresso non è
+    più piccolo dell'originale l'intero file resta non compresso.
+    """
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None or first.ndim != 3 or first.shape[2] != 3:
+        raise ValueError("save_secondary_capture_frames: servono frame RGB (H, W, 3)")
+    rows, cols, _ = first.shape
+
+    ds = _derived_dataset(
+        src_ds, out_path, algo_id, MultiFrameTrueColorSecondaryCaptureImageStorage
+    )
+    ds.SamplesPerPixel = 3
+    ds.PhotometricInterpretation = "RGB"
+    ds.Rows, ds.Columns = rows, cols
+    _set_8bit(ds)
+    ds.PlanarConfiguration = 0  # RGB interleaved
+    ds.NumberOfFrames = n_frames
+    if slice_locations is not None and len(slice_locations) == n_frames:
+        ds.SliceLocationVector = [float(x) for x in slice_locations]
+        ds.FrameIncrementPointer = pydicom.tag.Tag("SliceLocationVector")
+    else:
+        ds.PageNumberVector = list(range(1, n_frames + 1))
+        ds.FrameIncrementPointer = pydicom.tag.Tag("PageNumberVector")
+    ds.add_new(0x00181030, "LO", f"Post-processed with {algo_id}")
+
+    requested, compression = compression, resolve_compression(compression)
+    encode = _frame_encoder(compression, ds)
+    if encode is not None:
+        encoded_first = encode(first)
+        if len(encoded_first) < first.nbytes:
+            ds.file_meta.TransferSyntaxUID = COMPRESSIONS[compression][0]
+            stats = _write_encapsulated_frames(
+                ds, out_path, first, encoded_first, frames, n_frames, encode
+            )
+            stats.fallback = _fallback(requested, compression, stats.compression)
+            return stats
+
+    nbytes = n_frames * rows * cols * 3
+    with _open_out(out_path) as f:
+        ds.save_as(f, enforce_file_format=True)
+        # (7FE0,0010) OB, lunghezza esplicita pari
+        f.write(struct.pack("<HH2s2xI", 0x7FE0, 0x0010, b"OB", nbytes + nbytes % 2))
+        written = 0
+        for frame in itertools.chain([first], frames):
+            if frame.shape != first.shape:
+                raise ValueError("save_secondary_capture_frames: frame di dimensioni diverse")
+            f.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+            written += 1
+        if written != n_frames:
+            raise ValueError(
+                f"save_secondary_capture_frames: attesi {n_frames} frame, ricevuti {written}"
+            )
+        if nbytes % 2:
+            f.write(b"\0")
+    return EncodeStats(
+        ExplicitVRLittleEndian, nbytes, nbytes, _fallback(requested, compression, "none")
+    )
+
+
+def _write_encapsulated_frames(
+    ds: FileDataset,
+    out_path,
+    first: np.ndarray,
+    encoded_first: bytes,
+    frames: Iterator[np.ndarray],
+    n_frames: int,
+    encode: Callable[[np.ndarray], bytes],
+) -> EncodeStats:
+    """PixelData a lunghezza indefinita: offset table vuota + un item per frame."""
+    stats = EncodeStats(ds.file_meta.TransferSyntaxUID)
+
+    def checked(it: Iterator[np.ndarray]) -> Iterator[np.ndarray]:
+        for frame in it:
+            if frame.shape != first.shape:
+                raise ValueError("save_secondary_capture_frames: frame di dimensioni diverse")
+            yield frame
+
+    with _open_out(out_path) as f:
+        ds.save_as(f, enforce_file_format=True)
+        f.write(struct.pack("<HH2s2xI", 0x7FE0, 0x0010, b"OB", 0xFFFFFFFF))
+        f.write(struct.pack("<HHI", 0xFFFE, 0xE000, 0))  # Basic Offset Table vuota
+        written = 0
+        for data in itertools.chain([encoded_first], _iter_encoded(checked(frames), encode)):
+            item = b"".join(itemize_frame(data))
+            f.write(item)
+            stats.stored_bytes += len(item)
+            stats.raw_bytes += first.nbytes
+            written += 1
+        f.write(struct.pack("<HHI", 0xFFFE, 0xE0DD, 0))  # Sequence Delimitation
+    if written != n_frames:
+        raise ValueError(
+            f"save_secondary_capture_frames: attesi {n_frames} frame, ricevuti {written}"
+        )
+    return stats
+
+
+def _code(value: str, scheme: str, meaning: str) -> Dataset:
+    item = Dataset()
+    item.CodeValue = value
+    item.CodingSchemeDesignator = scheme
+    item.CodeMeaning = meaning
+    return item
+
+
+def save_segmentation(
+    masks: np.ndarray,
+    src_headers: Sequence[pydicom.Dataset],
+    out_path,
+    algo_id: str,
+    *,
+    segment_label: str = "Liver",
+) -> EncodeStats:
+    """Salva le maschere come DICOM Segmentation (BINARY, 1 bit per pixel).
+
+    ``masks`` è (H,W) o (Z,H,W), con una slice per header di ``src_headers``
+    (stesso ordine). Ogni frame referenzia la SOP instance da cui deriva,
+    quindi il viewer può sovrapporre il segmento all'immagine originale.
+    Un frame 512×512 occupa 32 KB invece dei ~786 KB dell'overlay RGB.
+    """
+    masks = np.asarray(masks)
+    if masks.ndim == 2:
+        masks = masks[None]
+    if masks.ndim != 3 or masks.shape[0] != len(src_headers):
+        raise ValueError("save_segmentation: serve una maschera per ogni header sorgente")
+    n_frames, rows, cols = masks.shape
+    src_ds = src_headers[0]
+
+    ds = _derived_dataset(src_ds, out_path, algo_id, SegmentationStorage)
+    ds.Modality = "SEG"
+    # tag di tipo 2: presenti anche se vuoti
+    for tag in ("PatientBirthDate", "PatientSex", "StudyID", "ReferringPhysicianName"):
+        setattr(ds, tag, src_ds.get(tag, ""))
+    if "FrameOfReferenceUID" in src_ds:
+        ds.FrameOfReferenceUID = src_ds.FrameOfReferenceUID
+    ds.InstanceNumber = 1
+    ds.Manufacturer = "medical_image_processing"
+    ds.ManufacturerModelName = algo_id
+    ds.DeviceSerialNumber = "0"
+    ds.SoftwareVersions = "1"
+    ds.ContentLabel = segment_label.upper().replace(" ", "_")[:16]
+    ds.ContentDescription = f"{algo_id} segmentation"
+    ds.ContentCreatorName = ""
+
+    # Image pixel: binario, bit impacchettati senza padding tra i frame
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.Rows, ds.Columns = rows, cols
+    ds.BitsAllocated = 1
+    ds.BitsStored = 1
+    ds.HighBit = 0
+    ds.PixelRepresentation = 0
+    ds.LossyImageCompression = "00"
+    ds.SegmentationType = "BINARY"
+    ds.NumberOfFrames = n_frames
+
+    seg = Dataset()
+    seg.SegmentNumber = 1
+    seg.SegmentLabel = segment_label
+    seg.SegmentAlgorithmType = "AUTOMATIC"
+    seg.SegmentAlgorithmName = algo_id
+    seg.SegmentedPropertyCategoryCodeSequence = [_code("91723000", "SCT", "Anatomical Structure")]
+    seg.SegmentedPropertyTypeCodeSequence = [_code("10200004", "SCT", "Liver")]
+    ds.SegmentSequence = [seg]
+
+    # Riferimenti alle immagini sorgente
+    ref_series = Dataset()
+    ref_series.SeriesInstanceUID = src_ds.get("SeriesInstanceUID", "")
+    ref_series.ReferencedInstanceSequence = []
+    for h in src_headers:
+        ref = Dataset()
+        ref.ReferencedSOPClassUID = h.SOPClassUID
+        ref.ReferencedSOPInstanceUID = h.SOPInstanceUID
+        ref_series.ReferencedInstanceSequence.append(ref)
+    ds.ReferencedSeriesSequence = [ref_series]
+
+    # Multi-frame functional groups: segmento + posizione della slice
+    dim_org = Dataset()
+    dim_org.DimensionOrganizationUID = generate_uid()
+    ds.DimensionOrganizationSequence = [dim_org]
+    dims = []
+    for ptr, grp in (
+        ("ReferencedSegmentNumber", "SegmentIdentificationSequence"),
+        ("ImagePositionPatient", "PlanePositionSequence"),
+    ):
+        d = Dataset()
+        d.DimensionOrganizationUID = dim_org.DimensionOrganizationUID
+        d.DimensionIndexPointer = pydicom.tag.Tag(ptr)
+        d.FunctionalGroupPointer = pydicom.tag.Tag(grp)
+        dims.append(d)
+    ds.DimensionIndexSequence = dims
+
+    shared = Dataset()
+    if "PixelSpacing" in src_ds:
+        pm = Dataset()
+        pm.PixelSpacing = src_ds.PixelSpacing
+        pm.SliceThickness = src_ds.get("SliceThickness", "")
+        shared.PixelMeasuresSequence = [pm]
+    if "ImageOrientationPatient" in src_ds:
+        po = Dataset()
+        po.ImageOrientationPatient = src_ds.ImageOrientationPatient
+        shared.PlaneOrientationSequence = [po]
+    ds.SharedFunctionalGroupsSequence = [shared]
+
+    per_frame = []
+    for z, h in enumerate(src_headers):
+        fg = Dataset()
+        src_img = Dataset()
+        src_img.ReferencedSOPClassUID = h.SOPClassUID
+        src_img.ReferencedSOPInstanceUID = h.SOPInstanceUID
+        src_img.PurposeOfReferenceCodeSequence = [
+            _code("121322", "DCM", "Source image for image processing operation")
+        ]
+        deriv = Dataset()
+        deriv.DerivationCodeSequence = [_code("113076", "DCM", "Segmentation")]
+        deriv.SourceImageSequence = [src_img]
+        fg.DerivationImageSequence = [deriv]
+        content = Dataset()
+        content.DimensionIndexValues = [1, z + 1]
+        fg.FrameContentSequence = [content]
+        if "ImagePositionPatient" in h:
+            pos = Dataset()
+            pos.ImagePositionPatient = h.ImagePositionPatient
+            fg.PlanePositionSequence = [pos]
+        seg_id = Dataset()
+        seg_id.ReferencedSegmentNumber = 1
+        fg.SegmentIdentificationSequence = [seg_id]
+        per_frame.append(fg)
+    ds.PerFrameFunctionalGroupsSequence = per_frame
+
+    packed = np.packbits(masks.astype(bool, copy=False).ravel(), bitorder="little")
+    pixel_bytes = packed.tobytes()
+    ds.PixelData = pixel_bytes + b"\0" * (len(pixel_bytes) % 2)
+    ds["PixelData"].VR = "OB"
+
+    ds.save_as(out_path, enforce_file_format=True)
+    return EncodeStats(ds.file_meta.TransferSyntaxUID, len(ds.PixelData), len(ds.PixelData))
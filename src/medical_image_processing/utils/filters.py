@@ -0,0 +1,221 @@
+# utils/filters.py
+"""Backend intercambiabili per filtri e morfologia binaria usati dai Processor.
+
+``scipy`` riproduce esattamente il comportamento storico (scipy.ndimage /
+skimage); ``opencv`` usa ``morphologyEx``, ``GaussianBlur`` e flood-fill, con
+bordi configurati per restare il più vicino possibile a scipy (vedi
+``python -m medical_image_processing.benchmarks.backend_conformance``).
+I kernel (disk, croce) sono costruiti una volta sola e condivisi.
+"""
+
+from __future__ import annotations
+
+import inspect
+import os
+from functools import lru_cache
+
+import cv2
+import numpy as np
+import scipy.ndimage as ndi
+from skimage.morphology import disk, remove_small_holes
+
+from medical_image_processing.utils.windowing import apply_window
+
+# skimage >= 0.26: ``max_size`` (buchi <= soglia) sostituisce ``area_threshold``
+# (buchi < soglia, deprecato con FutureWarning a ogni chiamata)
+_SKIMAGE_MAX_SIZE = "max_size" in inspect.signature(remove_small_holes).parameters
+
+
+@lru_cache(maxsize=None)
+def disk_kernel(radius: int) -> np.ndarray:
+    """``skimage.morphology.disk(radius)`` in uint8, in cache (sola lettura)."""
+    k = disk(radius).astype(np.uint8)
+    k.setflags(write=False)
+    return k
+
+
+@lru_cache(maxsize=None)
+def cross_kernel(ndim: int = 2) -> np.ndarray:
+    """Elemento strutturante 4‑connesso (``generate_binary_structure(ndim, 1)``)."""
+    k = ndi.generate_binary_structure(ndim, 1).astype(np.uint8)
+    k.setflags(write=False)
+    return k
+
+
+@lru_cache(maxsize=None)
+def gaussian_kernel1d(sigma: float, truncate: float = 4.0) -> np.ndarray:
+    """Kernel gaussiano 1‑D normalizzato, stesso supporto di scipy.ndimage."""
+    radius = int(truncate * sigma + 0.5)
+    x = np.arange(-radius, radius + 1)
+    k = np.exp(-0.5 * x**2 / sigma**2)
+    k = (k / k.sum()).astype(np.float32)
+    k.setflags(write=False)
+    return k
+
+
+class ScipyBackend:
+    """Implementazione di riferimento (scipy.ndimage)."""
+
+    name = "scipy"
+
+    def gaussian(self, img8: np.ndarray, sigma: float) -> np.ndarray:
+        return ndi.gaussian_filter(img8, sigma)
+
+    def gaussian_stack(self, stack8: np.ndarray, sigma: float) -> np.ndarray:
+        """``gaussian`` su ogni slice di uno stack (N,H,W) in una sola chiamata.
+
+        Sigma 0 lungo N: scipy salta l'asse, il risultato è identico slice
+        per slice (stesse passate e troncamenti uint8).
+        """
+        return ndi.gaussian_filter(stack8, (0, sigma, sigma))
+
+    def median(self, img: np.ndarray, size: int) -> np.ndarray:
+        return ndi.median_filter(img, size=size)
+
+    def closing(self, mask: np.ndarray, footprint: np.ndarray, iterations: int = 1) -> np.ndarray:
+        """Closing con bordo a 0 (``scipy.ndimage.binary_closing``)."""
+        return ndi.binary_closing(mask, structure=footprint, iterations=iterations)
+
+    def opening(
+        self,
+        mask: np.ndarray,
+        footprint: np.ndarray,
+        iterations: int = 1,
+        *,
+        ignore_border: bool = False,
+    ) -> np.ndarray:
+        """Opening; ``ignore_border=True`` non erode dal bordo (come skimage)."""
+        if not ignore_border:
+            return ndi.binary_opening(mask, structure=footprint, iterations=iterations)
+        eroded = ndi.binary_erosion(mask, footprint, iterations=iterations, border_value=1)
+        return ndi.binary_dilation(eroded, footprint, iterations=iterations)
+
+    def fill_holes(self, mask: np.ndarray) -> np.ndarray:
+        return ndi.binary_fill_holes(mask)
+
+    def remove_small_holes(self, mask: np.ndarray, area_threshold: int) -> np.ndarray:
+        """Riempie i buchi con area < ``area_threshold`` (semantica skimage < 0.26)."""
+        if _SKIMAGE_MAX_SIZE:
+            return remove_small_holes(mask, max_size=area_threshold - 1)
+        return remove_small_holes(mask, area_threshold=area_threshold)
+
+
+class OpenCVBackend(ScipyBackend):
+    """Implementazione veloce su OpenCV (uint8)."""
+
+    name = "opencv"
+
+    def gaussian(self, img8: np.ndarray, sigma: float) -> np.ndarray:
+        # scipy filtra un asse alla volta e tronca a uint8 dopo ogni passata:
+        # stesse due passate qui, in float32, con bordo 'reflect'
+        g, one = gaussian_kernel1d(sigma), np.ones(1, np.float32)
+        out = cv2.sepFilter2D(
+            img8.astype(np.float32), -1, one, g, borderType=cv2.BORDER_REFLECT
+        ).astype(img8.dtype)
+        out = cv2.sepFilter2D(
+            out.astype(np.float32), -1, g, one, borderType=cv2.BORDER_REFLECT
+        )
+        return out.astype(img8.dtype)
+
+    def gaussian_stack(self, stack8: np.ndarray, sigma: float) -> np.ndarray:
+        out = np.empty_like(stack8)
+        for i, img8 in enumerate(stack8):
+            out[i] = self.gaussian(img8, sigma)
+        return out
+
+    def closing(self, mask: np.ndarray, footprint: np.ndarray, iterations: int = 1) -> np.ndarray:
+        out = cv2.morphologyEx(
+            mask.astype(np.uint8), cv2.MORPH_CLOSE, footprint, iterations=iterations,
+            borderType=cv2.BORDER_CONSTANT, borderValue=0,
+        )
+        return out.astype(bool)
+
+    def opening(
+        self,
+        mask: np.ndarray,
+        footprint: np.ndarray,
+        iterations: int = 1,
+        *,
+        ignore_border: bool = False,
+    ) -> np.ndarray:
+        if ignore_border:
+            # bordo di default OpenCV: neutro per erosione e dilatazione
+            out = cv2.morphologyEx(
+                mask.astype(np.uint8), cv2.MORPH_OPEN, footprint, iterations=iterations
+            )
+        else:
+            out = cv2.morphologyEx(
+                mask.astype(np.uint8), cv2.MORPH_OPEN, footprint, iterations=iterations,
+                borderType=cv2.BORDER_CONSTANT, borderValue=0,
+            )
+        return out.astype(bool)
+
+    def fill_holes(self, mask: np.ndarray) -> np.ndarray:
+        # flood-fill 4‑connesso dello sfondo a partire da un bordo aggiunto
+        h, w = mask.shape
+        canvas = np.zeros((h + 2, w + 2), np.uint8)
+        canvas[1:-1, 1:-1] = mask
+        cv2.floodFill(canvas, None, (0, 0), 1, flags=4)
+        return (canvas[1:-1, 1:-1] == 0) | mask.astype(bool)
+
+    def remove_small_holes(self, mask: np.ndarray, area_threshold: int) -> np.ndarray:
+        """Riempie i buchi 4‑connessi con area < soglia."""
+        inv = (~mask.astype(bool)).astype(np.uint8)
+        _, holes, stats, _ = cv2.connectedComponentsWithStats(inv, connectivity=4)
+        small = stats[:, cv2.CC_STAT_AREA] < area_threshold
+        small[0] = False  # label 0 = foreground della maschera
+        return mask.astype(bool) | small[holes]
+
+
+def windowed_median(img: np.ndarray, size: int, lo: float) -> np.ndarray:
+    """Mediana ``size``×``size`` veloce su HU quantizzati a 1 HU per livello.
+
+    Gli HU vengono arrotondati all'intero, limitati a [lo, lo + 255] e portati
+    in uint8 (livello = HU - lo), poi filtrati con ``cv2.medianBlur`` su un
+    bordo 'reflect' come ``scipy.ndimage.median_filter``.
+
+    Contratto di accuratezza: la mediana commuta con clip e arrotondamento
+    (trasformazioni monotone), quindi per input a HU interi
+    ``windowed_median(img, k, lo) > t - lo`` coincide pixel per pixel con
+    ``ndi.median_filter(img, k) > t`` per ogni soglia ``lo <= t < lo + 255``.
+    Per HU non interi (slope frazionaria) possono cambiare solo i pixel la cui
+    mediana esatta dista al più 0.5 HU dalla soglia (valori x.5 arrotondati
+    al pari da ``np.rint``).
+
+    ``img`` può essere anche uno stack (N,H,W) di slice indipendenti: la
+    quantizzazione avviene in un solo passaggio, la mediana slice per slice.
+    """
+    if size % 2 == 0:
+        raise ValueError("windowed_median: size deve essere dispari")
+    lo = int(np.floor(lo))
+    img = np.asarray(img)
+    if img.dtype.kind == "f":
+        q = np.rint(np.clip(img, lo, lo + 255))
+        q = (q - lo).astype(np.uint8)
+    else:
+        # finestra larga 255 HU: la LUT restituisce esattamente HU - lo
+        q = apply_window(img, lo, lo + 255)
+    if q.ndim == 3:
+        out = np.empty_like(q)
+        for i, q2d in enumerate(q):
+            out[i] = _median_u8(q2d, size)
+        return out
+    return _median_u8(q, size)
+
+
+def _median_u8(q: np.ndarray, size: int) -> np.ndarray:
+    r = size // 2
+    padded = cv2.copyMakeBorder(q, r, r, r, r, cv2.BORDER_REFLECT)
+    return cv2.medianBlur(padded, size)[r:-r, r:-r]
+
+
+BACKENDS = {b.name: b() for b in (ScipyBackend, OpenCVBackend)}
+
+
+def get_backend(name: str | None = None) -> ScipyBackend:
+    """Backend per nome; default dall'env FILTER_BACKEND (``scipy``)."""
+    name = name or os.environ.get("FILTER_BACKEND", "scipy")
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Backend '{name}' non disponibile: {sorted(BACKENDS)}") from None
@@ -1,6 +1,8 @@
 # utils/liver_select.py
 import numpy as np
 
+from medical_image_processing.utils.components import ComponentStats, component_stats
+
 
 def pick_liver_component(
     lbl,
@@ -10,43 +12,43 @@ def pick_liver_component(
     *,
     max_cx: float | None = None,  # nuovo ➜ opzionale
     max_roundness: float | None = None,  # facoltativo
+    stats: ComponentStats | None = None,  # statistiche già calcolate su lbl
     **kwargs,  # cattura altri parametri futuri
 ):
     """
     Restituisce l’ID della label che più probabilmente è fegato.
     Parametri nuovi (facoltativi):
-      • max_cx         – valore max di cx ammesso se side == 'left'
-      • max_roundness  – esclude blob troppo “filiformi” (4πA / P² < soglia)
+      • max_cx         – valore max di cx ammesso se side == 'left'
+      • max_roundness  – esclude blob troppo “filiformi” (4πA / P² < soglia)
+      • stats          – ComponentStats di lbl, per non ricalcolarle
     Gli argomenti extra vengono ignorati = full backward‑compat.
+    Tutte le label vengono valutate insieme (vedi utils/components.py).
+
+    Con ``lbl`` 3‑D (Z,H,W) ``min_area`` è un volume in voxel e i filtri di
+    posizione usano il centroide nel piano (y, x) della componente.
     """
-    h, w = img_shape
-    best_lab, best_area = None, 0
-
-    for lab in range(1, lbl.max() + 1):
-        ys, xs = np.where(lbl == lab)
-        area = len(xs)
-        if area < min_area:
-            continue
-
-        cx, cy = xs.mean() / w, ys.mean() / h
-        if side == "left" and max_cx is not None and cx > max_cx:
-            continue
-        if side == "right" and max_cx is not None and cx < (1 - max_cx):
-            continue
-        if cy > 0.70:  # troppo in basso → intestino
-            continue
-
-        # rotondità opzionale
-        if max_roundness is not None:
-            # perimetro stimato con marching‑squares 4‑conn
-            perim = np.count_nonzero(np.diff(lbl == lab, axis=0)) + np.count_nonzero(
-                np.diff(lbl == lab, axis=1)
-            )
-            roundness = (4 * np.pi * area) / (perim**2 + 1e-6)
-            if roundness < max_roundness:
-                continue
-
-        if area > best_area:
-            best_lab, best_area = lab, area
-
-    return best_lab
+    h, w = img_shape[-2:]
+    if stats is None or (max_roundness is not None and stats.perimeter is None):
+        stats = component_stats(lbl, perimeter=max_roundness is not None)
+    if len(stats) == 0:
+        return None
+
+    area = stats.area
+    cy, cx = stats.centroid[:, -2] / h, stats.centroid[:, -1] / w
+
+    ok = (area > 0) & (area >= min_area)
+    if side == "left" and max_cx is not None:
+        ok &= cx <= max_cx
+    if side == "right" and max_cx is not None:
+        ok &= cx >= (1 - max_cx)
+    ok &= cy <= 0.70  # troppo in basso → intestino
+
+    # rotondità opzionale (perimetro stimato 4‑conn)
+    if max_roundness is not None:
+        roundness = (4 * np.pi * area) / (stats.perimeter.astype(float) ** 2 + 1e-6)
+        ok &= roundness >= max_roundness
+
+    if not ok.any():
+        return None
+    # a parità di area vince la label con ID più basso, come nel loop originale
+    return int(np.argmax(np.where(ok, area, -1))) + 1
@@ -2,7 +2,16 @@
 from scipy.ndimage import binary_fill_holes, binary_closing, generate_binary_structure
 
 
-def postprocess_mask(mask, close_r=3, dims=2):
+def postprocess_mask(mask, close_r=3, dims=2, backend=None):
+    """Closing 4‑connesso ripetuto ``close_r`` volte + fill‑holes.
+
+    ``backend`` (vedi utils/filters.py) è usato per le maschere 2‑D.
+    """
+    if dims == 2 and backend is not None:
+        from medical_image_processing.utils.filters import cross_kernel
+
+        mask = backend.closing(mask, cross_kernel(2), iterations=close_r)
+        return backend.fill_holes(mask)
     if dims == 3:
         struct = generate_binary_structure(3, 1)
     else:
@@ -0,0 +1,40 @@
+# utils/timing.py
+"""Hook di timing per i passi interni dei Processor.
+
+Di default :func:`step` non misura nulla (un ``nullcontext`` condiviso,
+costo trascurabile anche per slice). Chi esegue i Processor, ad es. la
+telemetria del worker, registra con :func:`set_step_hook` una funzione
+``hook(name, seconds)`` che riceve la durata di ogni passo.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import time
+from typing import Callable, ContextManager
+
+_HOOK: Callable[[str, float], None] | None = None
+_NULL = contextlib.nullcontext()
+
+
+def set_step_hook(hook: Callable[[str, float], None] | None) -> None:
+    """Registra (o rimuove, con None) il destinatario delle durate dei passi."""
+    global _HOOK
+    _HOOK = hook
+
+
+def step(name: str) -> ContextManager:
+    """``with step("morphology"): ...`` – misura il blocco se c'è un hook."""
+    hook = _HOOK
+    if hook is None:
+        return _NULL
+    return _timed(name, hook)
+
+
+@contextlib.contextmanager
+def _timed(name: str, hook: Callable[[str, float], None]):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        hook(name, time.perf_counter() - t0)
@@ -1,19 +1,29 @@
 from __future__ import annotations
 
+from typing import Iterator
+
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 
+from medical_image_processing.utils.windowing import apply_window, minmax_window
+
 
 def overlay_mask(
     img: np.ndarray,
     mask: np.ndarray,
     alpha: float = 0.4,
     color: tuple[int, int, int] = (255, 0, 255),
+    window: tuple[float, float] | None = None,
 ) -> np.ndarray:
-    """Overlay a binary mask on an 8-bit image."""
+    """Overlay a binary mask on an 8-bit image (or an HU array/HUVolume).
+
+    Gli HU vengono portati in 8 bit con ``window`` (lo, hi) oppure, di
+    default, con la finestra [min, max] dell'immagine.
+    """
+    img = np.asarray(img)
     if img.dtype != np.uint8:
-        img8 = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+        img8 = apply_window(img, *(window or minmax_window(img)))
     else:
         img8 = img.copy()
 
@@ -28,6 +38,24 @@ def overlay_mask(
     return out
 
 
+def iter_overlay_frames(
+    vol: np.ndarray,
+    masks: np.ndarray,
+    alpha: float = 0.4,
+    color: tuple[int, int, int] = (255, 0, 255),
+    window: tuple[float, float] | None = None,
+) -> Iterator[np.ndarray]:
+    """Overlay RGB di una serie (Z,H,W), una slice alla volta.
+
+    La finestra [min, max] di default è calcolata sull'intero volume, così
+    tutti i frame hanno la stessa scala di grigi.
+    """
+    vol = np.asarray(vol)
+    window = window or minmax_window(vol)
+    for z in range(vol.shape[0]):
+        yield overlay_mask(vol[z], masks[z], alpha, color, window=window)
+
+
 def show_overlay(img: np.ndarray, mask: np.ndarray, title: str = "Overlay") -> None:
     """Display the mask overlay using matplotlib."""
     plt.imshow(overlay_mask(img, mask[..., 0] if mask.ndim == 3 else mask))
@@ -0,0 +1,69 @@
+# utils/windowing.py
+"""Finestra HU → uint8 tramite lookup table.
+
+Per input int16 (HUVolume compatti) la finestra [lo, hi] è una tabella di
+65536 byte calcolata una volta per coppia (lo, hi): ogni pixel costa un solo
+accesso in memoria, senza temporanei float. La tabella riproduce esattamente
+la formula float32 usata finora dai Processor::
+
+    ((clip(x, lo, hi) - lo) / (hi - lo) * 255).astype(uint8)
+
+Gli input float (slope frazionaria) usano la stessa formula con un solo
+buffer float32 riusato.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=64)
+def window_lut(lo: float, hi: float) -> np.ndarray:
+    """LUT uint8 indicizzata dai pixel int16 visti come uint16 (sola lettura)."""
+    hu = np.arange(1 << 16, dtype=np.uint16).view(np.int16)
+    lut = _window_float(hu, lo, hi)
+    lut.setflags(write=False)
+    return lut
+
+
+def _window_float(img: np.ndarray, lo: float, hi: float, out: np.ndarray | None = None) -> np.ndarray:
+    buf = np.clip(img, lo, hi).astype(np.float32, copy=False)
+    buf -= np.float32(lo)
+    buf /= np.float32(hi - lo)
+    buf *= np.float32(255)
+    if out is None:
+        return buf.astype(np.uint8)
+    np.copyto(out, buf, casting="unsafe")
+    return out
+
+
+def apply_window(
+    img: np.ndarray, lo: float, hi: float, out: np.ndarray | None = None
+) -> np.ndarray:
+    """Porta ``img`` (slice o volume HU) in uint8 con la finestra [lo, hi].
+
+    ``out`` (uint8, stessa shape) permette di riusare un buffer già allocato,
+    ad es. un volume intero o una sua slice.
+    """
+    if hi <= lo:
+        raise ValueError(f"apply_window: finestra non valida ({lo}, {hi})")
+    img = np.asarray(img)
+    if out is None:
+        out = np.empty(img.shape, dtype=np.uint8)
+    elif out.shape != img.shape or out.dtype != np.uint8:
+        raise ValueError("apply_window: out deve essere uint8 con la stessa shape")
+    if img.dtype.kind in "iu" and img.dtype.itemsize == 1:
+        img = img.astype(np.int16)
+    if img.dtype == np.int16:
+        # mode="clip": indici sempre validi, evita il buffer intermedio di "raise"
+        return np.take(window_lut(lo, hi), img.view(np.uint16), out=out, mode="clip")
+    return _window_float(img, lo, hi, out)
+
+
+def minmax_window(img: np.ndarray) -> tuple[float, float]:
+    """Finestra [min, max] dell'immagine (come ``cv2.NORM_MINMAX``)."""
+    img = np.asarray(img)
+    lo, hi = img.min().item(), img.max().item()
+    return lo, (hi if hi > lo else lo + 1)
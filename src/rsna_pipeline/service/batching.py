@@ -0,0 +1,124 @@
+"""Coalescenza dei job a singola immagine in chiamate ``Processor.run_batch``.
+
+I thread del worker che arrivano alla fase CPU con una slice 2‑D la
+consegnano a :class:`BatchCoalescer`: il primo thread di un batch (leader)
+attende al più ``window_s`` secondi, o finché il batch non raggiunge
+``max_batch`` slice, poi esegue ``run_batch`` per tutti e distribuisce i
+risultati; gli altri thread restano in attesa del proprio risultato.
+
+Un batch non supera mai ``max_batch`` slice: quelle in eccesso restano in
+coda e la prima diventa leader del batch successivo. Con ``backlog`` (job
+in attesa della fase CPU o già al suo interno, vedi
+:meth:`~rsna_pipeline.service.pipeline.JobPipeline.compute_backlog`) il
+leader non aspetta quando nessun altro job può unirsi al batch.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+
+from medical_image_processing.processing.base import Processor
+from rsna_pipeline.service import telemetry
+
+
+@dataclass(eq=False)
+class _Entry:
+    img: np.ndarray
+    meta: dict | None
+    fut: Future = field(default_factory=Future)
+    lead: bool = False  # leader del proprio batch
+    promoted: bool = False  # leader di slice avanzate: la finestra è già trascorsa
+
+
+class BatchCoalescer:
+    """Raggruppa le slice 2‑D di job concorrenti, per istanza di Processor."""
+
+    def __init__(
+        self,
+        window_s: float = 0.01,
+        max_batch: int = 8,
+        cpu_slot=None,
+        backlog: Callable[[], int] | None = None,
+    ):
+        self.window_s = max(0.0, window_s)
+        self.max_batch = max(1, max_batch)
+        self.cpu_slot = cpu_slot
+        self.backlog = backlog
+        self._cond = threading.Condition()
+        self._pending: dict[Processor, list[_Entry]] = {}
+
+    def run(self, proc: Processor, img: np.ndarray, meta: dict | None = None) -> dict:
+        """Risultato di ``proc.run(img)``, calcolato in batch con i job vicini.
+
+        Il batch gira sotto ``cpu_slot``: il chiamante non deve tenerlo
+        occupato mentre aspetta.
+        """
+        entry = _Entry(img, meta)
+        with self._cond:
+            queue = self._pending.setdefault(proc, [])
+            queue.append(entry)
+            entry.lead = len(queue) == 1
+            # il leader può smettere di aspettare (batch pieno o altro job arrivato)
+            self._cond.notify_all()
+            while not entry.lead and not entry.fut.done():
+                self._cond.wait()
+        if entry.lead:
+            self._lead(proc, wait=not entry.promoted)
+        return entry.fut.result()
+
+    def _lead(self, proc: Processor, wait: bool = True) -> None:
+        deadline = time.monotonic() + (self.window_s if wait else 0.0)
+        with self._cond:
+            queue = self._pending[proc]
+            while len(queue) < self.max_batch:
+                # nessun altro job in arrivo alla fase CPU: inutile aspettare
+                if self.backlog is not None and self.backlog() <= len(queue):
+                    break
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            batch, rest = queue[: self.max_batch], queue[self.max_batch :]
+            if rest:
+                # le slice in eccesso formano il batch successivo, con un nuovo leader
+                self._pending[proc] = rest
+                rest[0].lead = rest[0].promoted = True
+                self._cond.notify_all()
+            else:
+                # i thread arrivati da ora in poi formano il batch successivo
+                del self._pending[proc]
+
+        try:
+            self._run_batch(proc, batch)
+        finally:
+            for e in batch:
+                if not e.fut.done():  # es. interruzione mentre si attende cpu_slot
+                    e.fut.set_exception(RuntimeError("batch interrotto"))
+            with self._cond:
+                self._cond.notify_all()  # sveglia i follower di questo batch
+
+    def _run_batch(self, proc: Processor, batch: list[_Entry]) -> None:
+        with self.cpu_slot or contextlib.nullcontext():
+            try:
+                results = proc.run_batch([e.img for e in batch], [e.meta for e in batch])
+            except Exception as e:
+                # una slice non valida non deve far fallire gli altri job
+                telemetry.log("WARNING", "run_batch failed, fallback slice per slice", error=str(e))
+                results = None
+            if len(batch) > 1:
+                telemetry.log("DEBUG", "batch", algo=proc.ALGO_ID, slices=len(batch))
+            for i, e in enumerate(batch):
+                if results is not None:
+                    e.fut.set_result(results[i])
+                    continue
+                try:
+                    e.fut.set_result(proc.run(e.img, e.meta))
+                except Exception as exc:
+                    e.fut.set_exception(exc)
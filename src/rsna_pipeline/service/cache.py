@@ -0,0 +1,190 @@
+"""Cache dei worker: LRU in memoria degli input e indice dei risultati.
+
+* :class:`LRUCache` – limitata in byte, condivisa dai job di un worker.
+* :class:`S3ResultStore` / :class:`LocalResultStore` – indice
+  content-addressed dei DICOM già prodotti (vedi :func:`result_cache_key`).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Generic, Hashable, Protocol, TypeVar
+
+V = TypeVar("V")
+
+INPUT_CACHE_MB = float(os.environ.get("INPUT_CACHE_MB", "256"))
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    nbytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"hits {self.hits}, misses {self.misses} ({self.hit_rate:.0%}), "
+            f"evictions {self.evictions}, {self.entries} entries, {self.nbytes / 1e6:.1f} MB"
+        )
+
+
+class LRUCache(Generic[V]):
+    """LRU con eviction per byte: ogni valore entra con la sua dimensione.
+
+    Un valore più grande dell'intera capacità non viene memorizzato.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, int(max_bytes))
+        self._data: OrderedDict[Hashable, tuple[V, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get(self, key: Hashable) -> V | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: V, nbytes: int) -> bool:
+        """Inserisce ``value``; False se non entra nella capacità."""
+        if nbytes > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._stats.nbytes -= old[1]
+            self._data[key] = (value, nbytes)
+            self._stats.nbytes += nbytes
+            while self._stats.nbytes > self.max_bytes:
+                _, (_, size) = self._data.popitem(last=False)
+                self._stats.nbytes -= size
+                self._stats.evictions += 1
+            self._stats.entries = len(self._data)
+            return True
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(**vars(self._stats))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._stats.entries = self._stats.nbytes = 0
+
+
+# byte grezzi dei DICOM scaricati, chiave (S3 key, ETag): un oggetto
+# sovrascritto nel PACS cambia ETag, quindi non serve invalidazione
+INPUT_CACHE: LRUCache[bytes] = LRUCache(int(INPUT_CACHE_MB * 1e6))
+
+
+# ---------------------------------------------------------------------------
+# Result cache
+# ---------------------------------------------------------------------------
+
+# env RESULT_CACHE: "s3" (indice nel bucket di output, default),
+# "local:<dir>" (stand-in su filesystem) oppure "off"
+RESULT_CACHE = os.environ.get("RESULT_CACHE", "s3")
+RESULT_CACHE_PREFIX = "_result-cache/"
+# versione del codice (es. tag dell'immagine): cambia → cache invalidata
+CODE_VERSION = os.environ.get("CODE_VERSION", "dev")
+
+
+def result_cache_key(
+    pacs_info: dict, files: list[dict], algo: str, version: str, params: dict, **options: Any
+) -> str | None:
+    """Hash SHA-256 di input, algoritmo, versione, parametri e opzioni di output.
+
+    Gli input entrano come (S3 key, ETag): senza ETag per tutti i file non
+    si può garantire che il contenuto sia lo stesso e non si usa la cache.
+    """
+    if not files or any(not f.get("key") or not f.get("etag") for f in files):
+        return None
+    doc = {
+        "pacs": {k: pacs_info.get(k) for k in ("scope", "study_id", "series_id", "image_id")},
+        "inputs": sorted((f["key"], f["etag"]) for f in files),
+        "algo": algo,
+        "version": version,
+        "code": CODE_VERSION,
+        "params": params,
+        "options": options,
+    }
+    blob = json.dumps(doc, sort_keys=True, default=str).encode()
+    return hashlib.sha256(blob).hexdigest()
+
+
+class ResultStore(Protocol):
+    """Indice chiave → {"bucket", "key", "format"} dei risultati già caricati."""
+
+    def get(self, key: str) -> dict | None: ...
+
+    def put(self, key: str, entry: dict) -> None: ...
+
+
+class S3ResultStore:
+    """Indice su S3: un piccolo JSON per chiave sotto ``RESULT_CACHE_PREFIX``."""
+
+    def __init__(self, s3, bucket: str, prefix: str = RESULT_CACHE_PREFIX):
+        self.s3, self.bucket, self.prefix = s3, bucket, prefix
+
+    def get(self, key: str) -> dict | None:
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{key}.json")
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(obj["Body"].read())
+
+    def put(self, key: str, entry: dict) -> None:
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{key}.json",
+            Body=json.dumps(entry).encode(),
+            ContentType="application/json",
+        )
+
+
+class LocalResultStore:
+    """Stand-in locale (sviluppo/test): un file JSON per chiave in ``root``."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str) -> dict | None:
+        try:
+            return json.loads((self.root / f"{key}.json").read_text())
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, entry: dict) -> None:
+        tmp = self.root / f".{key}.tmp"
+        tmp.write_text(json.dumps(entry))
+        tmp.replace(self.root / f"{key}.json")
+
+
+def result_store_from_env(s3, bucket: str, spec: str = RESULT_CACHE) -> ResultStore | None:
+    """Store configurato da RESULT_CACHE (None se disattivato)."""
+    if spec == "off":
+        return None
+    if spec == "s3":
+        return S3ResultStore(s3, bucket)
+    if spec.startswith("local:"):
+        return LocalResultStore(spec[len("local:"):])
+    raise ValueError(f"RESULT_CACHE non valido: {spec!r}")
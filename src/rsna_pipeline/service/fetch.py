@@ -0,0 +1,244 @@
+"""Download concorrente dei file DICOM (presigned URL) per il runner.
+
+I file vengono tenuti in memoria (``io.BytesIO`` passati direttamente a
+pydicom) finché c'è spazio in :data:`MEMORY_BUDGET`, il budget
+``INMEMORY_MAX_MB`` condiviso da tutti i job del processo (anche dagli
+output di ``publish_result``); oltre la soglia, o senza ``Content-Length``,
+si scrive su disco come prima.
+Con una :class:`~rsna_pipeline.service.cache.LRUCache` i file identificati
+da (S3 key, ETag) già scaricati da job precedenti non passano dalla rete.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import io
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Iterator
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+
+from rsna_pipeline.service import telemetry
+from rsna_pipeline.service.cache import LRUCache
+
+
+FETCH_CONCURRENCY = int(os.environ.get("FETCH_CONCURRENCY", "8"))
+FETCH_RETRIES = int(os.environ.get("FETCH_RETRIES", "3"))
+# byte tenuti in memoria da tutti i job del processo (input e output) prima
+# di passare al disco: con la pipeline del worker ci sono ~10 job in volo
+INMEMORY_MAX_BYTES = int(float(os.environ.get("INMEMORY_MAX_MB", "512")) * 1e6)
+
+
+class MemoryBudget:
+    """Byte prenotabili per buffer in memoria, condivisi tra i thread del processo."""
+
+    def __init__(self, nbytes: int):
+        self.free = nbytes
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> bool:
+        """Prenota ``nbytes``; False (senza attendere) se non ci stanno."""
+        with self._lock:
+            if nbytes <= 0 or nbytes > self.free:
+                return False
+            self.free -= nbytes
+            return True
+
+    def release(self, nbytes: int) -> None:
+        with self._lock:
+            self.free += nbytes
+
+    @contextlib.contextmanager
+    def hold(self, nbytes: int) -> Iterator[bool]:
+        """``reserve`` per la durata del blocco; True se il buffer sta in memoria."""
+        ok = self.reserve(nbytes)
+        try:
+            yield ok
+        finally:
+            if ok:
+                self.release(nbytes)
+
+
+MEMORY_BUDGET = MemoryBudget(INMEMORY_MAX_BYTES)
+
+
+@dataclass
+class FetchStats:
+    """Throughput per file e aggregato di un fetch."""
+
+    files: list[tuple[str, int, float]] = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+    elapsed: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, name: str, nbytes: int, seconds: float) -> None:
+        with self._lock:
+            self.files.append((name, nbytes, seconds))
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(n for _, n, _ in self.files)
+
+    def summary(self) -> str:
+        mb = self.total_bytes / 1e6
+        rate = mb / self.elapsed if self.elapsed > 0 else 0.0
+        return f"{len(self.files)} files, {mb:.1f} MB in {self.elapsed:.2f} s ({rate:.1f} MB/s)"
+
+
+def cache_key(file_info: dict) -> tuple[str, str] | None:
+    """Chiave di cache (S3 key, ETag) di un file restituito dalla PACS API."""
+    if file_info.get("key") and file_info.get("etag"):
+        return file_info["key"], file_info["etag"]
+    return None
+
+
+class SeriesFetcher:
+    """Scarica i file di una serie in parallelo su una sessione HTTP in pool.
+
+    Ogni file viene ritentato fino a ``retries`` volte con backoff
+    esponenziale; :meth:`iter_fetch` restituisce i file man mano che sono
+    completi, così la decodifica può partire senza aspettare l'intera serie.
+
+    I byte dei file tenuti in memoria restano prenotati nel budget finché
+    il chiamante non ha finito di usarli: :meth:`release`, o l'uscita dal
+    ``with``.
+    """
+
+    def __init__(
+        self,
+        http: requests.Session,
+        concurrency: int = FETCH_CONCURRENCY,
+        retries: int = FETCH_RETRIES,
+        backoff: float = 0.5,
+        timeout: float = 15,
+        memory_budget: MemoryBudget = MEMORY_BUDGET,
+        cache: LRUCache[bytes] | None = None,
+    ):
+        self.http = http
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.stats = FetchStats()
+        self.memory_budget = memory_budget
+        self.held = 0  # byte dei file in memoria, prenotati nel budget
+        self._held_lock = threading.Lock()
+        self.cache = cache
+
+    def __enter__(self) -> SeriesFetcher:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def release(self) -> None:
+        """Restituisce al budget i byte dei file in memoria (idempotente)."""
+        with self._held_lock:
+            held, self.held = self.held, 0
+        self.memory_budget.release(held)
+
+    def fetch_one(
+        self, url: str, dst: Path, cache_key: tuple[str, str] | None = None
+    ) -> Path | io.BytesIO:
+        """Scarica ``url`` con retry/backoff, in memoria o (oltre il budget) in ``dst``.
+
+        ``cache_key`` = (S3 key, ETag): se presente in cache il file non viene
+        scaricato; i download tenuti in memoria vengono aggiunti alla cache.
+        """
+        if self.cache is not None and cache_key is not None:
+            data = self.cache.get(cache_key)
+            if data is not None:
+                telemetry.log("DEBUG", "fetch cache hit", file=dst.name, kb=round(len(data) / 1e3))
+                out = io.BytesIO(data)
+                out.name = dst.name
+                return out
+        for attempt in range(self.retries + 1):
+            t0 = time.perf_counter()
+            reserved = 0
+            done = False
+            try:
+                with self.http.get(url, stream=True, timeout=self.timeout) as r:
+                    r.raise_for_status()
+                    length = int(r.headers.get("Content-Length") or 0)
+                    if self.memory_budget.reserve(length):
+                        reserved = length
+                        data = r.raw.read()
+                        out = io.BytesIO(data)
+                        out.name = dst.name
+                        nbytes = len(data)
+                    else:
+                        with open(dst, "wb") as f:
+                            shutil.copyfileobj(r.raw, f)
+                            nbytes = f.tell()
+                        out = dst
+                done = True
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.HTTPError,
+                # errori a metà body da r.raw (ProtocolError, ReadTimeoutError, …)
+                urllib3.exceptions.HTTPError,
+            ) as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                # 4xx (es. presigned scaduto) non si risolvono ritentando
+                if attempt == self.retries or (status is not None and status < 500):
+                    raise
+                delay = self.backoff * 2**attempt
+                telemetry.log(
+                    "WARNING", "fetch retry", file=dst.name, attempt=attempt + 1,
+                    retries=self.retries, delay_s=delay, error=str(e),
+                )
+                time.sleep(delay)
+                continue
+            finally:
+                if not done:
+                    # budget e file parziale tornano liberi prima del retry (o dell'errore)
+                    self.memory_budget.release(reserved)
+                    dst.unlink(missing_ok=True)
+            dt = time.perf_counter() - t0
+            with self._held_lock:
+                self.held += reserved
+            self.stats.add(dst.name, nbytes, dt)
+            if reserved and self.cache is not None and cache_key is not None:
+                self.cache.put(cache_key, data, nbytes)
+            where = "mem" if reserved else "disk"
+            telemetry.log(
+                "DEBUG", "fetch", file=dst.name, kb=round(nbytes / 1e3), ms=round(dt * 1e3),
+                where=where,
+            )
+            return out
+        raise AssertionError("unreachable")
+
+    def iter_fetch(self, files: Iterable[dict], dst_dir: Path) -> Iterator[Path | io.BytesIO]:
+        """Scarica tutti i ``files`` (dict con ``url`` e, se noti, ``key``/``etag``)
+        e li restituisce appena pronti."""
+        self.stats = FetchStats()
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="fetch") as pool:
+            # ogni thread vede il job corrente (job_id/trace_id nei log)
+            futs = [
+                pool.submit(
+                    contextvars.copy_context().run,
+                    self.fetch_one,
+                    f["url"],
+                    dst_dir / Path(urlparse(f["url"]).path).name,
+                    cache_key(f),
+                )
+                for f in files
+            ]
+            try:
+                for fut in as_completed(futs):
+                    yield fut.result()
+            finally:
+                for fut in futs:
+                    fut.cancel()
+                self.stats.elapsed = time.perf_counter() - self.stats.started
+                telemetry.log("INFO", "fetch total", summary=self.stats.summary())
@@ -0,0 +1,188 @@
+"""Pipeline a stadi del worker: fetch → compute → publish.
+
+Ogni stadio ha i suoi thread e gli stadi sono collegati da code limitate::
+
+    SQS ─▶ fetch (FETCH_WORKERS) ─▶ [PREFETCH_DEPTH] ─▶ compute (COMPUTE_WORKERS)
+        ─▶ [PUBLISH_DEPTH] ─▶ publish (PUBLISH_WORKERS) ─▶ delete_message
+
+Mentre il job N è in ``Processor.run``, presign e download del job N+1 sono
+già in corso e upload/notifica del job N-1 terminano in background. Quando
+uno stadio è saturo il ``put`` sulla sua coda blocca lo stadio precedente,
+fino al receive da SQS: i job in volo sono al più
+``fetch + prefetch + compute + publish_depth + publish`` (vedi :attr:`max_jobs`).
+Un receive chiede fino a ``max_jobs`` meno i job in volo: i messaggi oltre i
+thread di fetch aspettano il proprio turno nello stadio fetch.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from rsna_pipeline.service import telemetry
+from rsna_pipeline.service.batching import BatchCoalescer
+from rsna_pipeline.service.runner import (
+    Clients,
+    PendingJob,
+    compute_job,
+    prepare_job,
+    publish_job,
+)
+
+
+@dataclass
+class _Item:
+    msg: dict
+    t0: float
+    job: PendingJob | None = None
+
+
+class JobPipeline:
+    """Esegue i messaggi SQS in tre stadi sovrapposti."""
+
+    def __init__(
+        self,
+        clients: Clients,
+        cfg: dict,
+        job_kwargs: Callable[[dict], dict | None],
+        *,
+        fetch_workers: int = 2,
+        prefetch_depth: int = 2,
+        compute_workers: int = 1,
+        publish_workers: int = 2,
+        publish_depth: int = 2,
+        cpu_slot=None,
+        batcher: BatchCoalescer | None = None,
+    ):
+        self.clients, self.cfg, self.job_kwargs = clients, cfg, job_kwargs
+        self.cpu_slot, self.batcher = cpu_slot, batcher
+        self.fetch_workers = max(1, fetch_workers)
+        self.max_jobs = (
+            self.fetch_workers + prefetch_depth + compute_workers + publish_depth + publish_workers
+        )
+        self._ready: queue.Queue[_Item] = queue.Queue(max(1, prefetch_depth))
+        self._done: queue.Queue[_Item] = queue.Queue(max(1, publish_depth))
+        self._cond = threading.Condition()
+        self._fetching = 0  # job nello stadio fetch, anche in attesa di un thread
+        self._in_flight = 0  # job in qualsiasi stadio
+        self._computing = 0  # job nello stadio compute
+        self._fetch_pool = ThreadPoolExecutor(self.fetch_workers, thread_name_prefix="fetch")
+        for name, target, n in (
+            ("compute", self._compute_loop, compute_workers),
+            ("publish", self._publish_loop, publish_workers),
+        ):
+            for i in range(max(1, n)):
+                threading.Thread(target=target, name=f"{name}-{i}", daemon=True).start()
+
+    # ------------------------------------------------------------ ingresso
+    def _accepting(self) -> bool:
+        return self._fetching < self.fetch_workers and self._in_flight < self.max_jobs
+
+    def free_slots(self) -> int:
+        """Messaggi da ricevere ora: posti liberi nella pipeline (``max_jobs``).
+
+        Zero finché lo stadio fetch ha già lavoro per tutti i suoi thread,
+        così i messaggi non restano ricevuti ma fermi in coda troppo a lungo.
+        """
+        with self._cond:
+            return self.max_jobs - self._in_flight if self._accepting() else 0
+
+    def busy(self) -> bool:
+        with self._cond:
+            return self._in_flight > 0
+
+    def compute_backlog(self) -> int:
+        """Job pronti per lo stadio compute o al suo interno (vedi ``BatchCoalescer``)."""
+        with self._cond:
+            return self._ready.qsize() + self._computing
+
+    def wait_slot(self, timeout: float | None = None) -> None:
+        with self._cond:
+            self._cond.wait_for(self._accepting, timeout)
+
+    def submit(self, msg: dict) -> None:
+        """Accoda un messaggio allo stadio fetch (attende se la pipeline è piena)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_flight < self.max_jobs)
+            self._fetching += 1
+            self._in_flight += 1
+        self._fetch_pool.submit(self._fetch, _Item(msg, time.perf_counter()))
+
+    # -------------------------------------------------------------- stadi
+    def _fetch(self, item: _Item) -> None:
+        try:
+            kwargs = self.job_kwargs(item.msg)
+            if kwargs is None:
+                self._finish(item, ok=False)
+                return
+            # le serie in streaming vengono già elaborate qui (vedi prepare_job)
+            item.job = prepare_job(clients=self.clients, cpu_slot=self.cpu_slot, **kwargs)
+            self._ready.put(item)  # blocca se compute è indietro
+        except Exception as e:
+            self._fail(item, "fetch", e)
+        finally:
+            with self._cond:
+                self._fetching -= 1
+                self._cond.notify_all()
+
+    def _compute_loop(self) -> None:
+        while True:
+            item = self._ready.get()
+            with self._cond:
+                self._computing += 1
+            try:
+                compute_job(item.job, self.cpu_slot, self.batcher)
+            except Exception as e:
+                self._fail(item, "compute", e)
+                continue
+            finally:
+                with self._cond:
+                    self._computing -= 1
+            self._done.put(item)  # blocca se publish è indietro
+
+    def _publish_loop(self) -> None:
+        while True:
+            item = self._done.get()
+            try:
+                publish_job(item.job)
+            except Exception as e:
+                self._fail(item, "publish", e)
+                continue
+            self._finish(item, ok=True)
+
+    # --------------------------------------------------------------- esito
+    def _fail(self, item: _Item, stage: str, e: Exception) -> None:
+        # il messaggio torna visibile allo scadere del visibility timeout
+        with telemetry.activate(item.job.trace if item.job else None):
+            telemetry.log(
+                "ERROR", "job failed", stage=stage, error=str(e), traceback=traceback.format_exc()
+            )
+        self._finish(item, ok=False)
+
+    def _finish(self, item: _Item, ok: bool) -> None:
+        trace = None
+        if item.job is not None:
+            trace = item.job.trace
+            item.job.cleanup()
+            item.job = None
+        try:
+            with telemetry.activate(trace):
+                if ok:
+                    self.clients.sqs.delete_message(
+                        QueueUrl=self.cfg["queue_url"], ReceiptHandle=item.msg["ReceiptHandle"]
+                    )
+                    telemetry.log("DEBUG", "deleted SQS message")
+                telemetry.log(
+                    "INFO", "job END", ok=ok, duration_s=round(time.perf_counter() - item.t0, 3)
+                )
+        except Exception as e:
+            telemetry.log("ERROR", "delete-message failed", error=str(e))
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
@@ -0,0 +1,170 @@
+"""Profiling opzionale di un job: cProfile + picco di memoria (tracemalloc).
+
+Si attiva per un singolo job con ``"profile": true`` nel messaggio, o per
+tutti i job con la variabile d'ambiente ``PROFILE=1``. Le fasi del job
+(fetch, compute – cioè ``Processor.run`` – e publish) vengono eseguite
+sotto un ``cProfile.Profile`` condiviso e con tracemalloc attivo; a fine
+job accanto al risultato, in ``s3://<output>/<study>/<series>/``, vengono
+caricati:
+
+  • ``<job_id>_profile.pstats`` – statistiche cProfile (``python -m pstats``, snakeviz, …)
+  • ``<job_id>_profile.txt``    – riepilogo: durata e picco di memoria per fase,
+                                  funzioni più costose, allocazioni più grandi
+
+Da spento il costo è nullo: nessun profiler, tracemalloc mai avviato.
+Si profila un job alla volta, ma gli altri proseguono in parallelo, quindi:
+
+  • picco di memoria e allocazioni vive (tracemalloc) sono del processo
+    intero, compresi gli altri job in volo; il riepilogo lo indica;
+  • cProfile fino a Python 3.11 vede solo il thread della fase (non i
+    thread di download né quelli per algoritmo), da 3.12 (sys.monitoring)
+    tutti i thread del processo, anche quelli degli altri job.
+
+Se un altro profiler è già attivo la fase viene solo cronometrata. Il
+lavoro eseguito nei processi del pool (serie per slice) non compare mai.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from typing import ContextManager, Iterator
+
+from rsna_pipeline.service import telemetry
+
+PROFILE = os.environ.get("PROFILE", "0") == "1"
+TOP_N = int(os.environ.get("PROFILE_TOP", "40"))  # righe per sezione del riepilogo
+
+_BUSY = threading.Lock()  # un solo job profilato alla volta
+_NULL = contextlib.nullcontext()
+
+
+def _other_profiler_active() -> bool:
+    """True se nel thread (o, da 3.12, nel processo) c'è già un profiler."""
+    if sys.version_info >= (3, 12):
+        return sys.monitoring.get_tool(sys.monitoring.PROFILER_ID) is not None
+    return sys.getprofile() is not None
+
+
+class JobProfile:
+    """Profilo di un job, accumulato fase per fase."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.prof = cProfile.Profile()
+        self.stages: dict[str, tuple[float, int]] = {}  # fase → (secondi, picco byte)
+        self.unprofiled: set[str] = set()  # fasi senza cProfile (profiler occupato)
+        self.snapshot: tracemalloc.Snapshot | None = None
+        self._tracing = False  # tracemalloc avviato da noi
+        self._closed = False
+
+    @classmethod
+    def start(cls, job_id: str) -> JobProfile | None:
+        """Nuovo profilo, o None se un altro job è già in profiling."""
+        if not _BUSY.acquire(blocking=False):
+            telemetry.log("WARNING", "profiler occupato da un altro job, salto", job_id=job_id)
+            return None
+        prof = cls(job_id)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            prof._tracing = True
+        telemetry.log("INFO", "profiling attivo", job_id=job_id)
+        return prof
+
+    @contextlib.contextmanager
+    def stage(self, name: str, snapshot: bool = False) -> Iterator[None]:
+        """Profila il blocco nel thread corrente; ``snapshot`` salva le allocazioni vive."""
+        tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        enabled = self._enable(name)
+        try:
+            yield
+        finally:
+            if enabled:
+                self.prof.disable()
+            seconds = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            if snapshot:
+                self.snapshot = tracemalloc.take_snapshot()
+            s0, p0 = self.stages.get(name, (0.0, 0))
+            self.stages[name] = (s0 + seconds, max(p0, peak))
+
+    def _enable(self, name: str) -> bool:
+        """Avvia cProfile per la fase; False (solo tempi) se c'è già un profiler."""
+        try:
+            if not _other_profiler_active():
+                self.prof.enable()
+                return True
+        except ValueError:  # 3.12+: un altro tool registrato nel frattempo
+            pass
+        self.unprofiled.add(name)
+        telemetry.log("WARNING", "profiler già attivo, fase solo cronometrata", stage=name)
+        return False
+
+    @property
+    def profiled(self) -> bool:
+        """True se almeno una fase è passata da cProfile."""
+        return bool(self.stages.keys() - self.unprofiled)
+
+    def summary(self) -> str:
+        out = io.StringIO()
+        out.write(f"job {self.job_id}\n\n{'stage':<10} {'seconds':>10} {'peak MB*':>10}\n")
+        for name, (seconds, peak) in self.stages.items():
+            note = "  (senza cProfile: profiler già attivo)" if name in self.unprofiled else ""
+            out.write(f"{name:<10} {seconds:>10.3f} {peak / 2**20:>10.1f}{note}\n")
+        out.write("* picco tracemalloc dell'intero processo: include gli altri job in volo\n")
+        scope = (
+            "tutti i thread del processo, anche altri job"
+            if sys.version_info >= (3, 12)
+            else "solo il thread di ogni fase"
+        )
+        out.write(f"\n--- top {TOP_N} per tempo cumulativo ({scope}) ---\n")
+        if self.profiled:
+            pstats.Stats(self.prof, stream=out).sort_stats("cumulative").print_stats(TOP_N)
+        else:
+            out.write("nessuna fase profilata\n\n")
+        if self.snapshot is not None:
+            out.write(f"--- top {TOP_N} allocazioni vive a fine compute (tutto il processo) ---\n")
+            for stat in self.snapshot.statistics("lineno")[:TOP_N]:
+                out.write(f"{stat}\n")
+        return out.getvalue()
+
+    def export(self, s3, bucket: str, prefix: str) -> None:
+        """Carica ``.pstats`` e riepilogo in ``s3://bucket/prefix<job_id>_profile.*``."""
+        base = f"{prefix}{self.job_id}_profile"
+        if self.profiled:
+            stats = pstats.Stats(self.prof)
+            s3.put_object(Bucket=bucket, Key=f"{base}.pstats", Body=marshal.dumps(stats.stats))
+        s3.put_object(
+            Bucket=bucket,
+            Key=f"{base}.txt",
+            Body=self.summary().encode(),
+            ContentType="text/plain; charset=utf-8",
+        )
+        uri = f"s3://{bucket}/{base}.txt"
+        telemetry.log("INFO", "profilo caricato", job_id=self.job_id, uri=uri)
+
+    def close(self) -> None:
+        """Ferma tracemalloc (se avviato qui) e libera il profiler (idempotente)."""
+        if self._closed:
+            return
+        self._closed = True
+        self.snapshot = None
+        if self._tracing:
+            tracemalloc.stop()
+        _BUSY.release()
+
+
+def stage(profile: JobProfile | None, name: str, snapshot: bool = False) -> ContextManager:
+    """``profile.stage(name)``, oppure un no-op condiviso se il job non è profilato."""
+    if profile is None:
+        return _NULL
+    return profile.stage(name, snapshot)
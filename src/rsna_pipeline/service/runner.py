@@ -1,26 +1,107 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import contextvars
+import io
 import json
 import os
-import shutil
 import tempfile
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Any, Iterator
 from urllib.parse import urlparse
 
 import boto3
 import numpy as np
 import pydicom
 import requests
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 
 
 import medical_image_processing.processing  # registra gli algoritmi
 from medical_image_processing.processing.base import Processor
-from medical_image_processing.utils.dicom_io import load_dicom
-from medical_image_processing.utils.dicom_writer import save_secondary_capture
-from medical_image_processing.utils.viz import overlay_mask
-import cv2
+from medical_image_processing.utils.cpu import cpu_count
+from medical_image_processing.utils.dicom_io import (
+    HUVolume,
+    iter_series,
+    load_dicom,
+    load_series,
+    stack_series,
+)
+from medical_image_processing.utils.dicom_writer import (
+    compression_of,
+    resolve_compression,
+    save_secondary_capture,
+    save_secondary_capture_frames,
+    save_segmentation,
+)
+from medical_image_processing.utils.viz import iter_overlay_frames, overlay_mask
+from rsna_pipeline.service.batching import BatchCoalescer
+from rsna_pipeline.service.cache import (
+    INPUT_CACHE,
+    ResultStore,
+    result_cache_key,
+    result_store_from_env,
+)
+from rsna_pipeline.service import profiling, telemetry
+from rsna_pipeline.service.fetch import MEMORY_BUDGET, SeriesFetcher, cache_key
+
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "32"))
+# upload multipart concorrente per i DICOM multi-frame delle serie
+UPLOAD_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024**2,
+    multipart_chunksize=8 * 1024**2,
+    max_concurrency=int(os.environ.get("UPLOAD_CONCURRENCY", "8")),
+)
+# formato del DICOM di output, scelto per job (campo "output" del messaggio):
+#   sc  – overlay RGB in una Secondary Capture (default)
+#   seg – DICOM Segmentation binaria, 1 bit per pixel
+OUTPUT_FORMATS = ("sc", "seg")
+# compressione lossless delle SC (none | rle | jpegls), sovrascrivibile per job
+OUTPUT_COMPRESSION = os.environ.get("OUTPUT_COMPRESSION", "none")
+# serie elaborate slice per slice mentre il download è in corso (0 = disattivato)
+SERIES_STREAMING = os.environ.get("SERIES_STREAMING", "1") != "0"
+
+@dataclass
+class Clients:
+    """Client S3/SQS/HTTP condivisi tra i job di uno stesso processo."""
+
+    s3: Any
+    sqs: Any
+    http: requests.Session
+
+    @classmethod
+    def from_env(cls) -> "Clients":
+        # AWS_ENDPOINT_URL permette di puntare a uno stand-in locale di SQS/S3
+        endpoint = os.environ.get("AWS_ENDPOINT_URL") or None
+        # pool HTTP dimensionato per i job concorrenti del worker
+        cfg = BotoConfig(max_pool_connections=HTTP_POOL_SIZE)
+        http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE)
+        http.mount("http://", adapter)
+        http.mount("https://", adapter)
+        return cls(
+            s3=boto3.client("s3", endpoint_url=endpoint, config=cfg),
+            sqs=boto3.client("sqs", endpoint_url=endpoint, config=cfg),
+            http=http,
+        )
+
+
+@dataclass
+class JobInput:
+    """Immagine (o serie) scaricata e decodificata, pronta per il Processor."""
+
+    img: HUVolume
+    src_ds: pydicom.Dataset
+    is_series: bool
+    base_name: str
+    headers: list[pydicom.Dataset] | None = None  # uno per slice (serie)
 
 
 def parse() -> argparse.Namespace:
@@ -31,194 +112,781 @@ def parse() -> argparse.Namespace:
     return ap.parse_args()
 
 
-def load_series(folder: Path):
-    files = sorted(
-        folder.glob("*.dcm"), key=lambda p: pydicom.dcmread(p).InstanceNumber
-    )
-    vols = [load_dicom(p)[0] for p in files]
-    return np.stack(vols, axis=0), pydicom.dcmread(files[0])
-
-
-def _get_presigned_from_pacs(pacs: dict[str, str]) -> list[dict]:
+def _get_presigned_from_pacs(
+    pacs: dict[str, str], http: requests.Session | None = None
+) -> list[dict]:
+    http = http or requests.Session()
     base = os.environ["PACS_API_BASE"]
     hdrs = {"x-api-key": os.environ["PACS_API_KEY"]}
     scope = pacs.get("scope", "image")
     if scope == "image":
         # Usa lo stesso path della preview React: /studies/{study_id}/images/{series_id}/{image_id}
         ep = f"{base}/studies/{pacs['study_id']}/images/{pacs['series_id']}/{pacs['image_id']}"
-        r = requests.get(ep, headers=hdrs, timeout=10)
-        print(f"[runner] GET {ep} → {r.status_code}")
+        # meta: etag/size per input cache e result cache (HEAD su S3 lato PACS API)
+        r = http.get(ep, headers=hdrs, timeout=10, params={"meta": "true"})
+        telemetry.log("DEBUG", "PACS API GET", url=ep, status=r.status_code)
         r.raise_for_status()
         return [r.json()]
     if scope == "series":
         ep = f"{base}/studies/{pacs['study_id']}/images"
-        r = requests.get(
+        r = http.get(
             ep, headers=hdrs, timeout=10, params={"series_id": pacs["series_id"]}
         )
-        print(f"[runner] GET {ep} → {r.status_code}")
+        telemetry.log("DEBUG", "PACS API GET", url=ep, status=r.status_code)
         r.raise_for_status()
         return r.json()
     raise ValueError("scope non valido")
 
 
-def _download(url: str, dst: Path) -> None:
-    r = requests.get(url, stream=True, timeout=15)
-    r.raise_for_status()
-    with open(dst, "wb") as f:
-        shutil.copyfileobj(r.raw, f)
+def _log_input_cache() -> None:
+    if telemetry.enabled("DEBUG"):  # stats() copia i contatori sotto lock
+        telemetry.log("DEBUG", "input cache", stats=INPUT_CACHE.stats().summary())
 
 
-def main() -> None:
+def fetch_input(
+    pacs_info: dict, tmp: Path, clients: Clients, files: list[dict] | None = None
+) -> JobInput:
+    """Presign via PACS API, download e decodifica dell'input del job.
+
+    ``files`` (risposta della PACS API) può essere già stato richiesto dal
+    chiamante, ad es. per la chiave della result cache.
+    """
+    if files is None:
+        files = _get_presigned_from_pacs(pacs_info, clients.http)
+    telemetry.log("INFO", "presigned files", files=len(files))
+    # in memoria finché c'è posto in MEMORY_BUDGET (tutti i job), poi su disco in tmp;
+    # input già visti da questo worker: dalla cache (S3 key, ETag)
+    with SeriesFetcher(clients.http, cache=INPUT_CACHE) as fetcher:
+        return _fetch_files(fetcher, pacs_info, tmp, files)
 
-    print("[runner] START")
-    print(f"[runner] ENVIRONMENT: {dict(os.environ)}")
+
+def _fetch_files(
+    fetcher: SeriesFetcher, pacs_info: dict, tmp: Path, files: list[dict]
+) -> JobInput:
+    if len(files) == 1:
+        dst = tmp / Path(urlparse(files[0]["url"]).path).name
+        telemetry.log("DEBUG", "downloading image", file=dst.name)
+        with telemetry.span("download"):
+            src = fetcher.fetch_one(files[0]["url"], dst, cache_key(files[0]))
+        with telemetry.span("decode"):
+            img, src_ds = load_dicom(src, compact=True)
+        telemetry.log("INFO", "loaded DICOM", shape=list(img.shape))
+        _log_input_cache()
+        return JobInput(img, src_ds, False, dst.stem)
+
+    series_dir = tmp / "series"
+    series_dir.mkdir()
+    # la decodifica parte sui file già scaricati mentre gli altri sono in volo
+    t0 = time.perf_counter()
+    img, headers = load_series(fetcher.iter_fetch(files, series_dir), compact=True)
+    # download e decodifica si sovrappongono: "decode" è solo la coda dopo l'ultimo file
+    telemetry.record("download", fetcher.stats.elapsed)
+    telemetry.record("decode", max(0.0, time.perf_counter() - t0 - fetcher.stats.elapsed))
+    src_ds = headers[0]
+    telemetry.log("INFO", "loaded series", shape=list(img.shape))
+    _log_input_cache()
+    base_name = pacs_info.get("series_id", str(uuid.uuid4()))
+    return JobInput(img, src_ds, True, base_name, headers)
+
+
+def stream_series(
+    pacs_info: dict,
+    tmp: Path,
+    clients: Clients,
+    files: list[dict],
+    proc: Processor,
+    cpu_slot=None,
+    output: str = "sc",
+) -> tuple[JobInput, tuple[dict, Iterator[np.ndarray] | None]]:
+    """Download, decodifica ed elaborazione di una serie in streaming.
+
+    Ogni slice va a ``proc`` (``run_unordered``) appena il suo file è
+    scaricato, in qualsiasi ordine; volume e maschere vengono riordinati per
+    posizione alla fine. Il tempo fino all'ultima slice è circa
+    max(download, calcolo) invece della somma. Richiede ``proc.PER_SLICE``.
+    Restituisce l'input e ``(res, overlay)`` come :func:`process_input`.
+    """
+    telemetry.log("INFO", "presigned files", files=len(files), streaming=True, algo=proc.ALGO_ID)
+    series_dir = tmp / "series"
+    series_dir.mkdir()
+    fetcher = SeriesFetcher(clients.http, cache=INPUT_CACHE)
+    frames: list[np.ndarray] = []
+    headers: list[pydicom.Dataset] = []
+
+    def arrived() -> Iterator[np.ndarray]:
+        for hu, ds in iter_series(fetcher.iter_fetch(files, series_dir), compact=True):
+            frames.append(hu)
+            headers.append(ds)
+            yield hu
+
+    masks: dict[int, np.ndarray] = {}
+    metas: dict[int, dict] = {}
+    # cpu_slot solo durante il calcolo delle slice: mentre si attendono i
+    # download gli altri job possono usare la CPU
     try:
-        args = parse()
-        print(f"[runner] args: {args}")
-        print(f"[runner] ENV: PACS_INFO={os.environ.get('PACS_INFO')}, PACS_API_BASE={os.environ.get('PACS_API_BASE')}, PACS_API_KEY={os.environ.get('PACS_API_KEY')}, CLIENT_ID={os.environ.get('CLIENT_ID')}, RESULTS_TOPIC_ARN={os.environ.get('RESULTS_TOPIC_ARN')}")
-        s3 = boto3.client("s3")
+        with telemetry.span("stream", proc.ALGO_ID):
+            for i, mask, meta in proc.run_unordered(arrived(), cpu_slot=cpu_slot):
+                masks[i], metas[i] = mask, meta
+    finally:
+        fetcher.release()  # file già decodificati: il budget torna agli altri job
+    telemetry.record("download", fetcher.stats.elapsed)
+    img, headers, order = stack_series(frames, headers)
+    frames.clear()
+    telemetry.log("INFO", "loaded series", shape=list(img.shape))
+    _log_input_cache()
+    res = {
+        "mask": np.stack([masks.pop(i) for i in order]),
+        "labels": None,
+        "meta": {"series": [metas[i] for i in order], "algo": proc.ALGO_ID},
+    }
+    base_name = pacs_info.get("series_id", str(uuid.uuid4()))
+    inp = JobInput(img, headers[0], True, base_name, headers)
+    overlay = None if output == "seg" else iter_overlay_frames(img, res["mask"])
+    return inp, (res, overlay)
 
-        with tempfile.TemporaryDirectory() as tmp:
-            print(f"[runner] tempdir: {tmp}")
-            print(f"[runner] DEBUG: job_id={args.job_id}, algo={args.algo}, s3_output={args.s3_output}")
-            try:
-                pacs_info_raw = os.environ["PACS_INFO"]
-                print(f"[runner] PACS_INFO raw: {pacs_info_raw}")
-                pacs_info = json.loads(pacs_info_raw)
-                print(f"[runner] PACS_INFO loaded: {pacs_info}")
-            except Exception as e:
-                print(f"[runner] ERROR loading PACS_INFO: {e}")
-                import traceback; traceback.print_exc()
-                raise
 
-            try:
-                print(f"[runner] DEBUG: calling _get_presigned_from_pacs with pacs_info={pacs_info}")
-                files = _get_presigned_from_pacs(pacs_info)
-                print(f"[runner] presigned files: {files}")
-            except Exception as e:
-                print(f"[runner] ERROR during PACS download: {e}")
-                import traceback; traceback.print_exc()
-                raise
+def process_input(
+    inp: JobInput,
+    proc: Processor,
+    cpu_slot=None,
+    output: str = "sc",
+    batcher: BatchCoalescer | None = None,
+) -> tuple[dict, np.ndarray | Iterator[np.ndarray] | None]:
+    """Esegue il Processor e costruisce l'overlay RGB da salvare.
 
-            try:
-                print(f"[runner] DEBUG: files to download: {files}")
-                if len(files) == 1:
-                    dst = Path(tmp) / Path(urlparse(files[0]["url"]).path).name
-                    print(f"[runner] downloading image to {dst} from {files[0]['url']}")
-                    _download(files[0]["url"], dst)
-                    print(f"[runner] downloaded: {dst}")
-                    img, src_ds = load_dicom(dst)
-                    print(f"[runner] loaded DICOM: img shape={getattr(img, 'shape', None)}, src_ds={src_ds}")
-                    is_series = False
-                    base_name = Path(dst).stem
-                else:
-                    series_dir = Path(tmp) / "series"
-                    series_dir.mkdir()
-                    for f in files:
-                        print(f"[runner] downloading series file: {f['url']} to {series_dir / Path(urlparse(f['url']).path).name}")
-                        _download(f["url"], series_dir / Path(urlparse(f["url"]).path).name)
-                    img, src_ds = load_series(series_dir)
-                    print(f"[runner] loaded series: img shape={getattr(img, 'shape', None)}, src_ds={src_ds}")
-                    is_series = True
-                    base_name = pacs_info.get("series_id", str(uuid.uuid4()))
-            except Exception as e:
-                print(f"[runner] ERROR during DICOM download/parsing: {e}")
-                import traceback; traceback.print_exc()
-                raise
+    Per i volumi (Z,H,W) l'overlay è un iteratore di frame (H,W,3), generati
+    solo mentre vengono scritti nel DICOM multi-frame. Con ``output="seg"``
+    l'overlay non serve e viene restituito None.
+    ``cpu_slot`` (es. un ``threading.Semaphore``) limita quante fasi CPU-bound
+    girano insieme quando più job condividono lo stesso processo.
+    Con ``batcher`` le slice 2‑D vengono elaborate in batch con quelle degli
+    altri job in corso (vedi :mod:`rsna_pipeline.service.batching`).
+    """
+    telemetry.log("INFO", "running processor", algo=proc.ALGO_ID, shape=list(inp.img.shape))
+    res = None
+    algo = proc.ALGO_ID
+    if batcher is not None and inp.img.ndim == 2:
+        with telemetry.span("process", algo):
+            res = batcher.run(proc, inp.img)  # il batch prende cpu_slot da sé
+    with cpu_slot or contextlib.nullcontext():
+        if res is None:
+            with telemetry.span("process", algo):
+                res = proc.run(inp.img)
+        if output == "seg":
+            return res, None
+        if inp.img.ndim == 3:
+            # overlay generato frame per frame durante l'encode
+            overlay = iter_overlay_frames(inp.img, res["mask"])
+            telemetry.log("DEBUG", "overlay frames", frames=inp.img.shape[0])
+            return res, overlay
+        with telemetry.span("overlay", algo):
+            overlay = overlay_mask(inp.img, res["mask"])  # shape (H,W,3), dtype=uint8
+    telemetry.log("DEBUG", "overlay", shape=list(overlay.shape))
+    return res, overlay
 
-            try:
-                print(f"[runner] running processor: {args.algo} on img shape={getattr(img, 'shape', None)}")
-                proc = Processor.factory(args.algo)
-                print(f"[runner] processor instance: {proc}")
-                res = proc.run(img)
-                print(f"[runner] result: {res}")
-                mask = res["mask"]
-                overlay = overlay_mask(img, mask)  # shape (H,W,3), dtype=uint8
-                print(f"[runner] overlay shape: {getattr(overlay, 'shape', None)}")
-            except Exception as e:
-                print(f"[runner] ERROR during processing: {e}")
-                import traceback; traceback.print_exc()
-                raise
 
-            try:
-                out_name = f"{base_name}_{args.algo}.dcm"
-                out_path = Path(tmp) / out_name
-                print(f"[runner] saving DICOM: {out_path} (algo={args.algo}, is_series={is_series})")
-                save_secondary_capture(
+def _slice_locations(headers: list[pydicom.Dataset] | None) -> list[float] | None:
+    if not headers or any("SliceLocation" not in h for h in headers):
+        return None
+    return [float(h.SliceLocation) for h in headers]
+
+
+def publish_result(
+    overlay: np.ndarray | Iterator[np.ndarray] | None,
+    inp: JobInput,
+    tmp: Path,
+    pacs_info: dict,
+    *,
+    algo: str,
+    s3_output: str,
+    job_id: str,
+    client_id: str,
+    result_queue: str,
+    clients: Clients,
+    output: str = "sc",
+    mask: np.ndarray | None = None,
+    compression: str = OUTPUT_COMPRESSION,
+    trace_id: str | None = None,
+    timing: dict[str, int] | None = None,
+) -> dict:
+    """Salva il DICOM derivato, lo carica su S3 e notifica RESULT_QUEUE.
+
+    ``output="seg"`` salva ``mask`` come DICOM Segmentation invece
+    dell'overlay (già a 1 bit: ``compression`` vale solo per le SC).
+    Formato e compressione *effettiva* entrano nel nome del file (vedi
+    :func:`_result_suffix`): opzioni diverse non si sovrascrivono a vicenda, e
+    se il writer ripiega (codec assente, frame che non si comprime) il nome e
+    il ``transfer_syntax`` del messaggio descrivono il file davvero scritto.
+    """
+    compression = resolve_compression(compression)
+    out_path = tmp / f"{inp.base_name}{_result_suffix(algo, output, compression)}.dcm"
+    # dimensione massima del DICOM (pixel non compressi): sotto soglia si
+    # serializza in un buffer e lo si carica con upload_fileobj, senza disco
+    n_px = int(np.prod(inp.img.shape))
+    est_bytes = n_px // 8 if output == "seg" else n_px * 3
+    # il buffer prenota i suoi byte nel budget condiviso finché l'upload non è finito
+    with MEMORY_BUDGET.hold(est_bytes) as in_memory:
+        out = io.BytesIO() if in_memory else out_path
+        with telemetry.span("encode", algo):
+            if output == "seg":
+                stats = save_segmentation(mask, inp.headers or [inp.src_ds], out, algo_id=algo)
+            elif inp.img.ndim == 3:
+                # serie: un solo DICOM multi-frame, scritto frame per frame
+                stats = save_secondary_capture_frames(
+                    overlay,
+                    inp.img.shape[0],
+                    inp.src_ds,
+                    out,
+                    algo_id=algo,
+                    slice_locations=_slice_locations(inp.headers),
+                    compression=compression,
+                )
+            else:
+                stats = save_secondary_capture(
                     overlay,             # immagine RGB
-                    src_ds,
-                    out_path,
-                    algo_id=args.algo,
-                    is_series=is_series
+                    inp.src_ds,
+                    out,
+                    algo_id=algo,
+                    is_series=inp.is_series,
+                    compression=compression,
                 )
-                print(f"[runner] DICOM saved: {out_path}")
-            except Exception as e:
-                print(f"[runner] ERROR during DICOM save: {e}")
-                import traceback; traceback.print_exc()
-                raise
+        telemetry.log("INFO", "pixel data", job_id=job_id, stats=stats.summary())
+        if stats.fallback is not None:
+            telemetry.log("INFO", "compression fallback", algo=algo, reason=stats.fallback)
+        suffix = _result_suffix(algo, output, stats.compression)
+        if isinstance(out, io.BytesIO):
+            mb = out.getbuffer().nbytes / 1e6
+            telemetry.log("DEBUG", "DICOM saved in memory", mb=round(mb, 1))
+        else:
+            mb = out_path.stat().st_size / 1e6
+            telemetry.log("DEBUG", "DICOM saved", path=str(out_path), mb=round(mb, 1))
 
-            try:
-                # Struttura output: study_id/series_id/image_id_processing_1.dcm
-                dest_key = f"{pacs_info['study_id']}/{pacs_info['series_id']}/"
-                # Sostituisci .dcm con _{args.algo}.dcm
-                base_image_name = pacs_info['image_id'].replace('.dcm', f'_{args.algo}.dcm')
-                dest_key = f"{dest_key}{base_image_name}"
-                print(f"[runner] uploading to S3: bucket={args.s3_output} key={dest_key} file={out_path}")
-                s3.upload_file(str(out_path), args.s3_output, dest_key)
-                print(f"[runner] S3 upload complete: s3://{args.s3_output}/{dest_key}")
-            except Exception as e:
-                print(f"[runner] ERROR during S3 upload: {e}")
-                import traceback; traceback.print_exc()
-                raise
+        # Struttura output: study_id/series_id/image_id_processing_1[_rle|_seg].dcm
+        # (serie: study_id/series_id/series_id_processing_1[_rle|_seg].dcm)
+        dest_key = _result_prefix(pacs_info)
+        # Sostituisci .dcm con _{algo}.dcm
+        image_id = f"{inp.base_name}.dcm" if inp.is_series else pacs_info['image_id']
+        base_image_name = image_id.replace('.dcm', f'{suffix}.dcm')
+        dest_key = f"{dest_key}{base_image_name}"
+        with telemetry.span("upload", algo):
+            if isinstance(out, io.BytesIO):
+                out.seek(0)
+                clients.s3.upload_fileobj(out, s3_output, dest_key, Config=UPLOAD_CONFIG)
+            else:
+                clients.s3.upload_file(str(out_path), s3_output, dest_key, Config=UPLOAD_CONFIG)
+    telemetry.log("INFO", "S3 upload complete", uri=f"s3://{s3_output}/{dest_key}")
+    return notify_result(
+        dest_key,
+        algo=algo,
+        s3_output=s3_output,
+        job_id=job_id,
+        client_id=client_id,
+        result_queue=result_queue,
+        clients=clients,
+        output=output,
+        transfer_syntax=stats.transfer_syntax,
+        trace_id=trace_id,
+        timing=timing,
+    )
 
-            try:
-                presigned = s3.generate_presigned_url(
-                    "get_object",
-                    Params={"Bucket": args.s3_output, "Key": dest_key},
-                    ExpiresIn=86_400,
+
+def notify_result(
+    dest_key: str,
+    *,
+    algo: str,
+    s3_output: str,
+    job_id: str,
+    client_id: str,
+    result_queue: str,
+    clients: Clients,
+    output: str = "sc",
+    transfer_syntax: str | None = None,
+    cached: bool = False,
+    trace_id: str | None = None,
+    timing: dict[str, int] | None = None,
+) -> dict:
+    """Presigna ``dest_key`` e invia il messaggio di risultato a RESULT_QUEUE.
+
+    ``trace_id`` e ``timing`` (istanti epoch ms dei passaggi precedenti, vedi
+    :func:`telemetry.stamp`) vengono riportati nel messaggio insieme
+    all'istante di invio ``published``: ``result_push`` ne ricava le latenze.
+    """
+    with telemetry.span("notify", algo):
+        presigned = clients.s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": s3_output, "Key": dest_key},
+            ExpiresIn=86_400,
+        )
+
+        # Invia direttamente in SQS sulla coda callback fornita dal client
+        message = {
+            "job_id": job_id,
+            "algo_id": algo,
+            "format": output,
+            "dicom": {
+                "bucket": s3_output,
+                "key": dest_key,
+                "url": presigned,
+            },
+            "client_id": client_id,
+        }
+        if transfer_syntax is not None:
+            message["transfer_syntax"] = str(transfer_syntax)
+        if cached:
+            message["cached"] = True
+        if trace_id is not None:
+            message["trace_id"] = trace_id
+        if timing is not None:
+            message["timing"] = telemetry.stamp(timing, "published")
+        resp = clients.sqs.send_message(
+            QueueUrl=result_queue,
+            MessageBody=json.dumps(message),
+            MessageAttributes={
+                "client_id": {
+                    "DataType": "String",
+                    "StringValue": client_id,
+                }
+            },
+            MessageGroupId=job_id,
+        )
+    telemetry.log("INFO", "SQS send_message", message_id=resp.get("MessageId"))
+    return message
+
+
+def run_job(
+    pacs_info: dict,
+    *,
+    algo: str,
+    s3_output: str,
+    job_id: str,
+    client_id: str,
+    result_queue: str,
+    clients: Clients | None = None,
+    processor: Processor | None = None,
+    cpu_slot=None,
+    output: str = "sc",
+    compression: str | None = None,
+    result_store: ResultStore | None = None,
+    batcher: BatchCoalescer | None = None,
+    trace_id: str | None = None,
+    timing: dict[str, int] | None = None,
+    profile: bool | None = None,
+) -> dict:
+    """Esegue un job end-to-end e restituisce il messaggio inviato a RESULT_QUEUE.
+
+    ``clients`` e ``processor`` possono essere riusati tra job successivi
+    (vedi ``rsna_pipeline.service.worker``); se assenti vengono creati qui.
+    ``cpu_slot`` e ``batcher`` vengono passati a :func:`process_input`; ``output`` è uno di
+    ``OUTPUT_FORMATS``, ``compression`` (default ``OUTPUT_COMPRESSION``) una
+    delle compressioni di ``dicom_writer.COMPRESSIONS``.
+
+    Prima di scaricare l'input si consulta la result cache (``result_store``,
+    default da env RESULT_CACHE): se lo stesso input è già stato elaborato
+    con lo stesso algoritmo, versione, parametri e opzioni di output, si
+    ripresigna il DICOM esistente e si notifica subito RESULT_QUEUE.
+
+    ``trace_id`` e ``timing`` arrivano dal messaggio del router e vengono
+    riportati nel messaggio di risultato (latenze end-to-end); ``profile``
+    (default env PROFILE) attiva il profiling del job (vedi
+    :mod:`rsna_pipeline.service.profiling`).
+    """
+    return run_multi_job(
+        pacs_info,
+        algos=[algo],
+        s3_output=s3_output,
+        job_id=job_id,
+        client_id=client_id,
+        result_queue=result_queue,
+        clients=clients,
+        processors={algo: processor} if processor is not None else None,
+        cpu_slot=cpu_slot,
+        output=output,
+        compression=compression,
+        result_store=result_store,
+        batcher=batcher,
+        trace_id=trace_id,
+        timing=timing,
+        profile=profile,
+    )[0]
+
+
+def run_multi_job(
+    pacs_info: dict,
+    *,
+    algos: list[str],
+    s3_output: str,
+    job_id: str,
+    client_id: str,
+    result_queue: str,
+    clients: Clients | None = None,
+    processors: dict[str, Processor] | None = None,
+    cpu_slot=None,
+    output: str = "sc",
+    compression: str | None = None,
+    result_store: ResultStore | None = None,
+    batcher: BatchCoalescer | None = None,
+    trace_id: str | None = None,
+    timing: dict[str, int] | None = None,
+    profile: bool | None = None,
+) -> list[dict]:
+    """Come :func:`run_job` ma con più algoritmi sullo stesso input.
+
+    L'input viene scaricato e decodificato una sola volta; i Processor
+    girano in parallelo sullo stesso volume HU (limitati da ``cpu_slot``) e
+    per ogni algoritmo viene pubblicato un risultato, nell'ordine di
+    ``algos``. Gli algoritmi già presenti nella result cache non vengono
+    rieseguiti.
+
+    Le tre fasi (:func:`prepare_job`, :func:`compute_job`,
+    :func:`publish_job`) sono usabili anche separatamente, ad es. dalla
+    pipeline a stadi del worker.
+    """
+    job = prepare_job(
+        pacs_info,
+        algos=algos,
+        s3_output=s3_output,
+        job_id=job_id,
+        client_id=client_id,
+        result_queue=result_queue,
+        clients=clients,
+        processors=processors,
+        output=output,
+        compression=compression,
+        result_store=result_store,
+        cpu_slot=cpu_slot,
+        trace_id=trace_id,
+        timing=timing,
+        profile=profile,
+    )
+    try:
+        compute_job(job, cpu_slot, batcher)
+        return publish_job(job)
+    finally:
+        job.cleanup()
+
+
+@dataclass
+class PendingJob:
+    """Stato di un job tra le fasi prepare → compute → publish."""
+
+    pacs_info: dict
+    algos: list[str]
+    processors: dict[str, Processor]
+    s3_output: str
+    output: str
+    compression: str
+    notify: dict  # job_id, client_id, result_queue, clients, trace_id, timing
+    store: ResultStore | None
+    rkeys: dict[str, str | None]
+    messages: dict[str, dict]  # risultati già pubblicati (result cache)
+    files: list[dict] | None = None  # risposta della PACS API (chiavi della result cache)
+    inp: JobInput | None = None
+    results: dict[str, tuple] | None = None
+    trace: telemetry.Trace | None = None
+    profile: profiling.JobProfile | None = None
+    _tmp: tempfile.TemporaryDirectory | None = None
+
+    @property
+    def todo(self) -> list[str]:
+        return [a for a in self.algos if a not in self.messages]
+
+    @property
+    def tmp(self) -> Path:
+        return Path(self._tmp.name)
+
+    def cleanup(self) -> None:
+        """Libera input, risultati e file temporanei (idempotente).
+
+        Un job ripulito senza essere pubblicato conta come errore.
+        """
+        if self.trace is not None:
+            self.trace.finish(False)
+        if self.profile is not None:
+            self.profile.close()
+            self.profile = None
+        self.inp = self.results = None
+        if self._tmp is not None:
+            self._tmp.cleanup()
+            self._tmp = None
+
+
+def prepare_job(
+    pacs_info: dict,
+    *,
+    algos: list[str],
+    s3_output: str,
+    job_id: str,
+    client_id: str,
+    result_queue: str,
+    clients: Clients | None = None,
+    processors: dict[str, Processor] | None = None,
+    output: str = "sc",
+    compression: str | None = None,
+    result_store: ResultStore | None = None,
+    cpu_slot=None,
+    stream: bool | None = None,
+    trace_id: str | None = None,
+    timing: dict[str, int] | None = None,
+    profile: bool | None = None,
+) -> PendingJob:
+    """Fase I/O iniziale: presign, result cache e download/decodifica dell'input.
+
+    I risultati trovati in cache vengono notificati subito; l'input si
+    scarica solo se resta almeno un algoritmo da eseguire. Una serie con un
+    solo algoritmo per slice da eseguire viene elaborata già qui, in
+    streaming durante il download (``stream``, default ``SERIES_STREAMING``;
+    vedi :func:`stream_series`); ``cpu_slot`` serve solo in quel caso.
+    """
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(f"output non valido: {output!r} (ammessi: {OUTPUT_FORMATS})")
+    if not algos or len(set(algos)) != len(algos):
+        raise ValueError(f"algos non valido: {algos!r}")
+    clients = clients or Clients.from_env()
+    processors = dict(processors or {})
+    for algo in algos:
+        processors.setdefault(algo, Processor.factory(algo))
+    # jpegls senza codec → rle già qui: nome del file e chiave della result cache
+    requested = compression or OUTPUT_COMPRESSION
+    compression = resolve_compression(requested)
+    telemetry.log(
+        "INFO", "job START", job_id=job_id, trace_id=trace_id, algos=algos, pacs=pacs_info
+    )
+    if compression != requested:
+        telemetry.log(
+            "INFO", "compression fallback", job_id=job_id, trace_id=trace_id,
+            requested=requested, used=compression, reason="codec non disponibile (extra 'jpegls')",
+        )
+    notify = dict(
+        job_id=job_id, client_id=client_id, result_queue=result_queue, clients=clients,
+        trace_id=trace_id, timing=timing,
+    )
+
+    store = result_store or result_store_from_env(clients.s3, s3_output)
+    job = PendingJob(
+        pacs_info, list(algos), processors, s3_output, output, compression,
+        notify, store, rkeys={}, messages={}, trace=telemetry.Trace(job_id, algos, trace_id=trace_id),
+    )
+    profile = profiling.PROFILE if profile is None else bool(profile)
+    if profile:
+        job.profile = profiling.JobProfile.start(job_id)
+    with telemetry.activate(job.trace):
+        try:
+            with profiling.stage(job.profile, "fetch"):
+                with telemetry.span("presign"):
+                    files = _get_presigned_from_pacs(pacs_info, clients.http)
+                _prepare(job, files, clients, cpu_slot, stream)
+        except BaseException:
+            job.cleanup()
+            raise
+    return job
+
+
+def _prepare(job: PendingJob, files: list, clients: Clients, cpu_slot, stream: bool | None) -> None:
+    """Corpo di :func:`prepare_job`: result cache, poi download (o streaming)."""
+    pacs_info, processors, store, notify = job.pacs_info, job.processors, job.store, job.notify
+    output = job.output
+    job.files = files
+    for algo in job.algos:
+        job.rkeys[algo] = _result_key(job, algo, job.compression) if store is not None else None
+        rkey = job.rkeys[algo]
+        hit = _cached_result(store, rkey, clients) if rkey else None
+        if hit is not None:
+            telemetry.log(
+                "INFO", "result cache hit", algo=algo, rkey=rkey[:12],
+                uri=f"s3://{hit['bucket']}/{hit['key']}",
+            )
+            job.messages[algo] = notify_result(
+                hit["key"],
+                algo=algo,
+                s3_output=hit["bucket"],
+                output=hit.get("format", output),
+                transfer_syntax=hit.get("transfer_syntax"),
+                cached=True,
+                **notify,
+            )
+
+    todo = job.todo
+    if todo:
+        stream = SERIES_STREAMING if stream is None else stream
+        job._tmp = tempfile.TemporaryDirectory()
+        if stream and len(files) > 1 and len(todo) == 1 and processors[todo[0]].PER_SLICE:
+            job.inp, result = stream_series(
+                pacs_info, job.tmp, clients, files, processors[todo[0]], cpu_slot, output
+            )
+            job.results = {todo[0]: result}
+        else:
+            job.inp = fetch_input(pacs_info, job.tmp, clients, files)
+
+
+def compute_job(job: PendingJob, cpu_slot=None, batcher: BatchCoalescer | None = None) -> None:
+    """Fase CPU: esegue i Processor ancora da calcolare sull'input del job."""
+    done = job.results or {}
+    todo = [a for a in job.todo if a not in done]
+    if not todo:
+        return
+    # stesso input (sola lettura) per tutti i Processor; la CPU resta
+    # limitata da cpu_slot (di default: un algoritmo per CPU)
+    slot = cpu_slot or threading.BoundedSemaphore(cpu_count())
+    if job.profile is not None:
+        batcher = None  # il batch può girare nel thread di un altro job
+    with telemetry.activate(job.trace), profiling.stage(job.profile, "compute", snapshot=True):
+        if len(todo) == 1 or job.profile is not None:
+            # con il profiler (per thread) gli algoritmi girano in sequenza qui
+            job.results = {
+                **done,
+                **{
+                    a: process_input(job.inp, job.processors[a], slot, job.output, batcher)
+                    for a in todo
+                },
+            }
+            return
+        with ThreadPoolExecutor(len(todo), thread_name_prefix="algo") as pool:
+            # ogni thread parte da una copia del contesto: stessa trace del job
+            futs = {
+                a: pool.submit(
+                    contextvars.copy_context().run,
+                    process_input, job.inp, job.processors[a], slot, job.output, batcher,
                 )
-                print(f"[runner] presigned result url: {presigned}")
-            except Exception as e:
-                print(f"[runner] ERROR during presigned url generation: {e}")
-                import traceback; traceback.print_exc()
-                raise
+                for a in todo
+            }
+            job.results = {**done, **{a: f.result() for a, f in futs.items()}}
+
 
+def publish_job(job: PendingJob) -> list[dict]:
+    """Fase I/O finale: encode, upload, notifica e result cache; poi cleanup."""
+    cache_hits = len(job.messages)
+    try:
+        with telemetry.activate(job.trace), profiling.stage(job.profile, "publish"):
+            for algo in job.todo:
+                res, overlay = job.results.pop(algo)
+                job.messages[algo] = publish_result(
+                    overlay,
+                    job.inp,
+                    job.tmp,
+                    job.pacs_info,
+                    algo=algo,
+                    s3_output=job.s3_output,
+                    output=job.output,
+                    mask=res["mask"],
+                    compression=job.compression,
+                    **job.notify,
+                )
+                _store_result(
+                    job.store, _published_keys(job, algo), job.messages[algo], job.s3_output,
+                    job.output, job.notify["clients"],
+                )
+        if job.trace is not None:
+            job.trace.finish(True, cache_hits=cache_hits)
+        if job.profile is not None:
             try:
-                # Invia direttamente in SQS sulla coda callback fornita dal client
-                sqs_client = boto3.client("sqs")
-                message = {
-                    "job_id": args.job_id,
-                    "algo_id": args.algo,
-                    "dicom": {
-                        "bucket": args.s3_output,
-                        "key": dest_key,
-                        "url": presigned,
-                    },
-                    "client_id": os.environ.get("CLIENT_ID", "unknown")
-                }
-                print(f"[runner] sending result to SQS: {os.environ['RESULT_QUEUE']}")
-                print(f"[runner] SQS message: {json.dumps(message)}")
-                resp = sqs_client.send_message(
-                    QueueUrl=os.environ["RESULT_QUEUE"],
-                    MessageBody=json.dumps(message),
-                    MessageAttributes={
-                        "client_id": {
-                            "DataType": "String",
-                            "StringValue": os.environ.get("CLIENT_ID","unknown")
-                        }
-                    },
-                    MessageGroupId=args.job_id
+                job.profile.export(
+                    job.notify["clients"].s3, job.s3_output, _result_prefix(job.pacs_info)
                 )
-                print(f"[runner] SQS send_message response: {resp}")
-            except Exception as e:
-                print(f"[runner] ERROR during SQS send_message: {e}")
-                import traceback; traceback.print_exc()
-                raise
-        print("[runner] END OK")
+            except Exception as e:  # il risultato è già pubblicato
+                telemetry.log("WARNING", "profile export failed", error=str(e))
+        return [job.messages[a] for a in job.algos]
+    finally:
+        job.cleanup()
+
+
+def _result_suffix(algo: str, output: str, compression: str) -> str:
+    """``_<algo>`` + ``_seg`` o ``_<compressione>`` (SC non compresse: nessun suffisso)."""
+    if output == "seg":
+        return f"_{algo}_seg"
+    return f"_{algo}" if compression == "none" else f"_{algo}_{compression}"
+
+
+def _result_prefix(pacs_info: dict) -> str:
+    """Prefisso S3 dei risultati (e dei profili) di uno studio/serie."""
+    return f"{pacs_info['study_id']}/{pacs_info['series_id']}/"
+
+
+def _result_key(job: PendingJob, algo: str, compression: str) -> str | None:
+    proc = job.processors[algo]
+    return result_cache_key(
+        job.pacs_info, job.files, algo, proc.VERSION, proc.cache_params(),
+        output=job.output, compression=compression if job.output == "sc" else None,
+    )
+
+
+def _published_keys(job: PendingJob, algo: str) -> list[str]:
+    """Chiavi della result cache del risultato pubblicato: richiesta ed effettiva.
+
+    Se il writer ripiega (es. rle senza guadagno → non compresso) il file è
+    lo stesso di una richiesta ``none``: una voce per entrambe, così un job
+    non invalida (ETag) quella dell'altro.
+    """
+    rkey = job.rkeys.get(algo)
+    if rkey is None:
+        return []
+    keys = [rkey]
+    ts = job.messages[algo].get("transfer_syntax")
+    if job.output == "sc" and ts is not None and compression_of(ts) != job.compression:
+        keys.append(_result_key(job, algo, compression_of(ts)))
+    return keys
+
+
+def _store_result(
+    store: ResultStore | None,
+    rkeys: list[str],
+    message: dict,
+    s3_output: str,
+    output: str,
+    clients: Clients,
+) -> None:
+    if store is None or not rkeys:
+        return
+    entry = {
+        "bucket": s3_output,
+        "key": message["dicom"]["key"],
+        "format": output,
+        "transfer_syntax": message.get("transfer_syntax"),
+    }
+    try:
+        # l'ETag rileva se lo stesso key viene poi sovrascritto (es. altri parametri)
+        entry["etag"] = clients.s3.head_object(Bucket=s3_output, Key=entry["key"])["ETag"]
+        for rkey in rkeys:
+            store.put(rkey, entry)
+    except Exception as e:  # la cache non deve far fallire un job riuscito
+        telemetry.log("WARNING", "result cache put failed", error=str(e))
+
+
+def _cached_result(store: ResultStore, rkey: str, clients: Clients) -> dict | None:
+    """Voce della result cache, solo se l'oggetto di output esiste ancora invariato."""
+    try:
+        entry = store.get(rkey)
+        if entry is None:
+            return None
+        head = clients.s3.head_object(Bucket=entry["bucket"], Key=entry["key"])
+        if head["ETag"] != entry.get("etag"):
+            telemetry.log("INFO", "result cache stale: output sovrascritto", rkey=rkey[:12])
+            return None
+        return entry
+    except Exception as e:  # oggetto rimosso (lifecycle) o store non raggiungibile
+        telemetry.log("DEBUG", "result cache miss", rkey=rkey[:12], error=str(e))
+        return None
+
+
+def main() -> None:
+
+    telemetry.log("INFO", "runner START")
+    try:
+        args = parse()
+        telemetry.log("DEBUG", "runner args", args=vars(args))
+        pacs_info = json.loads(os.environ["PACS_INFO"])
+        run_job(
+            pacs_info,
+            algo=args.algo,
+            s3_output=args.s3_output,
+            job_id=args.job_id,
+            client_id=os.environ.get("CLIENT_ID", "unknown"),
+            result_queue=os.environ["RESULT_QUEUE"],
+            output=os.environ.get("OUTPUT_FORMAT", "sc"),
+        )
+        telemetry.log("INFO", "runner END OK")
     except Exception as e:
-        print(f"[runner] ERROR: {e}", flush=True)
         import traceback
-        traceback.print_exc()
+        telemetry.log("ERROR", "runner failed", error=str(e), traceback=traceback.format_exc())
         raise
 
 
@@ -0,0 +1,283 @@
+"""Telemetria dei job: span per fase, metriche CloudWatch EMF e log JSON.
+
+Ogni job ha una :class:`Trace`; le fasi del runner (presign, download,
+decode, process, overlay, encode, upload, notify) e i passi interni dei
+Processor (``utils.timing.step``) vi aggiungono la loro durata. Alla fine
+del job la trace emette un documento EMF per algoritmo (dimensione
+``Algo``; ``job_id`` è una proprietà, non una dimensione, per non creare
+una metrica per job; lo stesso vale per ``trace_id``, l'identificativo
+assegnato dal router e comune a tutti i log del job, dalla Lambda al
+worker a ``result_push``). Variabili d'ambiente:
+
+  • TELEMETRY        – stdout (EMF/JSON su stdout, default) | local:<file.jsonl> | off
+                       (off spegne le metriche, non i log)
+  • TELEMETRY_SAMPLE – frazione di job con il dettaglio degli span (default 1.0);
+                       durata ed esito del job sono emessi sempre
+  • LOG_LEVEL        – DEBUG (righe per file, slice e span) | INFO (default) | WARNING | ERROR
+
+I log del servizio (:func:`log`) sono righe JSON con ``level``, ``msg``,
+``job_id``/``trace_id``/``algo`` del job corrente e i campi passati; vanno
+su stdout, o nel file con ``TELEMETRY=local:<file>``.
+
+Il dettaglio di un file locale si riassume con::
+
+    python -m rsna_pipeline.service.telemetry summary telemetry.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Iterator, TextIO
+
+import numpy as np
+
+from medical_image_processing.utils.timing import set_step_hook
+
+TELEMETRY = os.environ.get("TELEMETRY", "stdout")
+TELEMETRY_SAMPLE = float(os.environ.get("TELEMETRY_SAMPLE", "1.0"))
+NAMESPACE = os.environ.get("TELEMETRY_NAMESPACE", "RSNA/Pipeline")
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+LOG_LEVEL = LEVELS.get(os.environ.get("LOG_LEVEL", "INFO").upper(), 20)
+
+_CURRENT: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("trace", default=None)
+_ALGO: contextvars.ContextVar[str | None] = contextvars.ContextVar("trace_algo", default=None)
+
+
+class Sink:
+    """Destinazione delle righe JSON (una per evento), thread-safe."""
+
+    def __init__(self, spec: str = TELEMETRY):
+        self.enabled = spec != "off"
+        self._lock = threading.Lock()
+        self._fp: TextIO | None = None
+        if spec.startswith("local:"):
+            self._fp = open(spec[len("local:"):], "a", buffering=1, encoding="utf-8")
+        elif spec not in ("stdout", "off"):
+            raise ValueError(f"TELEMETRY non valido: {spec!r}")
+
+    def write(self, doc: dict) -> None:
+        if not self.enabled:
+            return
+        line = json.dumps(doc, separators=(",", ":"), default=str)
+        with self._lock:
+            if self._fp is not None:
+                self._fp.write(line + "\n")
+            else:
+                print(line, flush=True)
+
+
+SINK = Sink()
+# i log seguono il sink locale; con TELEMETRY=off restano su stdout
+_LOG_SINK = SINK if SINK._fp is not None else Sink("stdout")
+
+
+def enabled(level: str) -> bool:
+    """True se ``level`` supera LOG_LEVEL: per non preparare campi costosi invano."""
+    return LEVELS[level] >= LOG_LEVEL
+
+
+def log(level: str, msg: str, **fields) -> None:
+    """Log JSON strutturato, scartato subito sotto LOG_LEVEL."""
+    if LEVELS[level] < LOG_LEVEL:
+        return
+    trace = _CURRENT.get()
+    if trace is not None:
+        fields.setdefault("job_id", trace.job_id)
+        if trace.trace_id is not None:
+            fields.setdefault("trace_id", trace.trace_id)
+    algo = _ALGO.get()
+    if algo is not None:
+        fields.setdefault("algo", algo)
+    _LOG_SINK.write({"ts": round(time.time(), 3), "level": level, "msg": msg, **fields})
+
+
+class Trace:
+    """Durate delle fasi di un job, sommate per (algoritmo, span)."""
+
+    def __init__(
+        self,
+        job_id: str,
+        algos: list[str],
+        sampled: bool | None = None,
+        trace_id: str | None = None,
+    ):
+        self.job_id = job_id
+        self.trace_id = trace_id
+        self.algos = list(algos)
+        if sampled is None:
+            sampled = SINK.enabled and random.random() < TELEMETRY_SAMPLE
+        self.sampled = sampled
+        self.t0 = time.perf_counter()
+        self.finished = False
+        self._lock = threading.Lock()
+        # algo (None = fase condivisa dal job) → span → [secondi, conteggio]
+        self._spans: dict[str | None, dict[str, list]] = defaultdict(dict)
+
+    def record(self, name: str, seconds: float, algo: str | None = None) -> None:
+        if not self.sampled:
+            return
+        algo = algo if algo is not None else _ALGO.get()
+        with self._lock:
+            acc = self._spans[algo].setdefault(name, [0.0, 0])
+            acc[0] += seconds
+            acc[1] += 1
+        if LEVELS["DEBUG"] >= LOG_LEVEL:
+            log("DEBUG", "span", span=name, ms=round(seconds * 1e3, 3), algo=algo)
+
+    @contextlib.contextmanager
+    def span(self, name: str, algo: str | None = None) -> Iterator[None]:
+        """Misura il blocco; con ``algo`` anche i passi del Processor al suo interno."""
+        token = _ALGO.set(algo) if algo is not None else None
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0, algo)
+            if token is not None:
+                _ALGO.reset(token)
+
+    def finish(self, ok: bool, **props) -> None:
+        """Emette le metriche EMF del job (una volta sola)."""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+            spans = {k: dict(v) for k, v in self._spans.items()}
+        if not SINK.enabled:
+            return
+        total_ms = (time.perf_counter() - self.t0) * 1e3
+        shared = spans.pop(None, {})
+        for algo in self.algos:
+            metrics = {"job_ms": total_ms, "jobs": 1, "errors": 0 if ok else 1}
+            doc_props = dict(props)
+            # le fasi condivise (presign, download, …) compaiono sotto ogni algoritmo
+            for source in (shared, spans.get(algo, {})):
+                for name, (seconds, count) in source.items():
+                    metrics[f"{name}_ms"] = seconds * 1e3
+                    if count > 1:
+                        doc_props[f"{name}_count"] = count
+            if self.trace_id is not None:
+                doc_props["trace_id"] = self.trace_id
+            SINK.write(_emf(algo, metrics, job_id=self.job_id, sampled=self.sampled, **doc_props))
+
+
+def _emf(algo: str, metrics: dict[str, float], **props) -> dict:
+    units = {"jobs": "Count", "errors": "Count"}
+    return {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [["Algo"]],
+                    "Metrics": [
+                        {"Name": n, "Unit": units.get(n, "Milliseconds")} for n in metrics
+                    ],
+                }
+            ],
+        },
+        "Algo": algo,
+        **{n: round(v, 3) for n, v in metrics.items()},
+        **props,
+    }
+
+
+def current() -> Trace | None:
+    return _CURRENT.get()
+
+
+@contextlib.contextmanager
+def activate(trace: Trace | None) -> Iterator[Trace | None]:
+    """Rende ``trace`` la trace corrente nel thread (contesto) chiamante."""
+    token = _CURRENT.set(trace)
+    try:
+        yield trace
+    finally:
+        _CURRENT.reset(token)
+
+
+def span(name: str, algo: str | None = None) -> contextlib.AbstractContextManager:
+    """Span sulla trace corrente; no-op se non c'è o il job non è campionato."""
+    trace = _CURRENT.get()
+    if trace is None or not trace.sampled:
+        return contextlib.nullcontext()
+    return trace.span(name, algo)
+
+
+def record(name: str, seconds: float, algo: str | None = None) -> None:
+    trace = _CURRENT.get()
+    if trace is not None:
+        trace.record(name, seconds, algo)
+
+
+def stamp(timing: dict[str, int] | None, name: str) -> dict[str, int]:
+    """Copia di ``timing`` con ``name`` = adesso (epoch ms).
+
+    Gli istanti dei passaggi di un job (``enqueued`` dal router,
+    ``received`` dal worker, ``published`` all'invio del risultato) viaggiano
+    nei messaggi; epoch e non perf_counter perché vengono da macchine diverse.
+    """
+    return {**(timing or {}), name: int(time.time() * 1000)}
+
+
+def _step_hook(name: str, seconds: float) -> None:
+    record(f"process.{name}", seconds)
+
+
+# passi interni dei Processor (threshold, morphology, ccl) → span "process.<passo>"
+set_step_hook(_step_hook)
+
+
+# ---------------------------------------------------------------------------
+# Riepilogo offline di un sink locale
+# ---------------------------------------------------------------------------
+
+
+def summarize(path: str) -> dict[str, dict[str, dict[str, float]]]:
+    """Per algoritmo e metrica: n, p50, p95, max (ms) dai documenti EMF del file."""
+    values: dict[str, dict[str, list[float]]] = defaultdict(lambda: defaultdict(list))
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            doc = json.loads(line)
+            if "_aws" not in doc:
+                continue
+            for m in doc["_aws"]["CloudWatchMetrics"][0]["Metrics"]:
+                values[doc["Algo"]][m["Name"]].append(doc[m["Name"]])
+    return {
+        algo: {
+            name: {
+                "n": len(v),
+                "p50": float(np.percentile(v, 50)),
+                "p95": float(np.percentile(v, 95)),
+                "max": float(np.max(v)),
+            }
+            for name, v in sorted(metrics.items())
+        }
+        for algo, metrics in values.items()
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Riepilogo di un file di telemetria locale")
+    ap.add_argument("command", choices=["summary"])
+    ap.add_argument("path")
+    args = ap.parse_args()
+    for algo, metrics in summarize(args.path).items():
+        print(f"{algo}")
+        print(f"  {'metric':<28} {'n':>5} {'p50':>10} {'p95':>10} {'max':>10}")
+        for name, s in metrics.items():
+            print(f"  {name:<28} {s['n']:>5} {s['p50']:>10.1f} {s['p95']:>10.1f} {s['max']:>10.1f}")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
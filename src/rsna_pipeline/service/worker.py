@@ -0,0 +1,188 @@
+"""Consumer SQS persistente: un solo interprete Python per tutti i job.
+
+Sostituisce il loop di ``containers/base/worker.sh`` che lanciava
+``python -m rsna_pipeline.service.runner`` per ogni messaggio: qui gli import
+(numpy, scipy, cv2, pydicom, …), i client boto3/requests e le istanze dei
+``Processor`` restano caldi tra un job e l'altro.
+
+I messaggi vengono letti a batch (fino a 10) ed eseguiti da una pipeline a
+stadi (vedi :mod:`rsna_pipeline.service.pipeline`): mentre un job è in
+``Processor.run`` il successivo scarica già l'input e il precedente carica
+il risultato; le code tra gli stadi sono limitate, così la memoria resta
+entro il limite del task. Variabili d'ambiente:
+
+  • FETCH_WORKERS      – job in presign/download contemporanei (default 2)
+  • PREFETCH_DEPTH     – input pronti in attesa della CPU (default 2)
+  • CPU_WORKERS        – fasi CPU-bound contemporanee (default: CPU del task)
+  • COMPUTE_WORKERS    – job nello stadio compute (default CPU_WORKERS; 2 × CPU_WORKERS
+                         con il batching attivo, così i thread in attesa della CPU
+                         possono unirsi a un batch)
+  • PUBLISH_WORKERS    – job in encode/upload/notifica contemporanei (default 2)
+  • PUBLISH_DEPTH      – risultati in attesa di upload (default 2)
+  • INMEMORY_MAX_MB    – byte di input scaricati e output da caricare tenuti in memoria,
+                         in totale per tutti i job in volo (default 512; oltre: disco)
+  • INPUT_CACHE_MB     – cache LRU dei DICOM scaricati, per (S3 key, ETag) (default 256)
+  • RESULT_CACHE       – indice dei risultati già prodotti: s3 | local:<dir> | off (default s3)
+  • BATCH_WINDOW_MS    – attesa max per raggruppare slice 2‑D di job diversi in un
+                         ``Processor.run_batch`` (default 0 = disattivato: con
+                         benchmarks/batch_throughput il guadagno è ~1.0×, perché
+                         morfologia e CCL restano per slice; es. 10 per provarlo)
+  • BATCH_MAX          – slice max per batch (default 8; limitato anche da COMPUTE_WORKERS)
+  • SERIES_STREAMING   – serie elaborate slice per slice durante il download (default 1)
+  • TELEMETRY, TELEMETRY_SAMPLE, LOG_LEVEL – metriche EMF per fase e log JSON
+                         (vedi :mod:`rsna_pipeline.service.telemetry`)
+  • PROFILE            – 1 = profila ogni job; per un solo job ``"profile": true`` nel
+                         messaggio (vedi :mod:`rsna_pipeline.service.profiling`)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+
+from medical_image_processing.processing.base import Processor
+from medical_image_processing.utils.cpu import cpu_count
+from medical_image_processing.utils.dicom_writer import resolve_compression
+from rsna_pipeline.service import telemetry
+from rsna_pipeline.service.batching import BatchCoalescer
+from rsna_pipeline.service.pipeline import JobPipeline
+from rsna_pipeline.service.runner import OUTPUT_COMPRESSION, Clients, run_multi_job
+
+
+SQS_MAX_BATCH = 10
+
+_PROCESSORS: dict[str, Processor] = {}
+_PROCESSORS_LOCK = threading.Lock()
+
+
+def get_processor(algo_id: str) -> Processor:
+    """Restituisce (creandola una volta sola) l'istanza del Processor."""
+    with _PROCESSORS_LOCK:
+        if algo_id not in _PROCESSORS:
+            _PROCESSORS[algo_id] = Processor.factory(algo_id)
+        return _PROCESSORS[algo_id]
+
+
+def job_kwargs(msg: dict, cfg: dict) -> dict | None:
+    """Argomenti di ``run_multi_job`` dal messaggio; None se non è eseguibile."""
+    body = json.loads(msg["Body"])
+    # istante di ricezione: la differenza con "enqueued" del router è l'attesa in coda
+    timing = telemetry.stamp(body.get("timing"), "received")
+    client_id = body.get("client_id") or "unknown"
+    if client_id == "unknown":
+        telemetry.log("ERROR", "client_id not found in message body", body=body)
+        return None
+    job_id = body.get("job_id")
+    if not job_id:
+        telemetry.log("WARNING", "job_id not found in message body")
+    # messaggi senza trace_id (inviati senza passare dal router): si usa il job_id
+    trace_id = str(body.get("trace_id") or job_id)
+    telemetry.log("INFO", "message received", job_id=job_id, trace_id=trace_id)
+
+    # job multi-algoritmo: "algos" nel messaggio, input scaricato una volta
+    algos = body.get("algos") or [cfg["algo"]]
+    return dict(
+        pacs_info=body["pacs"],
+        algos=algos,
+        s3_output=cfg["output_bucket"],
+        job_id=str(job_id),
+        client_id=client_id,
+        result_queue=cfg["result_queue"],
+        processors={a: get_processor(a) for a in algos},
+        output=body.get("output", "sc"),
+        compression=body.get("compression"),
+        trace_id=trace_id,
+        timing=timing,
+        profile=body.get("profile"),  # None → env PROFILE
+    )
+
+
+def handle_message(
+    msg: dict, clients: Clients, cfg: dict, cpu_slot=None, batcher: BatchCoalescer | None = None
+) -> bool:
+    """Esegue il job contenuto nel messaggio; True se va cancellato dalla coda."""
+    kwargs = job_kwargs(msg, cfg)
+    if kwargs is None:
+        return False
+    run_multi_job(clients=clients, cpu_slot=cpu_slot, batcher=batcher, **kwargs)
+    return True
+
+
+def main() -> None:
+    cfg = {
+        "queue_url": os.environ["QUEUE_URL"],
+        "output_bucket": os.environ["OUTPUT_BUCKET"],
+        "algo": os.environ["ALGO_ID"],
+        "result_queue": os.environ["RESULT_QUEUE"],
+    }
+    cpu_workers = max(1, int(os.environ.get("CPU_WORKERS", cpu_count())))
+    batch_window = float(os.environ.get("BATCH_WINDOW_MS", "0")) / 1000
+    batch_max = max(1, int(os.environ.get("BATCH_MAX", "8")))
+    batching = batch_window > 0 and batch_max > 1
+    stages = dict(
+        fetch_workers=max(1, int(os.environ.get("FETCH_WORKERS", "2"))),
+        prefetch_depth=max(1, int(os.environ.get("PREFETCH_DEPTH", "2"))),
+        compute_workers=max(
+            1, int(os.environ.get("COMPUTE_WORKERS", (2 if batching else 1) * cpu_workers))
+        ),
+        publish_workers=max(1, int(os.environ.get("PUBLISH_WORKERS", "2"))),
+        publish_depth=max(1, int(os.environ.get("PUBLISH_DEPTH", "2"))),
+    )
+    telemetry.log(
+        "INFO", "worker START", queue=cfg["queue_url"], output=f"s3://{cfg['output_bucket']}",
+        algo=cfg["algo"], cpu_workers=cpu_workers, stages=stages,
+    )
+    clients = Clients.from_env()
+    get_processor(cfg["algo"])  # fallisce subito se l'algoritmo non esiste
+    # codec mancante (es. jpegls senza extra) segnalato all'avvio, non al primo job
+    compression = resolve_compression(OUTPUT_COMPRESSION)
+    if compression != OUTPUT_COMPRESSION:
+        telemetry.log(
+            "WARNING", "codec non disponibile (extra 'jpegls')",
+            requested=OUTPUT_COMPRESSION, used=compression,
+        )
+    else:
+        telemetry.log("INFO", "output compression", compression=compression)
+    cpu_slot = threading.BoundedSemaphore(cpu_workers)
+    batcher = None
+    if batching and stages["compute_workers"] > 1:
+        batcher = BatchCoalescer(batch_window, batch_max, cpu_slot)
+        telemetry.log("INFO", "batching", window_ms=batch_window * 1000, max_slices=batch_max)
+
+    pipeline = JobPipeline(
+        clients,
+        cfg,
+        lambda msg: job_kwargs(msg, cfg),
+        cpu_slot=cpu_slot,
+        batcher=batcher,
+        **stages,
+    )
+    if batcher is not None:
+        # un job da solo nello stadio compute non attende la finestra di batching
+        batcher.backlog = pipeline.compute_backlog
+    telemetry.log("INFO", "pipeline", max_jobs=pipeline.max_jobs)
+    while True:
+        free = pipeline.free_slots()
+        if free <= 0:
+            pipeline.wait_slot()
+            continue
+        try:
+            resp = clients.sqs.receive_message(
+                QueueUrl=cfg["queue_url"],
+                # fino ai posti liberi della pipeline, non solo ai thread di fetch
+                MaxNumberOfMessages=min(SQS_MAX_BATCH, free),
+                # con job in corso non restiamo bloccati sul long polling
+                WaitTimeSeconds=1 if pipeline.busy() else 20,
+            )
+        except Exception as e:
+            telemetry.log("ERROR", "receive-message failed", error=str(e))
+            time.sleep(2)
+            continue
+
+        for msg in resp.get("Messages", []):
+            pipeline.submit(msg)
+
+if __name__ == "__main__":
+    main()
@@ -5,4 +5,6 @@ setup(
     version="0.1.0",
     package_dir={"": "."},
     packages=find_packages(where="."),
+    # codec JPEG-LS per compression="jpegls" (senza: ripiego su rle)
+    extras_require={"jpegls": ["pyjpegls"]},
 )
@@ -0,0 +1,149 @@
+"""Fixture comuni: slice e serie CT sintetiche (vedi benchmarks/synthetic.py),
+S3/SQS con moto e una PACS API finta per i test del servizio."""
+
+from __future__ import annotations
+
+import io
+import json
+import logging
+import sys
+import threading
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, ClassVar
+from urllib.parse import parse_qs, urlparse
+
+import pydicom
+import pytest
+
+# import dei pacchetti anche senza `pip install -e ./src`
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from medical_image_processing.benchmarks.synthetic import (  # noqa: E402
+    synthetic_hu_slice,
+    write_synthetic_series,
+)
+
+# 512×512: sotto questa size il fegato sintetico non supera min_area_px
+SIZE = 512
+
+
+@pytest.fixture(scope="session")
+def slices() -> list:
+    """Slice HU int16 con rumore diverso (stesso schema dei benchmark)."""
+    return [synthetic_hu_slice(z, SIZE, noise=15 + 5 * (z % 4)) for z in range(4)]
+
+
+@pytest.fixture(scope="session")
+def series_paths(tmp_path_factory) -> list[Path]:
+    return write_synthetic_series(tmp_path_factory.mktemp("series"), 6, SIZE)
+
+
+PACS_BUCKET = "pacs"
+SERIES = {"scope": "series", "study_id": "st", "series_id": "se", "image_id": "IM-0002.dcm"}
+IMAGE = {**SERIES, "scope": "image"}
+
+
+def _pacs_handler(s3):
+    """PACS API finta: URL presigned (con key ed ETag) degli oggetti nel bucket ``pacs``."""
+
+    def entry(key: str) -> dict:
+        head = s3.head_object(Bucket=PACS_BUCKET, Key=key)
+        url = s3.generate_presigned_url("get_object", Params={"Bucket": PACS_BUCKET, "Key": key})
+        return {"url": url, "key": key, "etag": head["ETag"].strip('"')}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            study, _, rest = url.path.removeprefix("/studies/").partition("/images")
+            if rest:  # /studies/{study}/images/{series}/{image}
+                body = entry(f"{study}{rest}")
+            else:  # /studies/{study}/images?series_id=…
+                series = parse_qs(url.query)["series_id"][0]
+                objs = s3.list_objects_v2(Bucket=PACS_BUCKET, Prefix=f"{study}/{series}/")
+                body = [entry(o["Key"]) for o in objs.get("Contents", [])]
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@pytest.fixture(scope="session")
+def aws_endpoint(series_paths):
+    """moto (S3 + SQS) e PACS API finta, con la serie sintetica in ``pacs/st/se/``."""
+    moto_server = pytest.importorskip("moto.server")
+    import boto3
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # una riga per richiesta
+
+    with pytest.MonkeyPatch.context() as mp:
+        for var in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+            mp.setenv(var, "test")
+        mp.setenv("AWS_DEFAULT_REGION", "us-east-1")
+        server = moto_server.ThreadedMotoServer(port=0, verbose=False)
+        server.start()
+        _, port = server.get_host_and_port()
+        mp.setenv("AWS_ENDPOINT_URL", f"http://127.0.0.1:{port}")
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket=PACS_BUCKET)
+        # ordine di upload diverso da quello delle slice
+        for p in series_paths[1::2] + series_paths[::2]:
+            s3.put_object(Bucket=PACS_BUCKET, Key=f"st/se/{p.name}", Body=p.read_bytes())
+        pacs = ThreadingHTTPServer(("127.0.0.1", 0), _pacs_handler(s3))
+        threading.Thread(target=pacs.serve_forever, daemon=True).start()
+        mp.setenv("PACS_API_BASE", f"http://127.0.0.1:{pacs.server_port}")
+        mp.setenv("PACS_API_KEY", "test")
+        try:
+            yield
+        finally:
+            pacs.shutdown()
+            server.stop()
+
+
+@dataclass
+class Cloud:
+    """Bucket di output e coda dei risultati nuovi per ogni test."""
+
+    SERIES: ClassVar[dict] = SERIES
+    IMAGE: ClassVar[dict] = IMAGE
+    clients: Any
+    bucket: str
+    result_queue: str
+
+    def results(self, n: int = 10) -> list[dict]:
+        """Messaggi arrivati sulla coda dei risultati (e rimossi)."""
+        sqs, out = self.clients.sqs, []
+        while True:
+            resp = sqs.receive_message(QueueUrl=self.result_queue, MaxNumberOfMessages=n)
+            if not resp.get("Messages"):
+                return out
+            for m in resp["Messages"]:
+                out.append(json.loads(m["Body"]))
+                sqs.delete_message(QueueUrl=self.result_queue, ReceiptHandle=m["ReceiptHandle"])
+
+    def dcmread(self, key: str) -> pydicom.Dataset:
+        body = self.clients.s3.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        return pydicom.dcmread(io.BytesIO(body))
+
+
+@pytest.fixture
+def cloud(aws_endpoint) -> Cloud:
+    from rsna_pipeline.service.runner import Clients
+
+    clients = Clients.from_env()
+    bucket = f"out-{uuid.uuid4().hex[:12]}"
+    clients.s3.create_bucket(Bucket=bucket)
+    queue = clients.sqs.create_queue(
+        QueueName=f"results-{bucket}.fifo",
+        Attributes={"FifoQueue": "true", "ContentBasedDeduplication": "true"},
+    )["QueueUrl"]
+    return Cloud(clients, bucket, queue)
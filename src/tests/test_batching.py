@@ -0,0 +1,54 @@
+"""BatchCoalescer: slice di job concorrenti raggruppate in ``run_batch``."""
+
+from __future__ import annotations
+
+import threading
+import time
+
+import numpy as np
+
+import medical_image_processing.processing  # noqa: F401 - registra gli algoritmi
+from medical_image_processing.processing.base import Processor
+from rsna_pipeline.service.batching import BatchCoalescer
+
+
+def _spied(algo: str) -> tuple[Processor, list[int]]:
+    proc = Processor.factory(algo)
+    sizes: list[int] = []
+    run_batch = proc.run_batch
+
+    def spy(imgs, metas=None):
+        sizes.append(len(imgs))
+        return run_batch(imgs, metas)
+
+    proc.run_batch = spy
+    return proc, sizes
+
+
+def test_concurrent_jobs_share_batches(slices):
+    proc, sizes = _spied("processing_1")
+    imgs = [slices[i % len(slices)] for i in range(7)]
+    coalescer = BatchCoalescer(window_s=0.5, max_batch=3)
+    out: list = [None] * len(imgs)
+    start = threading.Barrier(len(imgs))
+
+    def job(i: int) -> None:
+        start.wait()
+        out[i] = coalescer.run(proc, imgs[i])["mask"]
+
+    threads = [threading.Thread(target=job, args=(i,)) for i in range(len(imgs))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    assert sum(sizes) == len(imgs) and max(sizes) <= 3 and len(sizes) < len(imgs)
+    for img, mask in zip(imgs, out):
+        np.testing.assert_array_equal(mask, proc.run(img)["mask"])
+
+
+def test_lone_job_skips_window_with_backlog(slices):
+    proc, sizes = _spied("processing_1")
+    coalescer = BatchCoalescer(window_s=5, max_batch=8, backlog=lambda: 1)
+    t0 = time.monotonic()
+    coalescer.run(proc, slices[0])
+    assert time.monotonic() - t0 < 5 and sizes == [1]
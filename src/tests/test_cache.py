@@ -0,0 +1,27 @@
+"""Cache dei worker: LRU per byte degli input."""
+
+from __future__ import annotations
+
+from rsna_pipeline.service.cache import LRUCache
+
+
+def test_lru_evicts_least_recently_used_by_bytes():
+    cache: LRUCache[bytes] = LRUCache(10)
+    assert cache.put("a", b"aaaa", 4) and cache.put("b", b"bbbb", 4)
+    assert cache.get("a") == b"aaaa"  # "b" diventa il meno recente
+    assert cache.put("c", b"cccc", 4)
+    assert cache.get("b") is None and cache.get("a") and cache.get("c")
+    stats = cache.stats()
+    assert (stats.evictions, stats.entries, stats.nbytes) == (1, 2, 8)
+    assert (stats.hits, stats.misses) == (3, 1)
+
+
+def test_lru_replace_and_oversized_value():
+    cache: LRUCache[bytes] = LRUCache(10)
+    cache.put("a", b"aaaa", 4)
+    cache.put("a", b"aaaaaa", 6)  # sostituzione: i byte del vecchio valore tornano liberi
+    assert cache.stats().nbytes == 6 and cache.get("a") == b"aaaaaa"
+    assert not cache.put("big", b"x" * 11, 11)  # più grande della cache: non entra
+    assert cache.get("a") == b"aaaaaa"
+    cache.clear()
+    assert cache.stats().entries == cache.stats().nbytes == 0
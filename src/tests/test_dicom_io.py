@@ -0,0 +1,93 @@
+"""Caricamento delle serie: ordinamento dagli header, HU compatti (HUVolume)."""
+
+from __future__ import annotations
+
+import io
+
+import numpy as np
+import pydicom
+import pytest
+
+from medical_image_processing.benchmarks.synthetic import write_synthetic_series
+from medical_image_processing.utils.dicom_io import (
+    _to_hu,
+    iter_hu_frames,
+    load_dicom,
+    load_series,
+)
+
+PADDING = -32768
+
+
+def _reference(paths) -> np.ndarray:
+    """HU float64 con pydicom, slice per InstanceNumber (come write_synthetic_series)."""
+    dss = sorted((pydicom.dcmread(p) for p in paths), key=lambda ds: ds.InstanceNumber)
+    return np.stack(
+        [ds.pixel_array * float(ds.RescaleSlope) + float(ds.RescaleIntercept) for ds in dss]
+    )
+
+
+def test_series_sorted_from_headers(series_paths):
+    ref = _reference(series_paths)
+    shuffled = series_paths[3:] + series_paths[:3]
+    vol, headers = load_series(shuffled)
+    np.testing.assert_array_equal(vol, ref)
+    assert [h.InstanceNumber for h in headers] == list(range(1, len(ref) + 1))
+    assert all("PixelData" not in h for h in headers)  # solo header, pixel letti a parte
+
+    # buffer in memoria (download) come i file su disco
+    buffers = [io.BytesIO(p.read_bytes()) for p in shuffled]
+    np.testing.assert_array_equal(np.asarray(load_series(buffers, compact=True)[0]), ref)
+
+
+def test_sort_falls_back_to_instance_number(tmp_path):
+    paths = write_synthetic_series(tmp_path, 4, 64)
+    for p in paths:  # posizioni duplicate: non affidabili per l'ordine
+        ds = pydicom.dcmread(p)
+        ds.ImagePositionPatient = [0.0, 0.0, 0.0]
+        ds.save_as(p, enforce_file_format=True)
+    vol, headers = load_series(paths[::-1])
+    np.testing.assert_array_equal(vol, _reference(paths))
+    assert [h.InstanceNumber for h in headers] == [1, 2, 3, 4]
+
+
+@pytest.fixture
+def signed_series(tmp_path):
+    """CT signed a 16 bit con padding -32768 e intercept -1024."""
+    paths = write_synthetic_series(tmp_path, 3, 64)
+    for p in paths:
+        ds = pydicom.dcmread(p)
+        raw = ds.pixel_array.astype(np.int16)
+        raw[:4, :4] = PADDING
+        ds.PixelRepresentation = 1
+        ds.BitsStored, ds.HighBit = 16, 15
+        ds.PixelData = raw.tobytes()
+        ds.save_as(p, enforce_file_format=True)
+    return paths
+
+
+def test_compact_series_keeps_int16_when_in_range(tmp_path):
+    paths = write_synthetic_series(tmp_path, 3, 64)  # 12 bit unsigned, intercept -1024
+    vol, _ = load_series(paths, compact=True)
+    ref, _ = load_series(paths)
+    assert vol.dtype == np.int16
+    np.testing.assert_array_equal(np.asarray(vol), ref)
+
+
+def test_padding_does_not_wrap(signed_series):
+    vol, _ = load_series(signed_series, compact=True)
+    ref, _ = load_series(signed_series)
+    assert vol.dtype == np.float32
+    assert ref[0, 0, 0] == PADDING - 1024
+    np.testing.assert_array_equal(np.asarray(vol), ref)
+
+    img, _ = load_dicom(signed_series[0], compact=True)
+    np.testing.assert_array_equal(np.asarray(img), ref[0])
+    np.testing.assert_array_equal(next(iter_hu_frames(signed_series[0])), ref[0])
+
+
+def test_to_hu_saturates_inconsistent_pixels():
+    # header "a 12 bit" ma pixel fuori range: in int16 si satura, non si riavvolge
+    raw = np.array([[PADDING, 0, 4095]], dtype=np.int16)
+    out = _to_hu(raw, 1.0, -1024.0, np.empty(raw.shape, np.int16))
+    np.testing.assert_array_equal(out, [[PADDING, -1024, 3071]])
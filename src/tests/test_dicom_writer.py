@@ -0,0 +1,134 @@
+"""Writer DICOM: i file scritti si rileggono con pydicom e i pixel tornano uguali."""
+
+from __future__ import annotations
+
+import io
+
+import numpy as np
+import pydicom
+import pytest
+from pydicom.uid import (
+    ExplicitVRLittleEndian,
+    MultiFrameTrueColorSecondaryCaptureImageStorage,
+    RLELossless,
+    SegmentationStorage,
+)
+
+from medical_image_processing.benchmarks.synthetic import write_synthetic_series
+from medical_image_processing.utils.dicom_writer import (
+    COMPRESSIONS,
+    resolve_compression,
+    save_secondary_capture,
+    save_secondary_capture_frames,
+    save_segmentation,
+)
+
+SIZE = 64
+
+
+@pytest.fixture(scope="module")
+def ct_headers(tmp_path_factory) -> list[pydicom.Dataset]:
+    paths = write_synthetic_series(tmp_path_factory.mktemp("ct"), 3, SIZE)
+    return [pydicom.dcmread(p, stop_before_pixels=True) for p in paths]
+
+
+def _overlays(n: int) -> np.ndarray:
+    """Overlay RGB (n, H, W, 3): fondo grigio costante con un riquadro rosso."""
+    frames = np.full((n, SIZE, SIZE, 3), 40, np.uint8)
+    for z in range(n):
+        frames[z, 10 + z : 30 + z, 12:40] = (255, 0, 0)
+    return frames
+
+
+def test_multiframe_sc_round_trip(ct_headers, tmp_path):
+    frames = _overlays(3)
+    out = tmp_path / "series.dcm"
+    stats = save_secondary_capture_frames(
+        iter(frames), 3, ct_headers[0], out, "processing_1", slice_locations=[0.0, -2.5, -5.0]
+    )
+    assert stats.transfer_syntax == ExplicitVRLittleEndian and stats.fallback is None
+    ds = pydicom.dcmread(out)
+    assert ds.SOPClassUID == MultiFrameTrueColorSecondaryCaptureImageStorage
+    assert ds.NumberOfFrames == 3 and ds.SliceLocationVector == [0.0, -2.5, -5.0]
+    assert ds.StudyInstanceUID == ct_headers[0].StudyInstanceUID
+    np.testing.assert_array_equal(ds.pixel_array, frames)
+
+    # stesso contenuto in un buffer in memoria (upload senza disco)
+    buf = io.BytesIO()
+    save_secondary_capture_frames(iter(frames), 3, ct_headers[0], buf, "processing_1")
+    buf.seek(0)
+    np.testing.assert_array_equal(pydicom.dcmread(buf).pixel_array, frames)
+
+
+def test_multiframe_sc_rejects_wrong_frame_count(ct_headers, tmp_path):
+    with pytest.raises(ValueError):
+        save_secondary_capture_frames(
+            iter(_overlays(2)), 3, ct_headers[0], tmp_path / "x.dcm", "processing_1"
+        )
+
+
+@pytest.mark.parametrize("cols", [SIZE, SIZE - 5])  # anche righe non multiple di 8 bit
+def test_segmentation_round_trip(ct_headers, tmp_path, cols):
+    masks = np.random.default_rng(cols).random((3, SIZE, cols)) > 0.5
+    out = tmp_path / "seg.dcm"
+    stats = save_segmentation(masks.astype(np.uint8), ct_headers, out, "processing_7")
+    ds = pydicom.dcmread(out)
+    assert ds.SOPClassUID == SegmentationStorage and ds.SegmentationType == "BINARY"
+    assert ds.NumberOfFrames == 3 and ds.BitsAllocated == 1
+    # bit impacchettati senza padding tra i frame (PixelData di lunghezza pari)
+    nbytes = -(-masks.size // 8)
+    assert stats.stored_bytes == len(ds.PixelData) == nbytes + nbytes % 2
+    np.testing.assert_array_equal(ds.pixel_array.astype(bool), masks)
+    refs = ds.ReferencedSeriesSequence[0].ReferencedInstanceSequence
+    assert [r.ReferencedSOPInstanceUID for r in refs] == [h.SOPInstanceUID for h in ct_headers]
+    for fg, h in zip(ds.PerFrameFunctionalGroupsSequence, ct_headers):
+        src = fg.DerivationImageSequence[0].SourceImageSequence[0]
+        assert src.ReferencedSOPInstanceUID == h.SOPInstanceUID
+        assert fg.PlanePositionSequence[0].ImagePositionPatient == h.ImagePositionPatient
+
+
+def test_segmentation_needs_one_mask_per_header(ct_headers, tmp_path):
+    with pytest.raises(ValueError):
+        save_segmentation(np.zeros((2, SIZE, SIZE), np.uint8), ct_headers, tmp_path / "x", "p")
+
+
+def test_rle_round_trip(ct_headers, tmp_path):
+    frames = _overlays(3)
+    stats = save_secondary_capture(
+        frames[0], ct_headers[0], tmp_path / "a.dcm", "p", compression="rle"
+    )
+    assert stats.compression == "rle" and stats.stored_bytes < stats.raw_bytes
+    ds = pydicom.dcmread(tmp_path / "a.dcm")
+    assert ds.file_meta.TransferSyntaxUID == RLELossless
+    np.testing.assert_array_equal(ds.pixel_array, frames[0])
+
+    stats = save_secondary_capture_frames(
+        iter(frames), 3, ct_headers[0], tmp_path / "s.dcm", "p", compression="rle"
+    )
+    assert stats.transfer_syntax == RLELossless and stats.fallback is None
+    ds = pydicom.dcmread(tmp_path / "s.dcm")
+    assert ds.file_meta.TransferSyntaxUID == RLELossless and ds.NumberOfFrames == 3
+    np.testing.assert_array_equal(ds.pixel_array, frames)
+
+
+def test_no_gain_writes_uncompressed_and_reports_it(ct_headers, tmp_path):
+    noise = np.random.default_rng(0).integers(0, 256, (2, SIZE, SIZE, 3), dtype=np.uint8)
+    stats = save_secondary_capture_frames(
+        iter(noise), 2, ct_headers[0], tmp_path / "n.dcm", "p", compression="rle"
+    )
+    assert stats.compression == "none" and "senza guadagno" in stats.fallback
+    ds = pydicom.dcmread(tmp_path / "n.dcm")
+    assert ds.file_meta.TransferSyntaxUID == ExplicitVRLittleEndian
+    np.testing.assert_array_equal(ds.pixel_array, noise)
+
+
+def test_jpegls_without_codec_falls_back_to_rle(ct_headers, tmp_path):
+    if COMPRESSIONS["jpegls"][1].is_available:
+        pytest.skip("codec JPEG-LS installato")
+    assert resolve_compression("jpegls") == "rle"
+    stats = save_secondary_capture(
+        _overlays(1)[0], ct_headers[0], tmp_path / "j.dcm", "p", compression="jpegls"
+    )
+    assert stats.compression == "rle" and "jpegls" in stats.fallback
+    with pytest.raises(ValueError):
+        resolve_compression("zip")
@@ -0,0 +1,138 @@
+"""SeriesFetcher contro un server HTTP locale: retry, budget in memoria, cache."""
+
+from __future__ import annotations
+
+import io
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import requests
+import urllib3
+
+from rsna_pipeline.service.cache import LRUCache
+from rsna_pipeline.service.fetch import MemoryBudget, SeriesFetcher
+
+BODY = bytes(range(256)) * 40  # 10240 byte
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """``/flaky-N/…`` risponde 503 alle prime N richieste, ``/gone/…`` sempre 403,
+    ``/short/…`` chiude la connessione a metà body."""
+
+    hits: Counter = Counter()
+
+    def do_GET(self):
+        self.hits[self.path] += 1
+        kind = self.path.split("/")[1]
+        if kind.startswith("flaky-") and self.hits[self.path] <= int(kind[6:]):
+            self.send_error(503)
+            return
+        if kind == "gone":
+            self.send_error(403)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY[: len(BODY) // 2] if kind == "short" else BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def _files(base_url: str, n: int) -> list[dict]:
+    return [{"url": f"{base_url}/IM-{i:04d}.dcm"} for i in range(n)]
+
+
+def _fetcher(http, **kwargs) -> SeriesFetcher:
+    return SeriesFetcher(http, backoff=0.01, timeout=5, **kwargs)
+
+
+def test_retries_5xx_then_succeeds(base_url, tmp_path: Path):
+    with requests.Session() as http, _fetcher(http, retries=2) as fetcher:
+        out = fetcher.fetch_one(f"{base_url}/flaky-2/a.dcm", tmp_path / "a.dcm")
+        assert out.read() == BODY
+    assert _Handler.hits["/flaky-2/a.dcm"] == 3
+
+
+def test_gives_up_after_retries(base_url, tmp_path: Path):
+    with requests.Session() as http, _fetcher(http, retries=1) as fetcher:
+        with pytest.raises(requests.HTTPError):
+            fetcher.fetch_one(f"{base_url}/flaky-5/b.dcm", tmp_path / "b.dcm")
+    assert _Handler.hits["/flaky-5/b.dcm"] == 2
+
+
+def test_4xx_is_not_retried(base_url, tmp_path: Path):
+    with requests.Session() as http, _fetcher(http, retries=3) as fetcher:
+        with pytest.raises(requests.HTTPError):
+            fetcher.fetch_one(f"{base_url}/gone/c.dcm", tmp_path / "c.dcm")
+    assert _Handler.hits["/gone/c.dcm"] == 1
+
+
+@pytest.mark.parametrize("budget", [0, 1 << 20])
+def test_truncated_body_releases_budget_and_partial_file(base_url, tmp_path: Path, budget):
+    memory = MemoryBudget(budget)
+    with requests.Session() as http:
+        fetcher = _fetcher(http, retries=1, memory_budget=memory)
+        with pytest.raises(urllib3.exceptions.HTTPError):
+            fetcher.fetch_one(f"{base_url}/short/d{budget}.dcm", tmp_path / "d.dcm")
+    assert _Handler.hits[f"/short/d{budget}.dcm"] == 2  # ritentato
+    assert memory.free == budget and fetcher.held == 0
+    assert not (tmp_path / "d.dcm").exists()
+
+
+def test_budget_shared_between_fetchers(base_url, tmp_path: Path):
+    budget = MemoryBudget(3 * len(BODY))
+    with requests.Session() as http:
+        with SeriesFetcher(http, memory_budget=budget) as first:
+            outs = list(first.iter_fetch(_files(base_url, 2), tmp_path))
+            assert all(isinstance(o, io.BytesIO) for o in outs)
+            assert first.held == 2 * len(BODY)
+
+            # un secondo job vede solo quello che resta del budget
+            second = SeriesFetcher(http, memory_budget=budget, concurrency=1)
+            outs = list(second.iter_fetch(_files(base_url, 2), tmp_path))
+            assert sum(isinstance(o, io.BytesIO) for o in outs) == 1
+            assert sum(isinstance(o, Path) and o.read_bytes() == BODY for o in outs) == 1
+            second.release()
+            second.release()  # idempotente
+            assert budget.free == len(BODY)
+    assert budget.free == 3 * len(BODY)
+
+
+def test_hold_releases_only_when_reserved():
+    budget = MemoryBudget(100)
+    with budget.hold(80) as in_memory:
+        assert in_memory and budget.free == 20
+        with budget.hold(50) as nested:
+            assert not nested and budget.free == 20
+    assert budget.free == 100
+    assert not budget.reserve(0)
+
+
+def test_input_cache_skips_network(base_url, tmp_path: Path):
+    cache: LRUCache[bytes] = LRUCache(1 << 20)
+    files = [
+        {"url": f"{base_url}/cached/IM-{i}.dcm", "key": f"st/se/IM-{i}.dcm", "etag": "e1"}
+        for i in range(2)
+    ]
+    with requests.Session() as http:
+        for _ in range(2):
+            with _fetcher(http, cache=cache) as fetcher:
+                assert [o.read() for o in fetcher.iter_fetch(files, tmp_path)] == [BODY, BODY]
+        # stesso oggetto con ETag diverso (sovrascritto nel PACS): di nuovo dalla rete
+        changed = [{**files[0], "etag": "e2"}]
+        with _fetcher(http, cache=cache) as fetcher:
+            list(fetcher.iter_fetch(changed, tmp_path))
+    assert _Handler.hits["/cached/IM-0.dcm"] == 2 and _Handler.hits["/cached/IM-1.dcm"] == 1
+    assert cache.stats().hits == 2
@@ -0,0 +1,68 @@
+"""Backend OpenCV vs scipy e mediana veloce vs ``ndi.median_filter``."""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+import scipy.ndimage as ndi
+
+from medical_image_processing.benchmarks.backend_conformance import _primitives
+from medical_image_processing.utils.filters import get_backend, windowed_median
+
+THR, MEDIAN_K = 120, 11
+LO = THR - 127  # finestra della mediana veloce in LiverCCSimple
+
+
+def test_opencv_primitives_match_scipy(slices):
+    ref, cand = get_backend("scipy"), get_backend("opencv")
+    for img in slices:
+        for name, fn in _primitives(img):
+            a, b = fn(ref), fn(cand)
+            if name.startswith("gaussian"):
+                # troncamento uint8 per passata: al più 1 livello, su pochissimi pixel
+                assert np.abs(a.astype(np.int16) - b).max() <= 1, name
+                assert np.mean(a == b) >= 0.9999, name
+            else:
+                np.testing.assert_array_equal(a, b, err_msg=name)
+
+
+def test_remove_small_holes_threshold_is_strict():
+    mask = np.ones((40, 40), bool)
+    mask[5:10, 5:10] = False  # buco di 25 px
+    for name in ("scipy", "opencv"):
+        bk = get_backend(name)
+        assert not bk.remove_small_holes(mask, 25)[5:10, 5:10].any(), name
+        assert bk.remove_small_holes(mask, 26)[5:10, 5:10].all(), name
+
+
+def test_windowed_median_int16_is_exact(slices):
+    for img in slices:
+        exact = ndi.median_filter(img, size=MEDIAN_K) > THR
+        fast = windowed_median(img, MEDIAN_K, LO) > THR - LO
+        np.testing.assert_array_equal(exact, fast)
+
+
+def test_windowed_median_fractional_hu(slices):
+    # slope 0.5: metà dei pixel a x.5 HU
+    flips = 0
+    for img in slices:
+        frac = img.astype(np.float32)
+        frac.ravel()[1::2] += np.float32(0.5)
+        exact = ndi.median_filter(frac, size=MEDIAN_K)
+        diff = (exact > THR) != (windowed_median(frac, MEDIAN_K, LO) > THR - LO)
+        # solo pixel con mediana esatta a non più di 0.5 HU dalla soglia
+        assert np.all(np.abs(exact[diff] - THR) <= 0.5)
+        flips += int(diff.sum())
+    assert flips <= 1e-4 * len(slices) * slices[0].size
+
+
+def test_windowed_median_stack_matches_slices(slices):
+    stack = np.stack(slices)
+    fast = windowed_median(stack, MEDIAN_K, LO)
+    for img, out in zip(slices, fast):
+        np.testing.assert_array_equal(windowed_median(img, MEDIAN_K, LO), out)
+
+
+def test_windowed_median_rejects_even_size(slices):
+    with pytest.raises(ValueError):
+        windowed_median(slices[0], 10, LO)
@@ -0,0 +1,90 @@
+"""JobPipeline: stadi del runner sostituiti da stub, e end-to-end su moto."""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from rsna_pipeline.service import pipeline as pl
+from rsna_pipeline.service.worker import job_kwargs
+
+
+@pytest.fixture
+def stub_stages(monkeypatch):
+    """prepare_job bloccato finché non si apre ``gate``; compute/publish immediati."""
+    gate = threading.Event()
+
+    def prepare_job(**kwargs):
+        gate.wait(10)
+        return mock.Mock(trace=None)
+
+    monkeypatch.setattr(pl, "prepare_job", prepare_job)
+    monkeypatch.setattr(pl, "compute_job", lambda job, *a: None)
+    monkeypatch.setattr(pl, "publish_job", lambda job: [])
+    return gate
+
+
+def _wait_idle(pipe: pl.JobPipeline, timeout: float = 10) -> None:
+    t0 = time.monotonic()
+    while pipe.busy() and time.monotonic() - t0 < timeout:
+        time.sleep(0.01)
+    assert not pipe.busy()
+
+
+def test_free_slots_cover_whole_pipeline(stub_stages):
+    clients = mock.Mock()
+    pipe = pl.JobPipeline(clients, {"queue_url": "q"}, lambda msg: {}, fetch_workers=2)
+    # un receive può riempire tutta la pipeline, non solo i thread di fetch
+    assert pipe.free_slots() == pipe.max_jobs > pipe.fetch_workers
+    for i in range(pipe.max_jobs):
+        pipe.submit({"ReceiptHandle": str(i)})
+    assert pipe.free_slots() == 0
+    pipe.wait_slot(timeout=0.05)  # fetch saturo: nessun posto
+    assert pipe.free_slots() == 0
+
+    stub_stages.set()
+    _wait_idle(pipe)
+    assert pipe.free_slots() == pipe.max_jobs
+    assert clients.sqs.delete_message.call_count == pipe.max_jobs
+
+
+def test_jobs_flow_through_stages_on_moto(cloud):
+    sqs = cloud.clients.sqs
+    queue = sqs.create_queue(
+        QueueName=f"jobs-{cloud.bucket}.fifo",
+        Attributes={"FifoQueue": "true", "ContentBasedDeduplication": "true"},
+    )["QueueUrl"]
+    cfg = {
+        "queue_url": queue, "output_bucket": cloud.bucket,
+        "algo": "processing_1", "result_queue": cloud.result_queue,
+    }
+    bodies = [
+        {"job_id": "ok-series", "client_id": "c1", "pacs": cloud.SERIES},
+        {"job_id": "ok-image", "client_id": "c1", "pacs": cloud.IMAGE, "output": "seg"},
+        {"job_id": "no-client", "pacs": cloud.IMAGE},  # scartato, resta in coda
+        {"job_id": "bad-scope", "client_id": "c1", "pacs": {**cloud.IMAGE, "scope": "x"}},
+    ]
+    for body in bodies:
+        sqs.send_message(
+            QueueUrl=queue, MessageBody=json.dumps(body), MessageGroupId=body["job_id"]
+        )
+    msgs = sqs.receive_message(QueueUrl=queue, MaxNumberOfMessages=10, VisibilityTimeout=1)
+    assert len(msgs["Messages"]) == len(bodies)
+
+    pipe = pl.JobPipeline(cloud.clients, cfg, lambda msg: job_kwargs(msg, cfg))
+    for msg in msgs["Messages"]:
+        pipe.submit(msg)
+    _wait_idle(pipe, timeout=60)
+
+    results = {m["job_id"]: m for m in cloud.results()}
+    assert set(results) == {"ok-series", "ok-image"}
+    assert results["ok-image"]["format"] == "seg"
+    assert cloud.dcmread(results["ok-series"]["dicom"]["key"]).NumberOfFrames == 6
+    # solo i job riusciti vengono cancellati: gli altri tornano visibili
+    time.sleep(1.1)
+    left = sqs.receive_message(QueueUrl=queue, MaxNumberOfMessages=10)["Messages"]
+    assert sorted(json.loads(m["Body"])["job_id"] for m in left) == ["bad-scope", "no-client"]
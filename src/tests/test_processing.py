@@ -0,0 +1,86 @@
+"""Maschere dei Processor: backend, mediana, batch e streaming equivalenti."""
+
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+import pytest
+
+import medical_image_processing.processing  # noqa: F401 - registra gli algoritmi
+from medical_image_processing.processing.base import Processor
+from medical_image_processing.utils.dicom_io import iter_series, load_series, stack_series
+
+PER_SLICE = ["processing_1", "processing_6"]
+
+
+def _proc(algo: str, **attrs) -> Processor:
+    proc = Processor.factory(algo)
+    for k, v in attrs.items():
+        setattr(proc, k, v)
+    return proc
+
+
+@pytest.mark.parametrize("algo", PER_SLICE)
+def test_opencv_backend_masks_identical(slices, algo):
+    ref, cand = _proc(algo, backend="scipy"), _proc(algo, backend="opencv")
+    for img in slices:
+        mask = ref.run(img)["mask"]
+        assert mask.any()  # il fegato sintetico viene trovato
+        np.testing.assert_array_equal(mask, cand.run(img)["mask"])
+
+
+def test_fast_median_masks_identical(slices):
+    exact, fast = _proc("processing_6", median="exact"), _proc("processing_6", median="fast")
+    for img in slices:
+        np.testing.assert_array_equal(exact.run(img)["mask"], fast.run(img)["mask"])
+
+
+@pytest.mark.parametrize("algo", PER_SLICE)
+def test_run_batch_matches_run(slices, algo):
+    proc = _proc(algo)
+    batch = proc.run_batch(slices)
+    assert len(batch) == len(slices)
+    for img, res in zip(slices, batch):
+        np.testing.assert_array_equal(proc.run(img)["mask"], res["mask"])
+
+
+def test_run_batch_mixed_shapes(slices):
+    proc = _proc("processing_1")
+    imgs = [slices[0], slices[1][:256, :256], slices[2]]
+    for img, res in zip(imgs, proc.run_batch(imgs)):
+        np.testing.assert_array_equal(proc.run(img)["mask"], res["mask"])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("algo", PER_SLICE)
+def test_streamed_matches_loaded(series_paths, algo, workers):
+    proc = _proc(algo)
+    vol, _ = load_series(series_paths, compact=True)
+    loaded = proc.run_volume(vol, workers=1)["mask"]
+
+    # file in ordine di arrivo qualsiasi, come dal download concorrente
+    arrival = series_paths[::2] + series_paths[1::2]
+    frames, headers = [], []
+
+    def arrived():
+        for img, ds in iter_series(arrival):
+            frames.append(img)
+            headers.append(ds)
+            yield img
+
+    cpu_slot = threading.BoundedSemaphore(1)
+    masks = {i: mask for i, mask, _ in proc.run_unordered(arrived(), workers, cpu_slot)}
+    _, _, order = stack_series(frames, headers)
+    np.testing.assert_array_equal(np.stack([masks[i] for i in order]), loaded)
+    # slot restituito a fine serie
+    assert cpu_slot.acquire(blocking=False)
+
+
+def test_unordered_pool_handles_shape_change(slices):
+    # il ring di shared memory si rialloca quando cambiano shape o dtype
+    proc = _proc("processing_1")
+    imgs = [slices[0], slices[1], slices[2][:256, :256], slices[3].astype(np.float32)]
+    masks = {i: mask for i, mask, _ in proc.run_unordered(iter(imgs), workers=2)}
+    for i, img in enumerate(imgs):
+        np.testing.assert_array_equal(masks[i], proc.run(img)["mask"])
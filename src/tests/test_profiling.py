@@ -0,0 +1,64 @@
+"""JobProfile: fasi, profiler già attivo, riepilogo."""
+
+from __future__ import annotations
+
+import cProfile
+import marshal
+
+import pytest
+
+from rsna_pipeline.service import profiling
+
+
+@pytest.fixture
+def profile():
+    prof = profiling.JobProfile.start("j1")
+    assert prof is not None
+    yield prof
+    prof.close()
+
+
+def test_stages_and_summary(profile):
+    assert profiling.JobProfile.start("j2") is None  # un job alla volta
+    with profile.stage("fetch"):
+        sum(range(1000))
+    with profile.stage("compute", snapshot=True):
+        sorted(range(1000), reverse=True)
+    assert list(profile.stages) == ["fetch", "compute"] and profile.profiled
+    text = profile.summary()
+    assert "intero processo" in text and "allocazioni vive" in text
+    assert "sorted" in text
+
+
+def test_other_profiler_active_only_times_stage(profile):
+    other = cProfile.Profile()
+    other.enable()
+    try:
+        with profile.stage("fetch"):
+            sum(range(1000))
+    finally:
+        other.disable()
+    assert profile.unprofiled == {"fetch"} and not profile.profiled
+    assert "nessuna fase profilata" in profile.summary()
+
+
+def test_noop_when_not_profiled():
+    assert profiling.stage(None, "fetch") is profiling.stage(None, "publish")
+
+
+def test_profiled_job_exports_artifacts(cloud):
+    from rsna_pipeline.service.runner import run_job
+
+    run_job(
+        cloud.IMAGE, algo="processing_1", s3_output=cloud.bucket, job_id="j9",
+        client_id="c1", result_queue=cloud.result_queue, clients=cloud.clients, profile=True,
+    )
+    s3 = cloud.clients.s3
+    stats = s3.get_object(Bucket=cloud.bucket, Key="st/se/j9_profile.pstats")["Body"].read()
+    assert any("_run_2d" in fn for _, _, fn in marshal.loads(stats))
+    text = s3.get_object(Bucket=cloud.bucket, Key="st/se/j9_profile.txt")["Body"].read().decode()
+    assert all(stage in text for stage in ("fetch", "compute", "publish"))
+    # profiler di nuovo libero per il job successivo
+    following = profiling.JobProfile.start("j10")
+    assert following is not None
+    following.close()
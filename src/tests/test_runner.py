@@ -0,0 +1,91 @@
+"""Runner end-to-end su moto: result cache, job multi-algoritmo."""
+
+from __future__ import annotations
+
+import pytest
+
+from rsna_pipeline.service.cache import (
+    LocalResultStore,
+    result_cache_key,
+    result_store_from_env,
+)
+from rsna_pipeline.service import runner
+from rsna_pipeline.service.runner import run_job, run_multi_job
+
+FILES = [{"key": "st/se/IM-0001.dcm", "etag": "a"}, {"key": "st/se/IM-0002.dcm", "etag": "b"}]
+
+
+def _run(cloud, pacs=None, **kwargs) -> dict:
+    kwargs.setdefault("algo", "processing_1")
+    return run_job(
+        pacs or cloud.SERIES, s3_output=cloud.bucket, job_id="j1", client_id="c1",
+        result_queue=cloud.result_queue, clients=cloud.clients, **kwargs,
+    )
+
+
+def test_result_cache_key():
+    def key(files=FILES, version="1", **options):
+        return result_cache_key({"scope": "series"}, files, "processing_1", version, {}, **options)
+
+    assert key(output="sc") == key(FILES[::-1], output="sc")  # ordine dei file irrilevante
+    assert key(output="sc") != key(version="2", output="sc")
+    assert key(output="sc") != key(output="seg")
+    # senza ETag il contenuto non è garantito: niente cache
+    assert key([{"key": "k"}]) is None
+
+
+def test_local_store_and_env(tmp_path):
+    store = result_store_from_env(None, "out", f"local:{tmp_path}")
+    assert isinstance(store, LocalResultStore) and store.get("k") is None
+    store.put("k", {"bucket": "out", "key": "a.dcm"})
+    assert store.get("k") == {"bucket": "out", "key": "a.dcm"}
+    assert result_store_from_env(None, "out", "off") is None
+    with pytest.raises(ValueError):
+        result_store_from_env(None, "out", "redis")
+
+
+def test_rerun_is_served_from_result_cache(cloud):
+    first = _run(cloud)
+    assert "cached" not in first
+    again = _run(cloud)
+    assert again["cached"] and again["dicom"]["key"] == first["dicom"]["key"]
+    # altre opzioni di output: altro risultato
+    seg = _run(cloud, output="seg")
+    assert "cached" not in seg and seg["dicom"]["key"] != first["dicom"]["key"]
+    assert [m.get("cached", False) for m in cloud.results()] == [False, True, False]
+
+
+def test_overwritten_output_is_not_a_hit(cloud):
+    first = _run(cloud, pacs=cloud.IMAGE)
+    cloud.clients.s3.put_object(Bucket=cloud.bucket, Key=first["dicom"]["key"], Body=b"altro")
+    again = _run(cloud, pacs=cloud.IMAGE)
+    assert "cached" not in again
+    assert cloud.dcmread(again["dicom"]["key"]).Rows == 512
+
+
+def test_multi_algo_fetches_once(cloud, monkeypatch):
+    calls = []
+    presign = runner._get_presigned_from_pacs
+    monkeypatch.setattr(
+        runner, "_get_presigned_from_pacs", lambda *a: calls.append(1) or presign(*a)
+    )
+
+    def multi(algos):
+        return run_multi_job(
+            cloud.SERIES, algos=algos, s3_output=cloud.bucket, job_id="j1", client_id="c1",
+            result_queue=cloud.result_queue, clients=cloud.clients,
+        )
+
+    msgs = multi(["processing_1", "processing_6"])
+    assert len(calls) == 1  # input scaricato una volta per tutti gli algoritmi
+    assert [m["algo_id"] for m in msgs] == ["processing_1", "processing_6"]
+    assert len({m["dicom"]["key"] for m in msgs}) == 2
+    for m in msgs:
+        assert cloud.dcmread(m["dicom"]["key"]).NumberOfFrames == 6
+
+    # solo l'algoritmo nuovo viene calcolato, l'altro arriva dalla result cache
+    msgs = multi(["processing_7", "processing_1"])
+    assert [m.get("cached", False) for m in msgs] == [False, True]
+    # i risultati in cache vengono notificati subito, prima del calcolo
+    sent = [m["algo_id"] for m in cloud.results()]
+    assert sent == ["processing_1", "processing_6", "processing_1", "processing_7"]
@@ -0,0 +1,119 @@
+"""Telemetria: log JSON per livello, span, metriche EMF e tracing end-to-end."""
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from rsna_pipeline.service import telemetry
+
+
+@pytest.fixture
+def sink(tmp_path, monkeypatch):
+    """Metriche e log in un file locale; restituisce la funzione che lo rilegge."""
+    path = tmp_path / "telemetry.jsonl"
+    local = telemetry.Sink(f"local:{path}")
+    monkeypatch.setattr(telemetry, "SINK", local)
+    monkeypatch.setattr(telemetry, "_LOG_SINK", local)
+    monkeypatch.setattr(telemetry, "LOG_LEVEL", telemetry.LEVELS["INFO"])
+
+    def read() -> list[dict]:
+        return [json.loads(line) for line in path.read_text().splitlines()]
+
+    read.path = str(path)
+    return read
+
+
+def test_log_levels_and_job_context(sink):
+    telemetry.log("DEBUG", "scartato")
+    trace = telemetry.Trace("j1", ["processing_1"], trace_id="t1")
+    with telemetry.activate(trace), telemetry.span("process", "processing_1"):
+        telemetry.log("WARNING", "dentro", extra=1)
+    telemetry.log("ERROR", "fuori")
+    docs = sink()
+    assert [d["msg"] for d in docs] == ["dentro", "fuori"]
+    assert docs[0]["level"] == "WARNING" and docs[0]["extra"] == 1
+    assert (docs[0]["job_id"], docs[0]["trace_id"], docs[0]["algo"]) == ("j1", "t1", "processing_1")
+    assert "job_id" not in docs[1]
+    assert telemetry.enabled("ERROR") and not telemetry.enabled("DEBUG")
+
+
+def test_trace_emits_emf_per_algo(sink):
+    trace = telemetry.Trace("j1", ["processing_1", "processing_6"], sampled=True)
+    with telemetry.activate(trace):
+        telemetry.record("download", 0.010)  # fase condivisa
+        for algo in trace.algos:
+            with telemetry.span("process", algo):
+                telemetry.record("process.ccl", 0.002)  # passo interno del Processor
+                telemetry.record("process.ccl", 0.003)
+    trace.finish(True, cache_hits=0)
+    trace.finish(False)  # una volta sola
+    docs = sink()
+    assert [d["Algo"] for d in docs] == ["processing_1", "processing_6"]
+    for doc in docs:
+        names = {m["Name"] for m in doc["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+        assert {"job_ms", "jobs", "errors", "download_ms", "process_ms", "process.ccl_ms"} <= names
+        assert doc["download_ms"] == 10.0 and doc["process.ccl_ms"] == 5.0
+        assert doc["process.ccl_count"] == 2 and doc["errors"] == 0 and doc["cache_hits"] == 0
+    summary = telemetry.summarize(sink.path)
+    assert summary["processing_6"]["download_ms"]["n"] == 1
+
+
+def test_unsampled_trace_keeps_only_job_metrics(sink):
+    trace = telemetry.Trace("j1", ["processing_1"], sampled=False)
+    with telemetry.activate(trace):
+        with telemetry.span("download"):
+            pass
+    trace.finish(False)
+    (doc,) = sink()
+    assert doc["errors"] == 1 and "download_ms" not in doc
+
+
+def test_runner_job_reports_stage_spans(sink, cloud):
+    from rsna_pipeline.service.runner import run_job
+
+    run_job(
+        cloud.SERIES, algo="processing_1", s3_output=cloud.bucket, job_id="j1",
+        client_id="c1", result_queue=cloud.result_queue, clients=cloud.clients,
+    )
+    (emf,) = [d for d in sink() if "_aws" in d]
+    # serie in streaming: decode e process avvengono dentro "stream"
+    for name in ("presign", "download", "stream", "encode", "upload", "notify"):
+        assert emf[f"{name}_ms"] >= 0, name
+    assert emf["process.threshold_ms"] > 0 and emf["job_id"] == "j1"
+
+
+def test_invalid_sink():
+    with pytest.raises(ValueError):
+        telemetry.Sink("kafka")
+
+
+def test_stamp_copies_timing():
+    timing = {"enqueued": 1}
+    stamped = telemetry.stamp(timing, "received")
+    assert timing == {"enqueued": 1} and stamped["received"] >= stamped["enqueued"]
+    assert set(telemetry.stamp(None, "published")) == {"published"}
+
+
+def test_trace_id_and_timing_reach_result_message(sink, cloud):
+    from rsna_pipeline.service.worker import job_kwargs
+    from rsna_pipeline.service.runner import run_multi_job
+
+    cfg = {"output_bucket": cloud.bucket, "algo": "processing_1"}
+    cfg["result_queue"] = cloud.result_queue
+    body = {"job_id": "j0", "client_id": "c1", "pacs": cloud.IMAGE}
+    # senza trace_id dal router si usa il job_id
+    assert job_kwargs({"Body": json.dumps(body)}, cfg)["trace_id"] == "j0"
+
+    body.update(job_id="j1", trace_id="t-123", timing=telemetry.stamp(None, "enqueued"))
+    kwargs = job_kwargs({"Body": json.dumps(body)}, cfg)
+    (msg,) = run_multi_job(clients=cloud.clients, **kwargs)
+    assert msg["trace_id"] == "t-123"
+    timing = msg["timing"]
+    assert timing["enqueued"] <= timing["received"] <= timing["published"]
+    assert cloud.results() == [msg]
+    # stesso trace_id nei log e nelle metriche del job
+    docs = [d for d in sink() if d.get("job_id") == "j1"]
+    assert docs and all(d["trace_id"] == "t-123" for d in docs)
+    assert any("_aws" in d for d in docs)
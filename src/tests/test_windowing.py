@@ -0,0 +1,41 @@
+"""LUT di ``apply_window`` vs la formula float32 usata dai Processor."""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from medical_image_processing.utils.windowing import apply_window
+
+WINDOWS = [(30, 150), (-7, 248), (-1000, 1000), (0.5, 200.25)]
+
+
+def _reference(img: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    return ((np.clip(img, lo, hi).astype(np.float32) - lo) / (hi - lo) * 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("lo,hi", WINDOWS)
+def test_lut_matches_float_formula_on_all_int16(lo, hi):
+    hu = np.arange(-(1 << 15), 1 << 15, dtype=np.int32).astype(np.int16)
+    np.testing.assert_array_equal(apply_window(hu, lo, hi), _reference(hu, lo, hi))
+
+
+@pytest.mark.parametrize("lo,hi", WINDOWS)
+def test_float_input_matches_formula(slices, lo, hi):
+    img = slices[0].astype(np.float32) * np.float32(0.5)
+    np.testing.assert_array_equal(apply_window(img, lo, hi), _reference(img, lo, hi))
+
+
+def test_out_buffer_and_volume(slices):
+    vol = np.stack(slices)
+    out = np.zeros(vol.shape, np.uint8)
+    assert apply_window(vol, 30, 150, out=out) is out
+    for img, o in zip(slices, out):
+        np.testing.assert_array_equal(o, _reference(img, 30, 150))
+
+
+def test_rejects_bad_window_and_buffer(slices):
+    with pytest.raises(ValueError):
+        apply_window(slices[0], 100, 100)
+    with pytest.raises(ValueError):
+        apply_window(slices[0], 0, 100, out=np.empty((3, 3), np.uint8))